@@ -0,0 +1,235 @@
+# coding: utf-8
+
+"""
+Offline benchmarks of ryanscan, run against a synthetic network and backend.
+
+Usage:
+    run.py [--scenario=<name>...] [--repeat=<n>] [--output=<file>] [--compare=<file>]
+    run.py --list
+
+Options:
+    --scenario=<name>   Only run the given scenario(s)
+    --repeat=<n>        Times each measurement is repeated [default: 3]
+    --output=<file>     Write the results as JSON to this file
+    --compare=<file>    Print the change against results written by a previous run
+    --list              List the available scenarios
+
+Example, from the repository root:
+    PYTHONPATH=src python benchmarks/run.py --output=results.json
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import io
+import json
+import platform
+import sys
+import time
+from datetime import date
+from datetime import timedelta
+
+from docopt import docopt
+
+from ryanscan import core
+from ryanscan import transport
+from ryanscan import vectorized
+
+import synthetic
+
+
+scenarios = [
+    dict(name='1x1-week-direct', origs=1, dests=1, days=7, max_flights=1),
+    dict(name='1x1-month-2hops', origs=1, dests=1, days=30, max_flights=2),
+    dict(name='5x5-week-2hops', origs=5, dests=5, days=7, max_flights=2),
+    dict(name='5x5-month-2hops', origs=5, dests=5, days=30, max_flights=2),
+    dict(name='3x3-week-3hops', origs=3, dests=3, days=7, max_flights=3),
+    dict(name='10x10-week-2hops', origs=10, dests=10, days=7, max_flights=2),
+    dict(name='10x10-month-3hops', origs=10, dests=10, days=30, max_flights=3),
+    dict(name='5x5-week-2hops-round', origs=5, dests=5, days=7, max_flights=2, back_days=7),
+]
+
+airports = 300
+hubs = 12
+seed = 0
+start = date(2030, 1, 1)
+
+
+def run_scenario(scenario, network, repeat):
+    # Origins are taken from the spokes, so that connections go through hubs
+    origs = sorted(network)[hubs:][:scenario['origs']]
+    dests = pick_destinations(network, origs, scenario['dests'], scenario['max_flights'])
+    dates_to = core.DateInterval(start, start + timedelta(days=scenario['days'] - 1))
+    dates_back = core.DateInterval(None, None)
+
+    if scenario.get('back_days'):
+        dates_back = core.DateInterval(dates_to.end + timedelta(days=1), dates_to.end + timedelta(days=scenario['back_days']))
+
+    paths, find_paths_time = measure(repeat, lambda: list(core.find_paths(origs, dests, network, scenario['max_flights'])))
+    _, find_paths_bidirectional_time = measure(
+        repeat,
+        lambda: list(core.find_paths_bidirectional(origs, dests, network, scenario['max_flights'])),
+    )
+
+    date_constraint = core.make_date_constraint(dates_to)
+    session = synthetic.SyntheticSession(seed)
+    previous = transport.set_transport(transport.Transport(session=session))
+
+    try:
+        solutions, scan_time = measure(repeat, lambda: core.scan(
+            origs,
+            dests,
+            dates_to.start,
+            dates_to.end,
+            earliest_back=dates_back.start,
+            latest_back=dates_back.end,
+            max_flights=scenario['max_flights'],
+            concurrency=1,
+            get_network=lambda: network,
+        ))
+        requests = session.calls // repeat
+
+        # Fetched as scans fetch them
+        flight_store = core.fetch_flight_store(
+            core.get_edge_dates(paths, dates_to),
+            date_constraint,
+            concurrency=1,
+        )
+
+    finally:
+        transport.set_transport(previous)
+
+    join_times = {}
+
+    for engine in ['python', 'auto'] if vectorized.available else ['python']:
+        _, join_times[engine] = measure(repeat, lambda: [
+            s for path in paths for s in core.get_path_solutions(path, flight_store, date_constraint, engine=engine)
+        ])
+
+    return {
+        'name': scenario['name'],
+        'params': scenario,
+        'counts': {
+            'paths': len(paths),
+            'requests': requests,
+            'flights': len(flight_store),
+            'solutions': len(solutions),
+        },
+        'seconds': {
+            'find_paths': find_paths_time,
+            'find_paths_bidirectional': find_paths_bidirectional_time,
+            'get_path_solutions': join_times['python'],
+            'get_path_solutions_auto': join_times.get('auto'),
+            'scan': scan_time,
+        },
+    }
+
+
+def pick_destinations(network, origs, amount, max_flights):
+    """
+    Returns `amount` airports spread over those that are exactly `max_flights` flights
+    away from the origins (or as close to that as possible)
+
+    """
+    distances = {orig: 0 for orig in origs}
+    frontier = set(origs)
+    distance = 0
+
+    while frontier and distance < max_flights:
+        distance += 1
+        frontier = {dest for node in frontier for dest in network[node] if dest not in distances}
+        distances.update((node, distance) for node in frontier)
+
+    candidates = sorted(
+        (node for node, distance in distances.items() if distance),
+        key=lambda node: (-distances[node], node),
+    )[:amount * 5]
+
+    return sorted(candidates[::max(1, len(candidates) // amount)][:amount])
+
+
+def measure(repeat, func):
+    """
+    Returns the result of calling `func` and the best wall time of `repeat` calls
+
+    """
+    times = []
+
+    for _ in range(repeat):
+        start_time = time.time()
+        result = func()
+        times.append(time.time() - start_time)
+
+    return result, min(times)
+
+
+def print_comparison(results, baseline):
+    baseline = {r['name']: r for r in baseline['scenarios']}
+
+    for result in results['scenarios']:
+        old = baseline.get(result['name'])
+
+        if old is None:
+            continue
+
+        for phase, seconds in sorted(result['seconds'].items()):
+            old_seconds = old['seconds'].get(phase)
+
+            if not old_seconds:
+                continue
+
+            print('%-20s %-26s %8.4fs -> %8.4fs (%+.1f%%)' % (
+                result['name'],
+                phase,
+                old_seconds,
+                seconds,
+                100 * (seconds - old_seconds) / old_seconds,
+            ))
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv)
+
+    if args['--list']:
+        for scenario in scenarios:
+            print(scenario['name'])
+
+        return 0
+
+    selected = [s for s in scenarios if not args['--scenario'] or s['name'] in args['--scenario']]
+    network = core.get_connections_from_stations_data(synthetic.make_stations_data(airports, hubs, seed))
+    repeat = int(args['--repeat'])
+
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'repeat': repeat,
+        'scenarios': [],
+    }
+
+    for scenario in selected:
+        result = run_scenario(scenario, network, repeat)
+        results['scenarios'].append(result)
+
+        print('%-20s scan: %.4fs, %s' % (
+            scenario['name'],
+            result['seconds']['scan'],
+            ', '.join('%s=%s' % item for item in sorted(result['counts'].items())),
+        ), file=sys.stderr)
+
+    if args['--output']:
+        with io.open(args['--output'], 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args['--compare']:
+        with io.open(args['--compare'], encoding='utf-8') as f:
+            print_comparison(results, json.load(f))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+# coding: utf-8
+
+"""
+Startup time of the ryanscan CLI, checked against a budget. Exits with status 1
+when a measurement exceeds its budget.
+
+Measurements, in seconds:
+    import      Cumulative import time of ryanscan.__main__ (python -X importtime)
+    help        Wall time of "ryanscan --help", minus that of an empty interpreter
+    usage       Wall time of a command failing to parse, minus that of an empty interpreter
+
+Usage:
+    startup.py [--repeat=<n>] [--output=<file>]
+
+Options:
+    --repeat=<n>        Times each measurement is repeated [default: 10]
+    --output=<file>     Write the results as JSON to this file
+
+Example, from the repository root:
+    PYTHONPATH=src python benchmarks/startup.py
+
+The bytecode of ryanscan is compiled first: otherwise, with PYTHONDONTWRITEBYTECODE
+set, every run would measure the compilation of the sources.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import compileall
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from docopt import docopt
+
+import ryanscan
+
+
+# Seconds. Raise them only knowingly: the CLI is called thousands of times from scripts
+budgets = {
+    'import': 0.030,
+    'help': 0.050,
+    'usage': 0.050,
+}
+
+
+def main(argv=None):
+    args = docopt(__doc__, argv)
+    repeat = int(args['--repeat'])
+
+    compileall.compile_dir(os.path.dirname(ryanscan.__file__), quiet=1)
+
+    empty = measure(repeat, [sys.executable, '-c', 'pass'])
+    seconds = {
+        'import': min(get_import_time('ryanscan.__main__') for _ in range(repeat)),
+        'help': measure(repeat, [sys.executable, '-m', 'ryanscan', '--help']) - empty,
+        'usage': measure(repeat, [sys.executable, '-m', 'ryanscan', 'find-flights']) - empty,
+    }
+
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'repeat': repeat,
+        'seconds': seconds,
+        'budgets': budgets,
+    }
+
+    if args['--output']:
+        with io.open(args['--output'], 'w', encoding='utf-8') as f:
+            f.write(json.dumps(results, indent=2, sort_keys=True))
+
+    else:
+        print(json.dumps(results, indent=2, sort_keys=True))
+
+    over_budget = sorted(name for name, value in seconds.items() if value > budgets[name])
+
+    for name in over_budget:
+        print('%s: %.4fs over the budget of %.4fs' % (name, seconds[name], budgets[name]), file=sys.stderr)
+
+    return 1 if over_budget else 0
+
+
+def measure(repeat, command):
+    """
+    Returns the best wall time of `repeat` runs of `command`, after a first one
+    warming the caches up
+
+    """
+    times = []
+
+    with io.open(os.devnull, 'wb') as devnull:
+        for _ in range(repeat + 1):
+            start_time = time.time()
+            subprocess.call(command, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start_time)
+
+    return min(times[1:])
+
+
+def get_import_time(module):
+    """
+    Returns the seconds taken by importing `module` and its dependencies in a new
+    interpreter. Needs Python 3.7 or newer
+
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+        stderr=subprocess.STDOUT,
+    )
+
+    for line in output.decode('utf-8').splitlines():
+        _, _, cumulative, name = [part.strip() for part in line.replace(':', '|', 1).split('|')]
+
+        if name == module:
+            return int(cumulative) / 1e6
+
+    raise ValueError('%s not found in the output of -X importtime' % module)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
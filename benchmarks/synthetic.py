@@ -0,0 +1,156 @@
+# coding: utf-8
+
+"""
+Seeded generators of fake backend data, so that ryanscan can be benchmarked
+without network access. Everything generated is a pure function of the seed
+and the arguments.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import itertools
+import json
+import random
+import string
+import zlib
+from datetime import datetime
+from datetime import timedelta
+
+
+def make_iata_codes(amount):
+    return [''.join(letters) for letters in itertools.islice(itertools.product(string.ascii_uppercase, repeat=3), amount)]
+
+
+def make_stations_data(airports=300, hubs=12, seed=0):
+    """
+    Returns a payload with the shape of the aggregated airports data of the backend,
+    describing a hub-and-spoke network: hubs are densely connected among them, and
+    every other airport connects to a few hubs and a few neighbouring airports.
+
+    """
+    rnd = random.Random(seed)
+    codes = make_iata_codes(airports)
+    hub_codes, spoke_codes = codes[:hubs], codes[hubs:]
+    routes = {code: set() for code in codes}
+
+    def connect(a, b):
+        routes[a].add(b)
+        routes[b].add(a)
+
+    for a, b in itertools.combinations(hub_codes, 2):
+        if rnd.random() < 0.8:
+            connect(a, b)
+
+    for code in spoke_codes:
+        for hub in rnd.sample(hub_codes, min(len(hub_codes), rnd.randint(1, 4))):
+            connect(code, hub)
+
+        for other in rnd.sample(spoke_codes, min(len(spoke_codes), rnd.randint(0, 3))):
+            if other != code:
+                connect(code, other)
+
+    return {
+        'airports': [
+            {
+                'iataCode': code,
+                'name': 'Airport %s' % code,
+                'routes': ['airport:%s' % dest for dest in sorted(routes[code])] + ['country:xx'],
+            }
+            for code in codes
+        ]
+    }
+
+
+def make_availability_data(orig, dest, date_out, flex_days_out=6, seed=0, flights_per_day=(0, 4)):
+    """
+    Returns a payload with the shape of the backend availability response for the
+    given edge and dates. The same edge and day always get the same flights,
+    whatever the window they are requested in.
+
+    :param datetime.date date_out: first day of the window
+    :param int flex_days_out: amount of days after `date_out` also included
+
+    """
+    dates = []
+
+    for day in range(flex_days_out + 1):
+        date = date_out + timedelta(days=day)
+        rnd = random.Random(zlib.crc32(('%s:%s:%s:%s' % (seed, orig, dest, date.isoformat())).encode('ascii')))
+        flights = []
+
+        for n in range(rnd.randint(*flights_per_day)):
+            departure = datetime.combine(date, datetime.min.time()) + timedelta(minutes=5 * rnd.randint(72, 276))
+            arrival = departure + timedelta(minutes=5 * rnd.randint(9, 48))
+            amount = rnd.randint(999, 29999) / 100
+            fare = {'fares': [{'amount': amount}]}
+
+            flights.append({
+                'time': [format_date(departure), format_date(arrival)],
+                'faresLeft': rnd.choice([-1, 0, 1, 2, 5]),
+                'flightNumber': 'FR %s' % rnd.randint(1000, 9999),
+                'regularFare': fare if rnd.random() < 0.9 else None,
+                'leisureFare': fare,
+            })
+
+        flights.sort(key=lambda f: f['time'][0])
+        dates.append({'dateOut': format_date(datetime.combine(date, datetime.min.time())), 'flights': flights})
+
+    return {
+        'currency': 'EUR',
+        'trips': [{'origin': orig, 'destination': dest, 'dates': dates}],
+    }
+
+
+def format_date(date):
+    return date.strftime('%Y-%m-%dT%H:%M:%S.000')
+
+
+class SyntheticSession(object):
+    """
+    Drop-in replacement of `requests.Session` for `ryanscan.transport.Transport`,
+    answering availability requests with generated data
+
+    """
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.calls = 0
+
+    def get(self, url, params=None, **kwargs):
+        self.calls += 1
+
+        data = make_availability_data(
+            params['Origin'],
+            params['Destination'],
+            datetime.strptime(params['DateOut'], '%Y-%m-%d').date(),
+            int(params['FlexDaysOut']),
+            seed=self.seed,
+        )
+
+        if params.get('RoundTrip') == 'true':
+            data['trips'].extend(make_availability_data(
+                params['Destination'],
+                params['Origin'],
+                datetime.strptime(params['DateIn'], '%Y-%m-%d').date(),
+                int(params['FlexDaysIn']),
+                seed=self.seed,
+            )['trips'])
+
+        return SyntheticResponse(data)
+
+
+class SyntheticResponse(object):
+
+    status_code = 200
+    ok = True
+
+    def __init__(self, data):
+        self.content = json.dumps(data).encode('utf-8')
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
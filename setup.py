@@ -44,6 +44,8 @@ setup(
         'docopt',
     ],
     extras_require={
+        'numpy': ['numpy'],
+        'orjson': ['orjson'],
     },
     entry_points={
         'console_scripts': [
@@ -6,8 +6,12 @@ IMPORTANT: By using this programme you agree to the Terms of Use
 of the Ryanair Website: https://www.ryanair.com/gb/en/corporate/terms-of-use
 
 Usage:
-    ryanscan find-airports [<terms>...]
-    ryanscan find-flights <origins> <destinations> <earliest-to> <latest-to> [--max-flights=<max>] [--json]
+    ryanscan find-airports [<terms>...] [--server=<address>] [options]
+    ryanscan find-flights <origins> <destinations> <earliest-to> <latest-to> [<earliest-back> <latest-back>] [--server=<address>] [options]
+    ryanscan batch <queries-file> [--output-dir=<dir>] [options]
+    ryanscan watch <origins> <destinations> <earliest-to> <latest-to> [<earliest-back> <latest-back>] [--interval=<sec>] [options]
+    ryanscan serve [--port=<port> | --socket=<path>] [options]
+    ryanscan refresh-network
 
 Commands:
     find-airports       Output the list of all Ryanair airports with
@@ -28,9 +32,87 @@ Commands:
                         Example:
                             ryanscan find-flights BRE,HAM MAD,VLC 2016-10-10 2016-10-29
 
+                        If earliest and latest dates for the return are
+                        also given, round trips back to the same origin
+                        are searched instead.
+
+                        Example:
+                            ryanscan find-flights BRE MAD 2016-10-10 2016-10-12 2016-10-15 2016-10-20
+
+    batch               Run all the searches described in a JSON or CSV
+                        file, fetching the flights they have in common
+                        only once. Every search has the fields: id,
+                        origins, destinations, earliest_to, latest_to
+                        and optionally earliest_back, latest_back,
+                        max_flights, top, min_stay and max_stay. The
+                        results of every search are written as a JSON
+                        line to stdout, or to <id>.json in the
+                        directory given with --output-dir.
+
+                        Example:
+                            ryanscan batch searches.csv --output-dir=results
+
+    watch               Run the same search as find-flights once per
+                        interval, and output only the solutions that
+                        are new (+), gone (-) or have a different price
+                        (~) since the previous scan. Fares younger than
+                        the cache TTL are not requested again.
+
+                        Example:
+                            ryanscan watch BRE MAD 2016-10-10 2016-10-29 --interval=600 --cache-ttl=600
+
+    serve               Answer find-flights and find-airports requests
+                        sent with --server (or to its JSON API), keeping
+                        the network, the airports and the fares found in
+                        the last --cache-ttl seconds in memory, so that
+                        repeated searches are answered much faster.
+                        Listens on 127.0.0.1 only.
+
+                        Example:
+                            ryanscan serve --port=8642
+                            ryanscan find-flights BRE MAD 2016-10-10 2016-10-12 --server=http://127.0.0.1:8642
+
+    refresh-network     Download the route network and the airports list
+                        again, regardless of how old the local copy is.
+                        They are otherwise refreshed once a day.
+
 Options:
     --json                      Output results as JSON string to stdout
+    --ndjson                    Output each result as a JSON line to stdout as
+                                soon as it is found
     -m --max-flights=<max>      Maximum flights to reach destination [default: 1]
+    -c --concurrency=<n>        Maximum simultaneous requests to the backend. Fewer
+                                are made while it throttles them [default: 4]
+    --top=<n>                   Only output the <n> cheapest solutions
+    --lazy                      Request connecting flights only for the dates
+                                where the previous flights arrive. Fewer
+                                requests, but slower for short searches. Not
+                                for round trips nor with --top
+    --min-stay=<days>           Minimum days at the destination on round trips [default: 0]
+    --max-stay=<days>           Maximum days at the destination on round trips
+    --engine=<name>             How flights are joined into solutions: python,
+                                numpy (needs NumPy installed) or auto [default: auto]
+    --sort=<key>                Order of the solutions: date_out, price, duration or
+                                layovers. Defaults to price, or date_out with --json
+    --max-memory=<mb>           Megabytes of solutions kept in memory. Beyond them,
+                                they are sorted in temporary files [default: 512]
+    --processes=<n>             Join flights into solutions in <n> processes. Worth
+                                it for wide searches with many connections [default: 1]
+    --output-dir=<dir>          Write the results of every search of a batch
+                                to <dir>/<id>.json
+    --interval=<sec>            Seconds between the scans of watch [default: 300]
+    --port=<port>               Port where the server listens [default: 8642]
+    --socket=<path>             Make the server listen on a Unix socket instead
+    --server=<address>          Send the search to a running server, given by its
+                                URL (http://host:port) or its Unix socket
+                                (unix:/path/to/socket)
+    --profile                   Print timings and counters of the scan to stderr
+    --no-cache                  Do not use the local cache of fares and network
+    --record=<file>             Write every response of the backend to an archive
+                                file. The local cache is not used
+    --replay=<file>             Answer the requests with the responses of an archive
+                                written with --record, without network
+    --cache-ttl=<sec>           Seconds before cached fares are queried again [default: 900]
 
 """
 
@@ -40,14 +122,19 @@ import sys
 import os
 import json
 import io
-import traceback
-import tempfile
-from docopt import docopt
-from datetime import datetime
-from decimal import Decimal
+import time
 
+# Only what every command needs is imported here, the rest is imported by the
+# commands using it: the CLI may be called thousands of times from scripts
 from . import core
+from . import sorting
 from . import tools
+from .cache import DiskCache
+from .cache import std_ttl
+from .models import make_jsonizable
+from .stats import null_stats
+from .stats import Stats
+from .usage import parse_args
 
 try:
     input = raw_input
@@ -55,48 +142,248 @@ except NameError:
     pass
 
 
-def find(origins, destinations, earliest_to, latest_to, max_flights, as_json=False):
+def find(
+    origins,
+    destinations,
+    earliest_to,
+    latest_to,
+    max_flights,
+    earliest_back=None,
+    latest_back=None,
+    concurrency=core.std_concurrency,
+    cache=None,
+    top_k=None,
+    lazy=False,
+    min_stay=0,
+    max_stay=None,
+    engine=core.std_join_engine,
+    stats=null_stats,
+    as_json=False,
+    as_ndjson=False,
+    server_address=None,
+    processes=None,
+    sort_key=None,
+    max_memory=sorting.std_max_memory,
+):
+    sort_key = sort_key or ('date_out' if as_json else 'price')
+
+    if sort_key not in sorting.sort_keys:
+        raise core.AppError('Unknown sort key: %s' % sort_key, 'Use one of: %s' % ', '.join(sorted(sorting.sort_keys)))
+
+    core.check_lazy(lazy, top_k, earliest_back)
+
+    if server_address is not None:
+        if processes and processes > 1:
+            raise core.AppError('--processes cannot be used with --server', 'The server joins the flights itself')
+
+        spec = dict(
+            origins=origins,
+            destinations=destinations,
+            earliest_to=earliest_to.isoformat(),
+            latest_to=latest_to.isoformat(),
+            earliest_back=earliest_back.isoformat() if earliest_back else None,
+            latest_back=latest_back.isoformat() if latest_back else None,
+            max_flights=max_flights,
+            top=top_k,
+            min_stay=min_stay,
+            max_stay=max_stay,
+            lazy=lazy,
+        )
+
+        from . import server
+
+        solutions = server.Client(server_address).find_flights(spec)
+
+        if as_ndjson:
+            for s in solutions:
+                print(json.dumps(make_jsonizable(s)))
+                sys.stdout.flush()
 
-    solutions = core.scan(
+            return
+
+        render_solutions(sorting.sort_solutions(solutions, sort_key, max_memory), as_json)
+        return
+
+    scan_args = dict(
         origs=origins,
         dests=destinations,
         earliest_to=earliest_to,
         latest_to=latest_to,
+        earliest_back=earliest_back,
+        latest_back=latest_back,
         max_flights=max_flights,
+        concurrency=concurrency,
+        cache=cache,
+        top_k=top_k,
+        lazy=lazy,
+        min_stay=min_stay,
+        max_stay=max_stay,
+        engine=engine,
+        stats=stats,
+        processes=processes,
     )
 
+    if as_ndjson:
+        for s in core.scan_iter(**scan_args):
+            print(json.dumps(make_jsonizable(s)))
+            sys.stdout.flush()
+
+        return
+
+    render_solutions(sorting.sort_solutions(core.scan_iter(**scan_args), sort_key, max_memory), as_json)
+
+
+def render_solutions(solutions, as_json=False):
+    """
+    Outputs the solutions in the order they come, without holding them all in memory
+
+    """
     if as_json:
-        json.dump(make_jsonizable(solutions), fp=sys.stdout)
+        # Same output as json.dump of the whole list
+        sys.stdout.write('[')
+
+        for idx, s in enumerate(solutions):
+            sys.stdout.write('%s%s' % (', ' if idx else '', json.dumps(make_jsonizable(s))))
+
+        sys.stdout.write(']')
         return
 
-    if not solutions:
-        print('No flights found')
+    found = False
+
+    for s in solutions:
+        found = True
+
+        if isinstance(s, core.RoundTripSolution):
+            render_round_trip_solution(s)
+            continue
 
-    for s in sorted(solutions, key=lambda s: s.price):
         if len(s.flights) == 1:
             render_single_flight_solution(s)
             continue
 
         render_multiflight_solution(s)
 
+    if not found:
+        print('No flights found')
+
+
+def batch(
+    path,
+    max_flights,
+    output_dir=None,
+    concurrency=core.std_concurrency,
+    cache=None,
+    engine=core.std_join_engine,
+    stats=null_stats,
+    processes=None,
+):
+    ids, queries = read_queries(path, max_flights)
+    results = core.scan_many(queries, concurrency=concurrency, cache=cache, engine=engine, stats=stats, processes=processes)
+
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    for query_id, solutions in zip(ids, results):
+        if not output_dir:
+            print(json.dumps({'id': query_id, 'solutions': make_jsonizable(solutions)}))
+            continue
+
+        with io.open(os.path.join(output_dir, '%s.json' % query_id), 'w', encoding='utf-8') as f:
+            f.write(json.dumps(make_jsonizable(solutions), ensure_ascii=False))
+
 
-def make_jsonizable(obj):
-    if isinstance(obj, list):
-        return [make_jsonizable(o) for o in obj]
+def watch(query, interval, concurrency=core.std_concurrency, cache=None, engine=core.std_join_engine, as_json=False):
+    from .watch import Watcher
 
-    if isinstance(obj, datetime):
-        return obj.isoformat()
+    watcher = Watcher(query, concurrency=concurrency, cache=cache, engine=engine)
 
-    if isinstance(obj, Decimal):
-        return float(obj)
+    try:
+        while True:
+            started = time.time()
+
+            try:
+                render_changes(watcher.poll(), as_json)
+
+            except core.AppError as exc:
+                # The next scan may work, and compares against the last successful one
+                tools.log_info('Error - %s' % exc.msg)
+
+            time.sleep(max(0, interval - (time.time() - started)))
 
-    if isinstance(obj, (core.Solution, core.Flight)):
-        obj = obj._asdict()
+    except KeyboardInterrupt:
+        pass
 
-    if isinstance(obj, dict):
-        obj = {k: make_jsonizable(v) for k, v in obj.items()}
 
-    return obj
+def render_changes(changes, as_json=False):
+    if as_json:
+        print(json.dumps({
+            'added': make_jsonizable(changes.added),
+            'removed': make_jsonizable(changes.removed),
+            'repriced': [{'old': make_jsonizable(old), 'new': make_jsonizable(new)} for old, new in changes.repriced],
+        }))
+        sys.stdout.flush()
+        return
+
+    if not any(changes):
+        tools.log_info('No changes')
+        return
+
+    for s in changes.added:
+        print('+ %s' % format_solution(s))
+
+    for s in changes.removed:
+        print('- %s' % format_solution(s))
+
+    for old, new in changes.repriced:
+        print('~ %s (was %.2f EUR)' % (format_solution(new), old.price))
+
+    sys.stdout.flush()
+
+
+def format_solution(sol):
+    route = '{s.orig} > {s.dest} > {s.orig}' if isinstance(sol, core.RoundTripSolution) else '{s.orig} > {s.dest}'
+
+    return (route + ' | {dates} | {numbers} | {s.price:>7.2f} EUR').format(
+        s=sol,
+        dates=format_date_pair(sol.date_out, sol.date_in),
+        numbers=', '.join(f.flight_number for f in sol.flights),
+    )
+
+
+def read_queries(path, max_flights):
+    """
+    Reads the searches of a JSON (list of objects) or CSV (with header) file
+
+    Ids name the result files of the searches, so they must be unique and cannot
+    contain path separators.
+
+    :param int max_flights: for searches that do not set it
+    :returns: the ids of the searches, and their arguments for `core.scan_many`
+
+    """
+    with io.open(path, encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            import csv
+
+            specs = list(csv.DictReader(f))
+
+        else:
+            specs = json.load(f)
+
+    ids = ['%s' % (spec.get('id') or idx) for idx, spec in enumerate(specs, start=1)]
+
+    seen = set()
+
+    for query_id in ids:
+        if '/' in query_id or '\\' in query_id:
+            raise core.AppError('Invalid search id: %s' % query_id, 'Ids cannot contain path separators')
+
+        if query_id in seen:
+            raise core.AppError('Duplicate search id: %s' % query_id, 'Every search needs a different id')
+
+        seen.add(query_id)
+
+    return ids, [core.make_query(spec, max_flights) for spec in specs]
 
 
 def main(args=None):
@@ -109,6 +396,8 @@ def main(args=None):
         write_error_log(exc.msg, exc.details)
 
     except Exception:
+        import traceback
+
         write_error_log(traceback.format_exc())
 
         tools.log_info(
@@ -120,6 +409,7 @@ def main(args=None):
 
 
 def write_error_log(*msgs):
+    import tempfile
 
     log_path = os.path.join(tempfile.gettempdir(), 'ryanscan.error')
 
@@ -135,22 +425,20 @@ def write_error_log(*msgs):
     tools.log_info('Error report logged in: %s' % log_path)
 
 
-def find_airports(terms):
-    terms = [t.lower() for t in terms]
+def find_airports(terms, server_address=None, cache=None):
+    """
+    :param cache.DiskCache cache: where the airports are kept. None disables it
 
-    def predicate(x):
-        if not terms:
-            return True
+    """
+    if server_address is not None:
+        from . import server
 
-        x = x.lower()
+        matches = server.Client(server_address).find_airports(terms)
 
-        return any(t in x for t in terms)
+    else:
+        matches = core.get_airport_index(cache=cache).search(terms)
 
-    airports = [
-        ('{name} ({country})'.format(**data), iata)
-        for iata, data in core.get_airports().items()
-        if any(predicate(x) for x in data.values())
-    ]
+    airports = [('{name} ({country})'.format(**data), iata) for iata, data in matches]
 
     if not airports:
         print('No matches found')
@@ -158,28 +446,188 @@ def find_airports(terms):
 
     longest_key = max(len(airport[0]) for airport in airports)
 
-    for airport in sorted(airports, key=lambda x: x[0]):
+    # Best matches first
+    for airport in airports:
         print('%s: %s' % (airport[0].ljust(longest_key), airport[1]))
 
     return
 
 
 def _main(args):
-    args = docopt(__doc__, args)
+    args = parse_args(__doc__, args)
+
+    if not args['--record'] and not args['--replay']:
+        return run_command(args)
+
+    from . import transport
+
+    previous = set_archive_transport(args['--record'], args['--replay'])
+
+    try:
+        run_command(args)
+
+    finally:
+        transport.set_transport(previous).close()
+
+
+def set_archive_transport(record_path=None, replay_path=None):
+    """
+    Makes the backend requests go through an archive, see `archive.RecordingTransport`
+    and `archive.ReplayTransport`, and returns the previous transport
+
+    """
+    import sqlite3
+    import traceback
+    from . import archive
+    from . import transport
+
+    if record_path and replay_path:
+        raise core.AppError('--record and --replay cannot be used together', 'Record to an archive, or replay one, but not both')
+
+    try:
+        if replay_path:
+            return transport.set_transport(archive.ReplayTransport(archive.Archive(replay_path)))
+
+        return transport.set_transport(archive.RecordingTransport(transport.get_transport(), archive.Archive(record_path)))
+
+    except (IOError, OSError, sqlite3.Error):
+        raise core.AppError('Impossible to use the archive %s' % (record_path or replay_path), traceback.format_exc())
+
+
+def run_command(args):
+    # Recorded and replayed scans must make all their requests
+    no_cache = args['--no-cache'] or args['--record'] or args['--replay']
 
     if args['find-flights']:
-        find(
-            origins=args['<origins>'].upper().split(','),
-            destinations=args['<destinations>'].upper().split(','),
-            earliest_to=tools.parse_isodate(args['<earliest-to>']),
-            latest_to=tools.parse_isodate(args['<latest-to>']),
-            max_flights=int(args['--max-flights']),
-            as_json=args['--json'],
-        )
+        if args['--profile'] and args['--server']:
+            raise core.AppError('--profile cannot be used with --server', 'The scan runs in the server')
+
+        stats = Stats() if args['--profile'] else null_stats
+
+        with stats.phase('total'):
+            find(
+                origins=args['<origins>'].upper().split(','),
+                destinations=args['<destinations>'].upper().split(','),
+                earliest_to=tools.parse_isodate(args['<earliest-to>']),
+                latest_to=tools.parse_isodate(args['<latest-to>']),
+                earliest_back=tools.parse_isodate(args['<earliest-back>']) if args['<earliest-back>'] else None,
+                latest_back=tools.parse_isodate(args['<latest-back>']) if args['<latest-back>'] else None,
+                max_flights=int(args['--max-flights']),
+                concurrency=int(args['--concurrency']),
+                cache=None if no_cache else DiskCache(ttl=float(args['--cache-ttl'])),
+                top_k=parse_top(args['--top']),
+                lazy=args['--lazy'],
+                min_stay=int(args['--min-stay']),
+                max_stay=int(args['--max-stay']) if args['--max-stay'] else None,
+                engine=args['--engine'],
+                stats=stats,
+                as_json=args['--json'],
+                as_ndjson=args['--ndjson'],
+                server_address=args['--server'],
+                processes=int(args['--processes']),
+                sort_key=args['--sort'],
+                max_memory=int(args['--max-memory']) * 1024 * 1024,
+            )
+
+        if args['--profile']:
+            for line in stats.format():
+                tools.log_info(line)
+
         return
 
     if args['find-airports']:
-        find_airports(terms=args['<terms>'])
+        find_airports(
+            terms=args['<terms>'],
+            server_address=args['--server'],
+            cache=None if no_cache else DiskCache(),
+        )
+        return
+
+    if args['serve']:
+        serve(
+            port=int(args['--port']),
+            socket_path=args['--socket'],
+            concurrency=int(args['--concurrency']),
+            fares_ttl=float(args['--cache-ttl']),
+            engine=args['--engine'],
+            cache=None if no_cache else DiskCache(),
+        )
+        return
+
+    if args['watch']:
+        watch(
+            query=dict(
+                origs=args['<origins>'].upper().split(','),
+                dests=args['<destinations>'].upper().split(','),
+                earliest_to=tools.parse_isodate(args['<earliest-to>']),
+                latest_to=tools.parse_isodate(args['<latest-to>']),
+                earliest_back=tools.parse_isodate(args['<earliest-back>']) if args['<earliest-back>'] else None,
+                latest_back=tools.parse_isodate(args['<latest-back>']) if args['<latest-back>'] else None,
+                max_flights=int(args['--max-flights']),
+                top_k=parse_top(args['--top']),
+                min_stay=int(args['--min-stay']),
+                max_stay=int(args['--max-stay']) if args['--max-stay'] else None,
+            ),
+            interval=float(args['--interval']),
+            concurrency=int(args['--concurrency']),
+            cache=None if no_cache else DiskCache(ttl=float(args['--cache-ttl'])),
+            engine=args['--engine'],
+            as_json=args['--json'] or args['--ndjson'],
+        )
+        return
+
+    if args['batch']:
+        stats = Stats() if args['--profile'] else null_stats
+
+        with stats.phase('total'):
+            batch(
+                args['<queries-file>'],
+                max_flights=int(args['--max-flights']),
+                output_dir=args['--output-dir'],
+                concurrency=int(args['--concurrency']),
+                cache=None if no_cache else DiskCache(ttl=float(args['--cache-ttl'])),
+                engine=args['--engine'],
+                stats=stats,
+                processes=int(args['--processes']),
+            )
+
+        if args['--profile']:
+            for line in stats.format():
+                tools.log_info(line)
+
+        return
+
+    if args['refresh-network']:
+        refresh_network()
+
+
+def parse_top(value):
+    if not value:
+        return None
+
+    try:
+        return core.parse_top_k(value)
+
+    except ValueError as exc:
+        raise core.AppError('Invalid --top: %s' % value, '%s' % exc)
+
+
+def serve(port, socket_path=None, concurrency=core.std_concurrency, fares_ttl=std_ttl, engine=core.std_join_engine, cache=None):
+    """
+    :param cache.DiskCache cache: where the network and airports snapshots are kept
+
+    """
+    from . import server
+
+    app = server.App(cache=cache, fares_ttl=fares_ttl, concurrency=concurrency, engine=engine)
+    server.serve(app, port=port, socket_path=socket_path)
+
+
+def refresh_network():
+    cache = DiskCache()
+    core.get_airport_connections(cache=cache, refresh=True)
+    core.get_airport_index(cache=cache, refresh=True)
+    tools.log_info('Network refreshed')
 
 
 def render_single_flight_solution(sol):
@@ -200,6 +648,16 @@ def render_multiflight_solution(sol):
         print('  - %s' % format_flight(f))
 
 
+def render_round_trip_solution(sol):
+    print('{s.orig} > {s.dest} > {s.orig} | {dates} | {s.price:>7.2f} EUR'.format(
+        s=sol,
+        dates=format_date_pair(sol.date_out, sol.date_in),
+    ))
+
+    for f in sol.flights:
+        print('  - %s' % format_flight(f))
+
+
 def format_date_pair(date_out, date_in):
     """
     :type date_out: datetime.datetime
@@ -0,0 +1,148 @@
+# coding: utf-8
+
+"""
+Search index of the airports, for find-airports and autocompletion. Names are
+folded (lowercase, without accents nor punctuation) and split in words, and the
+sorted words are looked up by prefix with bisection.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import json
+import re
+import unicodedata
+from bisect import bisect_left
+
+
+# Fields of the stations data that are searched, best ranked first. The IATA
+# code (the key of the stations data) ranks above all of them
+indexed_fields = ['name', 'city', 'country']
+
+non_word = re.compile(r'[\W_]+', re.UNICODE)
+
+
+def fold(text):
+    """
+    Returns the words of `text` in lowercase, without accents nor punctuation,
+    e.g. "Málaga-Costa" -> ["malaga", "costa"]
+
+    :rtype: list of str
+
+    """
+    decomposed = unicodedata.normalize('NFKD', '%s' % text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+    return non_word.sub(' ', stripped.lower()).split()
+
+
+class AirportIndex(object):
+    """
+    Words of the searched fields of every airport, as (word, field rank, IATA
+    code) entries sorted by word.
+
+    """
+
+    def __init__(self, airports, entries=None, fingerprint=None):
+        """
+        :param dict airports: IATA code -> stations data, as returned by `core.get_airports`
+        :param entries: previously built entries of the same airports, see `as_dict`
+        :param str fingerprint: of the airports, see `get_fingerprint`
+
+        """
+        self.airports = airports
+        self.fingerprint = fingerprint or get_fingerprint(airports)
+
+        if entries is None:
+            entries = sorted(
+                (word, rank, iata)
+                for iata, data in airports.items()
+                for rank, value in enumerate([iata] + [data.get(field) for field in indexed_fields])
+                if value is not None
+                for word in set(fold(value))
+            )
+
+        self.entries = [tuple(entry) for entry in entries]
+        self.words = [entry[0] for entry in self.entries]
+
+        # Order of the airports ranked the same
+        self._sort_names = {iata: fold(data.get('name', '')) for iata, data in airports.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['airports'], data['entries'], data['fingerprint'])
+
+    def as_dict(self):
+        """
+        JSON serializable form, to be stored in the cache
+
+        """
+        return {'fingerprint': self.fingerprint, 'airports': self.airports, 'entries': self.entries}
+
+    def search(self, terms):
+        """
+        Returns the airports matching any of the terms, best matches first: a term
+        matches an airport if each of its words is the beginning of a word of its
+        IATA code, name, city or country. Exact words rank above prefixes, and the
+        code and the name above the city and the country. Without terms, all the
+        airports are returned.
+
+        :param list of str terms:
+        :rtype: list of (IATA code, stations data) tuples
+
+        """
+        iata2rank = {}
+
+        for term in terms:
+            for iata, rank in self.match(fold(term)).items():
+                iata2rank[iata] = min(rank, iata2rank.get(iata, rank))
+
+        if not terms:
+            iata2rank = dict.fromkeys(self.airports, 0)
+
+        ranked = sorted(iata2rank, key=lambda iata: (iata2rank[iata], self._sort_names[iata], iata))
+
+        return [(iata, self.airports[iata]) for iata in ranked]
+
+    def match(self, words):
+        """
+        Returns the airports matching all the words, with the sum of the ranks of
+        their best matches
+
+        :rtype: dict of IATA code -> rank
+
+        """
+        iata2rank = None
+
+        for word in words:
+            word_ranks = {}
+
+            for pos in range(bisect_left(self.words, word), len(self.words)):
+                entry_word, field_rank, iata = self.entries[pos]
+
+                if not entry_word.startswith(word):
+                    break
+
+                rank = 2 * field_rank + (entry_word != word)
+                word_ranks[iata] = min(rank, word_ranks.get(iata, rank))
+
+            if iata2rank is None:
+                iata2rank = word_ranks
+
+            else:
+                iata2rank = {iata: rank + word_ranks[iata] for iata, rank in iata2rank.items() if iata in word_ranks}
+
+            if not iata2rank:
+                break
+
+        return iata2rank or {}
+
+
+def get_fingerprint(airports):
+    """
+    Digest of the stations data, which tells whether an index is still valid
+
+    """
+    import hashlib
+
+    return hashlib.sha1(json.dumps(airports, sort_keys=True).encode('utf-8')).hexdigest()
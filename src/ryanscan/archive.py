@@ -0,0 +1,197 @@
+# coding: utf-8
+
+"""
+Recording of the backend traffic to an archive file, and replay of it without
+network: to reproduce a scan exactly as it happened, or to benchmark it against
+real data. Both are transports, see `transport.set_transport`.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from contextlib import closing
+
+
+class Archive(object):
+    """
+    Responses of the backend stored in a single SQLite file by request (URL and
+    parameters), with their bodies compressed. Recording a request again replaces
+    its previous response.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    def create(self):
+        directory = os.path.dirname(self.path)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with self._connect() as conn:
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS responses ('
+                    '    key TEXT PRIMARY KEY,'
+                    '    url TEXT NOT NULL,'
+                    '    params TEXT NOT NULL,'
+                    '    status INTEGER NOT NULL,'
+                    '    headers TEXT NOT NULL,'
+                    '    body BLOB NOT NULL'
+                    ')'
+                )
+
+    def add(self, url, params, response):
+        """
+        Not thread safe. Writes go through a single connection, see `close`
+
+        :param response: with the interface of `requests.Response`
+
+        """
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+            # Not waiting for every write to reach the disk makes recording much faster.
+            # Only the last responses may be lost, and only if the machine crashes
+            self._writer.execute('PRAGMA synchronous=OFF')
+
+        with self._writer as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses (key, url, params, status, headers, body) VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    get_request_key(url, params),
+                    url,
+                    json.dumps(params or {}, sort_keys=True),
+                    response.status_code,
+                    json.dumps(dict(getattr(response, 'headers', None) or {})),
+                    sqlite3.Binary(zlib.compress(response.content)),
+                ),
+            )
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def load(self):
+        """
+        Returns all the responses, still compressed
+
+        :rtype: dict of request key -> (status, headers, compressed body)
+
+        """
+        if not os.path.isfile(self.path):
+            raise IOError('No archive at %s' % self.path)
+
+        with self._connect() as conn:
+            rows = conn.execute('SELECT key, status, headers, body FROM responses')
+
+            return {key: (status, json.loads(headers), bytes(body)) for key, status, headers, body in rows}
+
+
+def get_request_key(url, params=None):
+    return json.dumps([url, sorted((params or {}).items())])
+
+
+class RecordingTransport(object):
+    """
+    Wraps a transport, writing every response it gets to an archive. Requests that
+    fail without response are not recorded.
+
+    """
+
+    def __init__(self, transport, archive):
+        """
+        :param Archive archive: created if it does not exist yet
+
+        """
+        self.transport = transport
+        self.archive = archive
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+        archive.create()
+
+    @property
+    def limiter(self):
+        return getattr(self.transport, 'limiter', None)
+
+    def get(self, url, params=None):
+        response = self.transport.get(url, params=params)
+
+        with self._lock:
+            self.archive.add(url, params, response)
+            self.recorded += 1
+
+        return response
+
+    def close(self):
+        with self._lock:
+            self.archive.close()
+
+
+class ReplayTransport(object):
+    """
+    Answers the requests with the responses of an archive, without network.
+    Requests missing from it fail.
+
+    """
+
+    limiter = None
+
+    def __init__(self, archive):
+        """
+        :param Archive archive: read whole when created, so that replays are not
+            slowed down by the file
+
+        """
+        self.archive = archive
+        self.replayed = 0
+        self._responses = archive.load()
+
+    def get(self, url, params=None):
+        entry = self._responses.get(get_request_key(url, params))
+
+        if entry is None:
+            raise LookupError('Request not in the archive %s: %s %s' % (self.archive.path, url, params))
+
+        status, headers, body = entry
+        self.replayed += 1
+
+        return ArchivedResponse(status, zlib.decompress(body), headers)
+
+    def close(self):
+        pass
+
+
+class ArchivedResponse(object):
+    """
+    The parts of `requests.Response` used by `core.get_json`
+
+    """
+
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
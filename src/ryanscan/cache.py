@@ -0,0 +1,242 @@
+# coding: utf-8
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import closing
+
+from .tools import get_cache_dir
+
+
+std_ttl = 15 * 60  # seconds
+std_max_size = 50 * 1024 * 1024  # bytes
+std_max_entries = 5000
+
+
+class DiskCache(object):
+    """
+    Persistent key-value store for JSON-serializable values, backed by SQLite so that
+    several processes can use it at the same time.
+
+    Entries older than `ttl` seconds are considered missing, and once the stored
+    (compressed) values take more than `max_size` bytes, the least recently used
+    entries are evicted.
+
+    """
+
+    def __init__(self, path=None, ttl=std_ttl, max_size=std_max_size, clock=time.time):
+        """
+        :param str path: database file. Defaults to the user's cache directory
+        :param float ttl: default time to live of the entries, in seconds
+        :param int max_size: maximum amount of bytes taken by the values
+        :param clock: function returning the current timestamp
+
+        """
+        if path is None:
+            path = os.path.join(get_cache_dir(), 'cache.sqlite')
+
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+
+        self._init_db()
+
+    def _connect(self):
+        # Generous timeout: other processes may be holding the write lock
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    def _init_db(self):
+        directory = os.path.dirname(self.path)
+
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+
+            except OSError:
+                # Created in the meantime by another process
+                if not os.path.isdir(directory):
+                    raise
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS entries ('
+                    '    key TEXT PRIMARY KEY,'
+                    '    value BLOB NOT NULL,'
+                    '    size INTEGER NOT NULL,'
+                    '    created REAL NOT NULL,'
+                    '    accessed REAL NOT NULL'
+                    ')'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def get(self, key, ttl=None):
+        """
+        Returns the value stored under `key`, or None if missing or expired
+
+        :param float ttl: overrides the default time to live for this lookup
+
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = self.clock()
+
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, created FROM entries WHERE key = ?', (key, )).fetchone()
+
+            if row is None or now - row[1] > ttl:
+                return None
+
+            with conn:
+                conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+
+        return decode_value(row[0])
+
+    def set(self, key, value):
+        blob = encode_value(value)
+        now = self.clock()
+
+        with self._connect() as conn:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                    (key, sqlite3.Binary(blob), len(blob), now, now),
+                )
+                self._evict(conn)
+
+    def keys(self, prefix='', ttl=None):
+        """
+        Returns the keys starting with `prefix` whose entries are not expired
+
+        :param float ttl: overrides the default time to live for this lookup
+
+        """
+        ttl = self.ttl if ttl is None else ttl
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT key FROM entries WHERE substr(key, 1, ?) = ? AND created >= ?',
+                (len(prefix), prefix, self.clock() - ttl),
+            )
+
+            return [row[0] for row in rows]
+
+    def delete(self, key):
+        with self._connect() as conn:
+            with conn:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key, ))
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+        if total <= self.max_size:
+            return
+
+        to_delete = []
+
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            if total <= self.max_size:
+                break
+
+            to_delete.append((key, ))
+            total -= size
+
+        conn.executemany('DELETE FROM entries WHERE key = ?', to_delete)
+
+
+class MemoryCache(object):
+    """
+    In-memory counterpart of DiskCache for long running processes, with the same
+    interface. Values are kept as they are, not copied, so they must not be modified.
+
+    Entries older than `ttl` seconds are considered missing, and beyond `max_entries`
+    the least recently used ones are evicted.
+
+    Keys are indexed by their prefixes ending in ':', so that `keys` only looks at the
+    entries of e.g. an edge, not at all of them.
+
+    """
+
+    def __init__(self, ttl=std_ttl, max_entries=std_max_entries, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (created, value), least recently used first
+        self._prefixes = {}  # prefix ending in ':' -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or self.clock() - entry[0] > ttl:
+                return None
+
+            # Marked as the most recently used
+            del self._entries[key]
+            self._entries[key] = entry
+
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                self._index(key)
+
+            self._entries[key] = (self.clock(), value)
+
+            while len(self._entries) > self.max_entries:
+                self._unindex(self._entries.popitem(last=False)[0])
+
+    def keys(self, prefix='', ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        oldest = self.clock() - ttl
+
+        with self._lock:
+            indexed_prefix = prefix[:prefix.rfind(':') + 1]
+            candidates = self._prefixes.get(indexed_prefix, ()) if indexed_prefix else self._entries
+
+            return [key for key in candidates if key.startswith(prefix) and self._entries[key][0] >= oldest]
+
+    def delete(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._unindex(key)
+
+    def _index(self, key):
+        for prefix in get_key_prefixes(key):
+            self._prefixes.setdefault(prefix, set()).add(key)
+
+    def _unindex(self, key):
+        for prefix in get_key_prefixes(key):
+            keys = self._prefixes[prefix]
+            keys.discard(key)
+
+            if not keys:
+                del self._prefixes[prefix]
+
+
+def get_key_prefixes(key):
+    """
+    Returns the prefixes of a cache key ending in ':', e.g. 'a:' and 'a:b:' for 'a:b:c'
+
+    """
+    return [key[:pos + 1] for pos, char in enumerate(key) if char == ':']
+
+
+def encode_value(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def decode_value(blob):
+    return json.loads(zlib.decompress(bytes(blob)).decode('utf-8'))
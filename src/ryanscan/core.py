@@ -2,30 +2,41 @@
 
 from __future__ import unicode_literals, division, absolute_import, print_function
 
+import heapq
 import itertools
 import traceback
-from collections import namedtuple
+from bisect import bisect_left
+from bisect import bisect_right
+from functools import partial
 from datetime import datetime
 from datetime import time
 from datetime import timedelta
 from math import ceil
-import requests
 
+from . import vectorized
+from .airports import AirportIndex
+from .airports import get_fingerprint
+from .models import BackendRequest
+from .models import DateConstraint
+from .models import DateInterval
+from .models import Edge
+from .models import Flight
+from .models import RoundTripSolution
+from .models import Solution
+from .stats import null_stats
+from .stats import Stats
+from .store import FlightStore
+from .store import from_minutes
+from .store import timedelta_to_minutes
+from .store import to_cents
+from .store import to_minutes
+from .store import to_minutes_ceil
+from .transport import get_transport
 from .tools import set_assoc
 from .tools import group_by
-from .tools import float2decimal
+from .tools import json_loads
 from .tools import log_info
-
-
-Flight = namedtuple('Flight', ['orig', 'dest', 'date_out', 'date_in', 'price', 'flight_number'])
-DateInterval = namedtuple('DateInterval', ['start', 'end'])
-BackendRequest = namedtuple('BackedRequest', ['orig', 'dest', 'date_to', 'date_back'])
-Edge = namedtuple('Edge', ['orig', 'dest'])
-Solution = namedtuple('Solution', ['orig', 'dest', 'date_out', 'date_in', 'flights', 'price'])
-DateConstraint = namedtuple(
-    'DateConstraint',
-    ['earliest_out', 'latest_in', 'latest_out', 'min_between_flights', 'max_between_flights']
-)
+from .tools import parse_isodate
 
 
 class AppError(Exception):
@@ -50,9 +61,56 @@ def make_solution(flights):
     )
 
 
-def get_airport_connections():
+def get_solution_order(solution):
+    """
+    Sort key of the solutions by departure. Ties are broken by their flights, so that
+    the order does not depend on which backend responses arrived first
+
+    """
+    return solution.date_out, tuple((f.date_out, f.orig, f.dest, f.flight_number) for f in solution.flights)
+
+
+std_network_ttl = 24 * 60 * 60  # seconds
+
+
+def get_airport_connections(cache=None, refresh=False):
+    """
+    Returns the route graph, from the local snapshot if it is fresh enough
+
+    :param cache.DiskCache cache: where the snapshot is kept. None disables it
+    :param bool refresh: ignore the snapshot and download the network again
+
+    """
+    network = get_snapshot(cache, 'network', download_network, refresh=refresh)
+
+    return {iata: set(dests) for iata, dests in network.items()}
+
+
+def download_network():
     log_info('Getting network')
-    return get_connections_from_stations_data(get_airports_raw_data())
+    network = get_connections_from_stations_data(get_airports_raw_data())
+
+    # Sets are not JSON serializable
+    return {iata: sorted(dests) for iata, dests in network.items()}
+
+
+def get_snapshot(cache, key, fetch, refresh=False, ttl=std_network_ttl):
+    """
+    Returns the value of `fetch()`, going through `cache` if any
+
+    """
+    if cache is not None and not refresh:
+        value = cache.get(key, ttl=ttl)
+
+        if value is not None:
+            return value
+
+    value = fetch()
+
+    if cache is not None:
+        cache.set(key, value)
+
+    return value
 
 
 def get_airports_raw_data():
@@ -60,26 +118,50 @@ def get_airports_raw_data():
     return get_json('https://api.ryanair.com/aggregate/3/common?embedded=airports&market=en-ie')
 
 
-def get_json(path, **kwargs):
+def get_json(path, params=None, transport=None, stats=null_stats):
+    """
+    :param str path: URL to query
+    :param dict params: query string parameters
+    :param transport.Transport transport: defaults to the shared transport
+    :param stats.Stats stats: records the time spent, the bytes received and the pace
+        of the rate limiter of the transport
+
+    """
     err_msg = 'Impossible to communicate with Ryanair backend'
 
+    if transport is None:
+        transport = get_transport()
+
     try:
-        r = requests.get(path, **kwargs)
+        with stats.phase('http'):
+            r = transport.get(path, params=params)
 
     except Exception:
         raise AppError(err_msg, traceback.format_exc())
 
+    stats.incr('http_requests')
+    stats.incr('response_bytes', len(r.content))
+
+    limiter = getattr(transport, 'limiter', None)
+
+    if limiter is not None:
+        # Pace reached so far, see `transport.RateLimiter`
+        stats.set('request_rate', round(limiter.rate, 2))
+        stats.set('requests_in_flight_limit', int(limiter.concurrency_limit))
+        stats.set('requests_throttled', limiter.throttled)
+
     if not r.ok:
         msg = (
             'Requested URL:%s\n'
             'Params: %s\n'
             'Backend responded with status %s\n'
             'and contents: %s\n'
-        ) % (path, kwargs, r.status_code, r.text)
+        ) % (path, params, r.status_code, r.text)
 
         raise AppError(err_msg, msg)
 
-    return r.json()
+    with stats.phase('json'):
+        return json_loads(r.content)
 
 
 def get_connections_from_stations_data(data):
@@ -146,8 +228,101 @@ def _find_path_for_origin(orig, targets, network, explored_path=None, visited_no
                 yield path
 
 
+def find_paths_bidirectional(origs, targets, network, max_flights=2):
+    """
+    Finds the same paths as `find_paths`, but searching from both ends: first the
+    hop distance from every airport to the targets is calculated going backwards
+    from them, and then the forward search only steps into airports from which a
+    target can still be reached within the remaining flights.
+
+    :param origs: list of iata codes of aiports to start from
+    :param targets: list of iata codes of destination airports
+    :param dict network: graph of airports and routes
+    :param int max_flights: desired max amount of flights
+
+    """
+    targets = set(targets)
+    distances = get_distances_to_targets(targets, network, max_flights)
+    visited_nodes = set(origs)
+
+    for orig in origs:
+        if distances.get(orig, max_flights + 1) > max_flights:
+            continue
+
+        for path in _find_bounded_paths(orig, targets, network, distances, [], visited_nodes, max_flights):
+            yield path
+
+
+def get_distances_to_targets(targets, network, max_distance):
+    """
+    Returns a dict mapping each airport to the minimum amount of flights needed to
+    reach any of the targets from it. Targets are never crossed as intermediate
+    stops. Airports further than `max_distance` are left out.
+
+    :param set of str targets:
+    :param dict network: graph of airports and routes
+    :param int max_distance:
+    :rtype: dict
+
+    """
+    reversed_network = {}
+
+    for orig, dests in network.items():
+        for dest in dests:
+            reversed_network.setdefault(dest, set()).add(orig)
+
+    distances = {}
+    frontier = set(targets)
+    distance = 0
+
+    while frontier and distance < max_distance:
+        distance += 1
+        next_frontier = set()
+
+        for node in frontier:
+            # A target ends the path, so nothing can fly *through* it
+            if node in targets and distance > 1:
+                continue
+
+            for prev in reversed_network.get(node, ()):
+                if prev not in distances:
+                    distances[prev] = distance
+                    next_frontier.add(prev)
+
+        frontier = next_frontier
+
+    return distances
+
+
+def _find_bounded_paths(orig, targets, network, distances, explored_path, visited_nodes, max_flights):
+    destinations = network[orig]
+
+    for dest in destinations & targets:
+        yield explored_path + [Edge(orig, dest)]
+
+    flights_left = max_flights - len(explored_path) - 1
+    this_visited_nodes = set_assoc(visited_nodes, orig)
+
+    for node in (destinations - targets) - visited_nodes:
+        if distances.get(node, flights_left + 1) > flights_left:
+            continue
+
+        for path in _find_bounded_paths(
+            node,
+            targets,
+            network,
+            distances,
+            explored_path + [Edge(orig, node)],
+            this_visited_nodes,
+            max_flights,
+        ):
+            yield path
+
+
 std_min_between_flights = timedelta(hours=1)
 std_max_between_flights = timedelta(hours=5)
+std_concurrency = 4
+std_join_engine = 'auto'
 
 
 def get_solutions(
@@ -158,20 +333,575 @@ def get_solutions(
     dates_back=None,
     min_between_flights=std_min_between_flights,
     max_between_flights=std_max_between_flights,
+    concurrency=std_concurrency,
+    cache=None,
+    stats=null_stats,
+    lazy=False,
+    engine=std_join_engine,
+    processes=None,
 ):
+    """
+    Yields the solutions of every path. The solutions of a path are calculated as
+    soon as the flights of all its edges have been fetched, so the first ones are
+    available before the slowest requests finish.
+
+    :param bool lazy: fetch the legs one after another, see `get_solutions_by_leg`
+    :param str engine: join engine, see `get_join_function`
+    :param int processes: join the paths in this amount of worker processes once
+        all the flights are fetched, see `parallel.get_paths_solutions`. Not
+        used with `lazy`
+
+    """
+    if lazy:
+        for solution in get_solutions_by_leg(
+            paths,
+            dates_to,
+            min_between_flights=min_between_flights,
+            max_between_flights=max_between_flights,
+            concurrency=concurrency,
+            cache=cache,
+            stats=stats,
+            engine=engine,
+        ):
+            yield solution
+
+        return
+
     log_info('Finding valid solutions')
+    date_constraint = make_date_constraint(dates_to, min_between_flights, max_between_flights)
+
+    if processes and processes > 1:
+        store = fetch_flight_store(
+            get_edge_dates(paths, dates_to),
+            date_constraint,
+            concurrency=concurrency,
+            cache=cache,
+            stats=stats,
+        )
+
+        with stats.phase('join'):
+            solutions = get_paths_solutions(paths, store, date_constraint, stats=stats, engine=engine, processes=processes)
+
+        for solution in solutions:
+            yield solution
+
+        return
+
     # TODO [bgusach 01.11.2016]: inject these functions
-    needed_requests = calculate_needed_requests(paths, dates_to, dates_back)
+    needed_requests = plan_requests(get_edge_dates(paths, dates_to), cache=cache, stats=stats)
+
+    edge2requests = group_by(lambda req: Edge(req.orig, req.dest), needed_requests)
+    edge2paths = {}
+    path_pending_edges = []
+
+    for idx, path in enumerate(paths):
+        path_pending_edges.append(len(set(path)))
+
+        for edge in set(path):
+            edge2paths.setdefault(edge, []).append(idx)
+
+    edge2responses = {}
+    store = FlightStore()
+
+    for req, rows in fetch_responses(
+        needed_requests,
+        concurrency=concurrency,
+        execute_request=partial(execute_request, cache=cache, stats=stats, date_constraint=date_constraint),
+    ):
+        edge = Edge(req.orig, req.dest)
+        responses = edge2responses.setdefault(edge, {})
+        responses[req] = rows
+
+        if len(responses) < len(edge2requests[edge]):
+            continue
+
+        # Responses arrive in any order, but the flights must not
+        store.add_rows(edge, group_rows(row for r in sorted(responses) for row in responses[r]).get(edge, []))
+        del edge2responses[edge]
+
+        for idx in edge2paths[edge]:
+            path_pending_edges[idx] -= 1
+
+            if path_pending_edges[idx]:
+                continue
+
+            with stats.phase('join'):
+                solutions = get_path_solutions(
+                    paths[idx],
+                    store,
+                    date_constraint=date_constraint,
+                    stats=stats,
+                    engine=engine,
+                )
+
+            for solution in solutions:
+                yield solution
+
+
+def get_solutions_by_leg(
+    paths,
+    dates_to,
+    min_between_flights=std_min_between_flights,
+    max_between_flights=std_max_between_flights,
+    concurrency=std_concurrency,
+    cache=None,
+    stats=null_stats,
+    engine=std_join_engine,
+):
+    """
+    Yields the solutions of every path, fetching their legs on demand: first the
+    first leg of all paths, then the second leg of the paths whose first leg has
+    usable flights, and so on. Later legs are only requested for the dates on which
+    some partial itinerary arrives and can connect.
+
+    This takes more round trips than `get_solutions`, but most paths through
+    intermediate airports turn out to be dead ends, so far fewer requests.
+
+    """
+    log_info('Finding valid solutions leg by leg')
+    date_constraint = make_date_constraint(dates_to, min_between_flights, max_between_flights)
+    all_dates = get_interval_dates(dates_to)
+    join = get_join_function(engine)
+    edge2covered_dates = {}
+    store = FlightStore()
+    alive_paths = list(paths)
+    position = 0
+
+    while alive_paths:
+        edge2dates = {}
+
+        for path in alive_paths:
+            if position == 0:
+                dates = all_dates
+
+            else:
+                last_leg = store.get(path[position - 1])
+                dates = get_connection_dates(
+                    [
+                        from_minutes(last_leg.dates_in[partial[-1]])
+                        for partial in join(store, path[:position], date_constraint)
+                    ],
+                    date_constraint,
+                )
+
+            edge = path[position]
+            edge2dates.setdefault(edge, set()).update(dates - edge2covered_dates.get(edge, set()))
+
+        edge2responses = {}
+        # As days since the epoch, like the dates of the rows in minutes
+        previously_covered = {
+            edge: {to_minutes(datetime.combine(day, time())) // 1440 for day in edge2covered_dates.get(edge, ())}
+            for edge in edge2dates
+        }
+
+        for req, rows in fetch_responses(
+            plan_requests(edge2dates, cache=cache, stats=stats),
+            concurrency=concurrency,
+            execute_request=partial(execute_request, cache=cache, stats=stats, date_constraint=date_constraint),
+        ):
+            edge = Edge(req.orig, req.dest)
+            edge2responses.setdefault(edge, {})[req] = rows
+
+            # The whole window is known now, not only the dates that were needed
+            edge2covered_dates.setdefault(edge, set()).update(
+                req.date_to + timedelta(days=x) for x in range(req.flex_days_out + 1)
+            )
+
+        for edge in edge2dates:
+            # Flights of the days covered by former waves are already stored
+            responses = edge2responses.get(edge, {})
+            store.add_rows(edge, group_rows(
+                row
+                for req in sorted(responses)
+                for row in responses[req]
+                if row[1] // 1440 not in previously_covered[edge]
+            ).get(edge, []))
+
+        position += 1
+        still_alive = []
+
+        for path in alive_paths:
+            if len(path) > position:
+                still_alive.append(path)
+                continue
+
+            with stats.phase('join'):
+                solutions = get_path_solutions(path, store, date_constraint, stats=stats, engine=engine)
+
+            for solution in solutions:
+                yield solution
+
+        alive_paths = still_alive
+
+
+def get_connection_dates(arrivals, date_constraint):
+    """
+    Returns the dates on which a flight must depart to connect with any of the
+    partial itineraries
+
+    :param arrivals: arrival dates of the last flight of the partial itineraries
+    :type date_constraint: DateConstraint
+    :rtype: set of datetime.date
+
+    """
+    dates = set()
+
+    for arrival in set(arrivals):
+        day = (arrival + date_constraint.min_between_flights).date()
+        last_day = min(arrival + date_constraint.max_between_flights, date_constraint.latest_in).date()
+
+        while day <= last_day:
+            dates.add(day)
+            day += timedelta(days=1)
+
+    return dates
 
-    edge2flights = group_by(
-        lambda x: (x.orig, x.dest),
-        (flight for req in needed_requests for flight in execute_request(req)),
+
+def get_cheapest_solutions(
+    paths,
+    dates_to,
+    top_k,
+    min_between_flights=std_min_between_flights,
+    max_between_flights=std_max_between_flights,
+    concurrency=std_concurrency,
+    cache=None,
+    stats=null_stats,
+    engine=std_join_engine,
+):
+    """
+    Returns the `top_k` cheapest solutions of all paths, sorted by price.
+
+    The edges are fetched in waves: first the first edge of every path, then the
+    second edge of the paths still alive, and so on. Paths are finished as soon as
+    all their edges are fetched, and the remaining ones are dropped when their
+    fetched edges alone are already more expensive than the k-th cheapest solution
+    found so far. That way their other edges are never requested.
+
+    """
+    log_info('Finding the %s cheapest solution(s)' % top_k)
+    needed_requests = plan_requests(get_edge_dates(paths, dates_to), cache=cache, stats=stats)
+
+    date_constraint = make_date_constraint(dates_to, min_between_flights, max_between_flights)
+    edge2requests = group_by(lambda req: Edge(req.orig, req.dest), needed_requests)
+    store = FlightStore()
+    cheapest = CheapestSolutions(top_k)
+    pending_paths = list(paths)
+    requests_done = 0
+    position = 0
+
+    while pending_paths:
+        edges = {path[position] for path in pending_paths} - store.edges()
+        # Edges without dates, e.g. with latest_to before earliest_to, have no requests
+        backend_requests = [req for edge in edges for req in edge2requests.get(edge, [])]
+        responses = dict(fetch_responses(
+            backend_requests,
+            concurrency=concurrency,
+            execute_request=partial(execute_request, cache=cache, stats=stats, date_constraint=date_constraint),
+        ))
+        requests_done += len(backend_requests)
+
+        for edge in edges:
+            store.add_rows(edge, group_rows(row for req in sorted(edge2requests.get(edge, [])) for row in responses[req]).get(edge, []))
+
+        position += 1
+        still_pending = []
+
+        for path in pending_paths:
+            if len(path) == position:
+                with stats.phase('join'):
+                    solutions = get_path_solutions(
+                        path,
+                        store,
+                        date_constraint,
+                        max_price=cheapest.max_price,
+                        stats=stats,
+                        engine=engine,
+                    )
+
+                for solution in solutions:
+                    cheapest.add(solution)
+
+                continue
+
+            fetched_prices = [store.get(edge).min_price() for edge in path[:position]]
+
+            if None in fetched_prices:
+                continue
+
+            if cheapest.max_price is not None and sum(fetched_prices) > to_cents(cheapest.max_price):
+                continue
+
+            still_pending.append(path)
+
+        pending_paths = still_pending
+
+    log_info('%s of %s request(s) skipped' % (len(needed_requests) - requests_done, len(needed_requests)))
+    stats.incr('backend_requests_skipped', len(needed_requests) - requests_done)
+
+    return cheapest.get_solutions()
+
+
+class CheapestSolutions(object):
+    """
+    Keeps the k cheapest of the solutions added to it. Ties in price are broken
+    like `scan` sorts, see `get_solution_order`, so that the result does not depend
+    on the order in which the solutions are added.
+
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self._heap = []
+
+    @property
+    def max_price(self):
+        """
+        Price that a solution must not exceed to make it into the k cheapest,
+        or None while there are less than k solutions
+
+        """
+        if len(self._heap) < self.k:
+            return None
+
+        return self._heap[0].rank[0]
+
+    def add(self, solution):
+        item = _RankedSolution(solution)
+
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, item)
+
+        elif item.rank < self._heap[0].rank:
+            heapq.heapreplace(self._heap, item)
+
+    def get_solutions(self):
+        return [item.solution for item in sorted(self._heap, reverse=True)]
+
+
+class _RankedSolution(object):
+    """
+    Heap item for CheapestSolutions, where the most expensive solution goes first
+
+    """
+    __slots__ = ['rank', 'solution']
+
+    def __init__(self, solution):
+        self.rank = solution.price, get_solution_order(solution)
+        self.solution = solution
+
+    def __lt__(self, other):
+        return self.rank > other.rank
+
+
+def get_round_trip_solutions(
+    out_paths,
+    back_paths,
+    dates_to,
+    dates_back,
+    min_stay=0,
+    max_stay=None,
+    min_between_flights=std_min_between_flights,
+    max_between_flights=std_max_between_flights,
+    concurrency=std_concurrency,
+    cache=None,
+    stats=null_stats,
+    engine=std_join_engine,
+    processes=None,
+):
+    """
+    Yields the round trips made of a solution of `out_paths` and a solution of
+    `back_paths` going back to the airport where the first one started.
+
+    The flights of both directions are fetched together: requests of opposite
+    edges are merged into round trip requests, see `merge_round_trip_requests`.
+
+    :param DateInterval dates_back: dates to fly back
+    :param int min_stay: minimum amount of days between the arrival and the flight back
+    :param int max_stay: maximum amount of days between the arrival and the flight back.
+        None for no limit
+    :param int processes: see `get_paths_solutions`
+
+    """
+    log_info('Finding valid round trips')
+    dates_back = get_return_dates(dates_to, dates_back, min_stay, max_stay)
+
+    if dates_back is None:
+        return
+
+    constraint_to = make_date_constraint(dates_to, min_between_flights, max_between_flights)
+    constraint_back = make_date_constraint(dates_back, min_between_flights, max_between_flights)
+
+    store = fetch_flight_store(
+        merge_edge_dates([get_edge_dates(out_paths, dates_to), get_edge_dates(back_paths, dates_back)]),
+        make_date_constraint(DateInterval(min(dates_to.start, dates_back.start), max(dates_to.end, dates_back.end))),
+        round_trips=True,
+        concurrency=concurrency,
+        cache=cache,
+        stats=stats,
+    )
+
+    with stats.phase('join'):
+        outbound = get_paths_solutions(out_paths, store, constraint_to, stats=stats, engine=engine, processes=processes)
+        inbound = get_paths_solutions(back_paths, store, constraint_back, stats=stats, engine=engine, processes=processes)
+        round_trips = join_round_trips(outbound, inbound, min_stay, max_stay, min_between_flights)
+
+    for round_trip in round_trips:
+        yield round_trip
+
+
+def get_return_dates(dates_to, dates_back, min_stay=0, max_stay=None):
+    """
+    Returns the part of `dates_back` that some outbound flight within `dates_to`
+    can be combined with given the stay bounds, or None if there is none
+
+    :rtype: DateInterval
+
+    """
+    dates_back = DateInterval(
+        max(dates_back.start, dates_to.start + timedelta(days=min_stay)),
+        dates_back.end if max_stay is None else min(dates_back.end, dates_to.end + timedelta(days=max_stay)),
     )
 
+    return dates_back if dates_back.start <= dates_back.end else None
+
+
+def merge_edge_dates(edge2dates_list):
+    """
+    :param edge2dates_list: list of dicts edge -> set of datetime.date
+    :rtype: dict
+
+    """
+    res = {}
+
+    for edge2dates in edge2dates_list:
+        for edge, dates in edge2dates.items():
+            res[edge] = res.get(edge, set()) | dates
+
+    return res
+
+
+def fetch_flight_store(
+    edge2dates,
+    date_constraint=None,
+    round_trips=False,
+    concurrency=std_concurrency,
+    cache=None,
+    stats=null_stats,
+):
+    """
+    Fetches the flights of every edge on its dates, with as few requests as the
+    planner can make, and returns them in a FlightStore
+
+    :param dict edge2dates: edge -> collection of datetime.date
+    :param DateConstraint date_constraint: flights out of it are left out
+    :param bool round_trips: merge requests of opposite edges, see `merge_round_trip_requests`
+    :rtype: FlightStore
+
+    """
+    needed_requests = plan_requests(edge2dates, cache=cache, stats=stats)
+
+    if round_trips:
+        needed_requests = merge_round_trip_requests(needed_requests, cache=cache, stats=stats)
+
+    request2order = {req: idx for idx, req in enumerate(sorted(needed_requests, key=get_request_order))}
+    store = FlightStore(unique=True)
+
+    for edge in edge2dates:
+        store.add_rows(edge, [])
+
+    # Rows are stored as the responses arrive, but in the order of the requests
+    for req, rows in fetch_responses(
+        needed_requests,
+        concurrency=concurrency,
+        execute_request=partial(execute_request, cache=cache, stats=stats, date_constraint=date_constraint),
+    ):
+        # Responses of round trip requests have flights of two edges
+        for edge, edge_rows in group_rows(rows).items():
+            store.add_rows(edge, edge_rows, order=request2order[req])
+
+    return store
+
+
+def get_paths_solutions(paths, store, date_constraint, stats=null_stats, engine=std_join_engine, processes=None):
+    """
+    :param int processes: join the paths in this amount of worker processes, see
+        `parallel.get_paths_solutions`. Solutions then come sorted by departure
+    :rtype: list of Solution
+
+    """
+    if processes and processes > 1:
+        from . import parallel
+
+        return parallel.get_paths_solutions(paths, store, date_constraint, processes, stats=stats, engine=engine)
+
+    return [
+        solution
+        for path in paths
+        for solution in get_path_solutions(path, store, date_constraint, stats=stats, engine=engine)
+    ]
+
+
+def join_round_trips(outbound, inbound, min_stay=0, max_stay=None, min_between_flights=std_min_between_flights):
+    """
+    Returns the round trips combining an outbound solution with an inbound one that
+    goes back to its origin, leaving between `min_stay` and `max_stay` days after the
+    arrival (and not before `min_between_flights` after it).
+
+    Inbound solutions are sorted by departure, so that the ones that fit the stay of
+    an outbound solution are found by bisection instead of pairing all of them.
+
+    :param list of Solution outbound:
+    :param list of Solution inbound:
+    :rtype: list of RoundTripSolution
+
+    """
+    route2inbound = group_by(lambda s: (s.orig, s.dest), sorted(inbound, key=lambda s: s.date_out))
+    route2dates = {route: [s.date_out for s in solutions] for route, solutions in route2inbound.items()}
+    round_trips = []
+
+    for out in outbound:
+        route = out.dest, out.orig
+
+        if route not in route2inbound:
+            continue
+
+        arrival_day = out.date_in.date()
+        earliest_back = max(
+            out.date_in + min_between_flights,
+            datetime.combine(arrival_day + timedelta(days=min_stay), time(0, 0, 0)),
+        )
+        start = bisect_left(route2dates[route], earliest_back)
+
+        if max_stay is None:
+            end = len(route2dates[route])
+
+        else:
+            latest_back = datetime.combine(arrival_day + timedelta(days=max_stay), time(23, 59, 59))
+            end = bisect_right(route2dates[route], latest_back)
+
+        round_trips.extend(make_round_trip(out, back) for back in route2inbound[route][start:end])
+
+    return round_trips
+
+
+def make_round_trip(outbound, inbound):
+    return RoundTripSolution(
+        orig=outbound.orig,
+        dest=outbound.dest,
+        date_out=outbound.date_out,
+        date_in=inbound.date_in,
+        flights=outbound.flights + inbound.flights,
+        price=outbound.price + inbound.price,
+        outbound=outbound,
+        inbound=inbound,
+    )
+
+
+def make_date_constraint(dates_to, min_between_flights=std_min_between_flights, max_between_flights=std_max_between_flights):
     earliest_out = datetime.combine(dates_to.start, time(0, 0, 0))
     latest_in = datetime.combine(dates_to.end, time(23, 59, 59))
 
-    date_constraint = DateConstraint(
+    return DateConstraint(
         earliest_out=earliest_out,
         latest_out=latest_in,
         latest_in=latest_in,
@@ -179,14 +909,6 @@ def get_solutions(
         max_between_flights=max_between_flights,
     )
 
-    for path in paths:
-        for solution in get_path_solutions(
-            path,
-            edge2flights,
-            date_constraint=date_constraint,
-        ):
-            yield solution
-
 
 def are_flights_compatible(flights, date_constraint):
     """
@@ -216,42 +938,388 @@ def are_flights_compatible(flights, date_constraint):
     return are_flights_compatible(rest, date_constraint)
 
 
-def get_path_solutions(path, edge2flights, date_constraint, are_flights_compatible=are_flights_compatible):
+def get_path_solutions(
+    path,
+    edge2flights,
+    date_constraint,
+    are_flights_compatible=None,
+    max_price=None,
+    stats=null_stats,
+    engine=std_join_engine,
+):
+    """
+    Returns the solutions for a path, i.e. the combinations of one flight per edge
+    that are consistent with the date constraint.
+
+    :param list of Edge path:
+    :param edge2flights: flights grouped by edge, as a dict or a FlightStore
+    :type date_constraint: DateConstraint
+    :param are_flights_compatible: custom compatibility predicate. Since it cannot
+        be indexed, every possible combination of flights is checked with it
+    :param max_price: if passed, solutions more expensive than this are discarded
+    :type stats: stats.Stats
+    :param str engine: join engine, see `get_join_function`
+
+    """
     if not all(edge in edge2flights for edge in path):
         return []
 
-    all_posible_solutions = itertools.product(*[edge2flights[edge] for edge in path])
+    is_store = isinstance(edge2flights, FlightStore)
 
-    return [
-        make_solution(s)
-        for s in all_posible_solutions
-        if s
-        and are_flights_compatible(s, date_constraint)
-    ]
+    if are_flights_compatible is not None:
+        legs = [edge2flights.flights(edge) if is_store else edge2flights[edge] for edge in path]
+        all_posible_solutions = list(itertools.product(*legs))
 
+        solutions = [
+            make_solution(s)
+            for s in all_posible_solutions
+            if s
+            and are_flights_compatible(s, date_constraint)
+            and (max_price is None or sum(f.price for f in s) <= max_price)
+        ]
+        stats.incr('combinations_checked', len(all_posible_solutions))
 
-def calculate_needed_requests(paths, dates_to, dates_back=None):
-    # TODO [bgusach 17.10.2016]: handle dates_back
-    start, end = dates_to
-    week_intervals_to_query = int(ceil((end - start).days / 7)) or 1  # At least one we need
-    dates_to_query = [start + timedelta(days=7 * x) for x in range(week_intervals_to_query)]
+    else:
+        store = edge2flights if is_store else FlightStore.from_mapping({edge: edge2flights[edge] for edge in path})
+        flights = {}
 
-    return {
-        BackendRequest(edge.orig, edge.dest, date, None)
-        for path in paths
-        for edge in path
-        for date in dates_to_query
-    }
+        def get_flight(edge, pos):
+            # Legs are shared by many solutions, so build each Flight only once
+            key = edge, pos
 
+            if key not in flights:
+                flights[key] = store.make_flight(edge, pos)
 
-def execute_request(request):
-    query = {
+            return flights[key]
+
+        solutions = [
+            make_solution([get_flight(edge, pos) for edge, pos in zip(path, positions)])
+            for positions in get_join_function(engine)(store, path, date_constraint, max_price, stats)
+        ]
+
+    stats.incr('combinations_accepted', len(solutions))
+
+    return solutions
+
+
+def get_join_function(engine=std_join_engine):
+    """
+    Returns the function joining the flights of a path for an engine: 'python',
+    'numpy' (needs NumPy installed), or 'auto' to use NumPy when available and the
+    path has enough flights to make up for its overhead. All of them give the same
+    results.
+
+    """
+    if engine == 'auto':
+        return join_path_auto if vectorized.available else join_path
+
+    if engine == 'python':
+        return join_path
+
+    if engine == 'numpy':
+        if not vectorized.available:
+            raise AppError('The numpy engine needs NumPy installed', 'Install it with: pip install ryanscan[numpy]')
+
+        return vectorized.join_path
+
+    raise AppError('Unknown join engine: %s' % engine, 'Use one of: auto, python, numpy')
+
+
+# Below this amount of flights in a path, the pure Python join is faster
+std_vectorized_min_flights = 200
+
+
+def join_path_auto(store, path, date_constraint, max_price=None, stats=null_stats):
+    if sum(len(store.get(edge)) for edge in path) < std_vectorized_min_flights:
+        return join_path(store, path, date_constraint, max_price, stats)
+
+    return vectorized.join_path(store, path, date_constraint, max_price, stats)
+
+
+def join_path(store, path, date_constraint, max_price=None, stats=null_stats):
+    """
+    Returns the combinations of one flight per edge of the path that
+    `are_flights_compatible` would accept, as tuples of positions within the
+    columns of every edge. They come in the order `itertools.product` would yield
+    the flights in the order they were added to the store.
+
+    Flights of every edge are sorted by departure time, and partial itineraries are
+    only extended with the flights departing within the allowed window after their
+    last arrival. Thus the cost depends on the amount of valid combinations, not on
+    the size of the product.
+
+    When `max_price` is passed, partial itineraries whose price plus the cheapest
+    fare of every remaining edge exceeds it are not extended any further.
+
+    :type store: FlightStore
+    :param list of Edge path:
+    :type date_constraint: DateConstraint
+    :param stats.Stats stats: records how many candidate flights are checked
+    :rtype: list of tuple of int
+
+    """
+    legs = [store.get(edge) for edge in path]
+
+    if not legs or not all(legs):
+        return []
+
+    # Everything in minutes and cents, rounded so that nothing allowed is left out
+    earliest_out = to_minutes_ceil(date_constraint.earliest_out)
+    latest_out = to_minutes(date_constraint.latest_out)
+    latest_in = to_minutes(date_constraint.latest_in)
+    min_between = timedelta_to_minutes(date_constraint.min_between_flights, ceil=True)
+    max_between = timedelta_to_minutes(date_constraint.max_between_flights)
+
+    if max_price is None:
+        def is_too_expensive(price, next_leg_idx):
+            return False
+
+    else:
+        max_cents = to_cents(max_price)
+
+        # Cheapest possible price of the legs from a given one up to the end
+        rest_min_prices = [0] * (len(legs) + 1)
+
+        for leg_idx in reversed(range(len(legs))):
+            rest_min_prices[leg_idx] = rest_min_prices[leg_idx + 1] + legs[leg_idx].min_price()
+
+        def is_too_expensive(price, next_leg_idx):
+            return price + rest_min_prices[next_leg_idx] > max_cents
+
+    first_leg = legs[0]
+    candidates = first_leg.find(earliest_out, latest_out)
+    checked = len(candidates)
+
+    partials = [
+        ((pos, ), first_leg.prices[pos])
+        for pos in candidates
+        if first_leg.dates_in[pos] <= latest_in
+        and not is_too_expensive(first_leg.prices[pos], 1)
+    ]
+
+    for leg_idx in range(1, len(legs)):
+        prev_leg, leg = legs[leg_idx - 1], legs[leg_idx]
+        dates_in, prices = leg.dates_in, leg.prices
+        extended = []
+
+        for partial, price in partials:
+            arrival = prev_leg.dates_in[partial[-1]]
+            candidates = leg.find(arrival + min_between, arrival + max_between)
+            checked += len(candidates)
+
+            for pos in candidates:
+                if dates_in[pos] <= latest_in and not is_too_expensive(price + prices[pos], leg_idx + 1):
+                    extended.append((partial + (pos, ), price + prices[pos]))
+
+        partials = extended
+
+    stats.incr('combinations_checked', checked)
+
+    seqs = [leg.seqs for leg in legs]
+    positions = [partial for partial, _ in partials]
+    positions.sort(key=lambda partial: tuple(s[pos] for s, pos in zip(seqs, partial)))
+
+    return positions
+
+
+std_max_flex_days = 6
+
+
+def get_edge_dates(paths, dates_to):
+    """
+    Returns a dict mapping every edge of the paths to the set of dates on which its
+    flights may depart.
+
+    Without knowing any flight, that is the whole interval for every leg: a later leg
+    can depart as early as the first one, and must arrive by the end of the interval
+    like all of them.
+
+    """
+    dates = get_interval_dates(dates_to)
+
+    return {edge: dates for path in paths for edge in path}
+
+
+def get_interval_dates(interval):
+    """
+    :type interval: DateInterval
+    :rtype: set of datetime.date
+
+    """
+    return {interval.start + timedelta(days=x) for x in range((interval.end - interval.start).days + 1)}
+
+
+def plan_requests(edge2dates, cache=None, stats=null_stats):
+    """
+    Returns the smallest set of backend requests covering, for every edge, all its
+    dates. A request covers its DateOut plus up to `std_max_flex_days` days after it.
+
+    Dates covered by fresh responses in the cache are covered by requesting those
+    same windows again (which the cache will answer) instead of new ones.
+
+    :param dict edge2dates: edge -> collection of datetime.date
+    :param cache.DiskCache cache:
+    :type stats: stats.Stats
+    :rtype: set of BackendRequest
+
+    """
+    planned = set()
+    cached = 0
+    naive = 0
+
+    for edge, dates in edge2dates.items():
+        if not dates:
+            continue
+
+        pending = set(dates)
+        # What fixed weekly chunks from the first date would take
+        naive += int(ceil(((max(dates) - min(dates)).days + 1) / 7))
+
+        for req in sorted(get_cached_requests(edge, cache)):
+            covered = {d for d in pending if req.date_to <= d <= req.date_to + timedelta(days=req.flex_days_out)}
+
+            if covered:
+                planned.add(req)
+                pending -= covered
+                cached += 1
+
+        pending = sorted(pending)
+
+        while pending:
+            start = pending[0]
+            window = [d for d in pending if d <= start + timedelta(days=std_max_flex_days)]
+            planned.add(BackendRequest(edge.orig, edge.dest, start, None, (window[-1] - start).days))
+            pending = pending[len(window):]
+
+    saved = naive - (len(planned) - cached)
+
+    log_info('%s request(s) planned, %s of them cached, %s saved' % (len(planned), cached, saved))
+    stats.incr('requests_planned', len(planned))
+    stats.incr('requests_saved', saved)
+
+    return planned
+
+
+def merge_round_trip_requests(requests, cache=None, stats=null_stats):
+    """
+    Pairs one-way requests of opposite edges into round trip requests, which the
+    backend answers with the flights of both directions at once. Requests that the
+    cache can answer are kept as they are.
+
+    :param requests: collection of one-way BackendRequest
+    :rtype: set of BackendRequest
+
+    """
+    edge2requests = group_by(lambda req: Edge(req.orig, req.dest), requests)
+    merged = set()
+    pairs = 0
+
+    for edge, edge_requests in edge2requests.items():
+        reverse = Edge(edge.dest, edge.orig)
+
+        if reverse not in edge2requests:
+            merged.update(edge_requests)
+            continue
+
+        # Every pair of edges is handled once, from its first edge
+        if reverse < edge:
+            continue
+
+        cached = set(get_cached_requests(edge, cache)) | set(get_cached_requests(reverse, cache))
+        outs = sorted(req for req in edge_requests if req not in cached)
+        backs = sorted(req for req in edge2requests[reverse] if req not in cached)
+        edge_pairs = min(len(outs), len(backs))
+
+        merged.update(req for req in edge_requests + edge2requests[reverse] if req in cached)
+        merged.update(outs[edge_pairs:])
+        merged.update(backs[edge_pairs:])
+        merged.update(
+            out._replace(date_back=back.date_to, flex_days_back=back.flex_days_out)
+            for out, back in zip(outs, backs)
+        )
+        pairs += edge_pairs
+
+    log_info('%s pair(s) of requests merged into round trip requests' % pairs)
+    stats.incr('requests_merged', pairs)
+
+    return merged
+
+
+def get_request_order(request):
+    """
+    Sort key of backend requests, which may mix one-way and round trip ones
+
+    """
+    return (
+        request.orig,
+        request.dest,
+        request.date_to,
+        request.flex_days_out,
+        request.date_back is not None,
+        request.date_back or request.date_to,
+        request.flex_days_back,
+    )
+
+
+def get_cached_requests(edge, cache):
+    """
+    Returns the requests of an edge whose responses are in the cache and not expired
+
+    """
+    if cache is None:
+        return []
+
+    prefix = 'availability:%s:%s:' % edge
+    template = make_availability_query(BackendRequest(edge.orig, edge.dest, None))
+    requests = []
+
+    for key in cache.keys(prefix):
+        query = dict(item.split('=', 1) for item in key[len(prefix):].split('&'))
+
+        # Other kind of query, e.g. for a different amount of passengers
+        if any('%s' % template[k] != query.get(k) for k in template if k not in ('DateOut', 'FlexDaysOut')):
+            continue
+
+        requests.append(BackendRequest(
+            edge.orig,
+            edge.dest,
+            parse_isodate(query['DateOut']),
+            None,
+            int(query['FlexDaysOut']),
+        ))
+
+    return requests
+
+
+def group_rows(rows):
+    """
+    Groups the rows of `parse_flights` by edge, without duplicates (as when requested
+    windows overlap), keeping the first occurrence
+
+    :rtype: dict of edge -> list of (departure, arrival, price, flight number), see
+        `FlightStore.add_rows`
+
+    """
+    seen = set()
+    edge2rows = {}
+
+    for edge, date_out, date_in, price, flight_number in rows:
+        key = (edge, date_out, flight_number)
+
+        if key not in seen:
+            seen.add(key)
+            edge2rows.setdefault(edge, []).append((date_out, date_in, price, flight_number))
+
+    return edge2rows
+
+
+def make_availability_query(request):
+    query = {
         'ADT': 1,
         'CHD': 0,
-        'DateOut': request.date_to.isoformat(),
-        # 'DateIn': date.strftime(RAR_DATE_FORMAT),
+        'DateOut': request.date_to.isoformat() if request.date_to else None,
         'Destination': request.dest,
-        'FlexDaysOut': 6,
+        'FlexDaysOut': request.flex_days_out,
         'INF': 0,
         'Origin': request.orig,
         'RoundTrip': 'false',
@@ -259,36 +1327,229 @@ def execute_request(request):
         'ToUs': 'AGREED',
     }
 
-    # FIXME [bgusach 30.10.2016]: add support for more countries/currencies
-    res = get_json('https://desktopapps.ryanair.com/en-ie/availability', params=query)
+    if request.date_back:
+        query.update({
+            'DateIn': request.date_back.isoformat(),
+            'FlexDaysIn': request.flex_days_back,
+            'RoundTrip': 'true',
+        })
 
-    return [
-        Flight(
-            orig=trip['origin'],
-            dest=trip['destination'],
-            date_out=parse_full_date(flight['time'][0]),
-            date_in=parse_full_date(flight['time'][1]),
-            price=get_cheapest_fare_from_flight(flight),
-            flight_number=flight['flightNumber'],
-        )
-        for trip in res['trips']
-        for date in trip['dates']
-        for flight in date['flights']
-        if flight['faresLeft']
-    ]
+    return query
+
+
+def execute_request(request, cache=None, stats=null_stats, date_constraint=None):
+    """
+    :type request: BackendRequest
+    :param cache.DiskCache cache: if passed, responses are looked up and stored there
+    :type stats: stats.Stats
+    :param DateConstraint date_constraint: if passed, flights that cannot be part of
+        a solution are left out, see `parse_flights`
+    :rtype: list of (edge, departure, arrival, price, flight number), see `parse_flights`
+
+    """
+    query = make_availability_query(request)
+    key = get_request_cache_key(request, query)
+    stats.incr('backend_requests')
+
+    with stats.phase('cache'):
+        res = cache.get(key) if cache is not None else None
+
+    if res is None:
+        # FIXME [bgusach 30.10.2016]: add support for more countries/currencies
+        res = get_json('https://desktopapps.ryanair.com/en-ie/availability', params=query, stats=stats)
+
+        if cache is not None:
+            with stats.phase('cache'):
+                cache.set(key, res)
+
+    else:
+        stats.incr('cache_hits')
+
+    with stats.phase('parse'):
+        rows = parse_flights(res, date_constraint)
+
+    stats.incr('flights_parsed', len(rows))
+
+    return rows
+
+
+def parse_flights(res, date_constraint=None):
+    """
+    Returns the flights with fares left in an availability response, as rows ready
+    for `FlightStore.add_rows` preceded by their edge: no `Flight` is built for them
+
+    When a date constraint is passed, flights departing before its earliest
+    departure or arriving after its latest arrival are skipped. No leg of a
+    solution can do that, and since the timestamps of the backend sort like
+    the dates they represent, they are skipped without being parsed.
+
+    :type date_constraint: DateConstraint
+    :rtype: list of (edge, departure, arrival, price, flight number), with dates in
+        minutes since the epoch and prices in cents
+
+    """
+    if date_constraint is None:
+        earliest, latest = '', '~'
+
+    else:
+        earliest = date_constraint.earliest_out.strftime(backend_date_format)
+        latest = date_constraint.latest_in.strftime(backend_date_format)
+
+    rows = []
+
+    for trip in res['trips']:
+        edge = Edge(trip['origin'], trip['destination'])
+
+        for date in trip['dates']:
+            for flight in date['flights']:
+                if not flight['faresLeft']:
+                    continue
+
+                time_out, time_in = flight['time']
+
+                # Compared up to the seconds, so that nothing valid is skipped
+                if time_out[:19] < earliest or time_in[:19] > latest:
+                    continue
+
+                rows.append((
+                    edge,
+                    to_minutes(parse_full_date(time_out)),
+                    to_minutes(parse_full_date(time_in)),
+                    get_cheapest_fare_from_flight(flight),
+                    flight['flightNumber'],
+                ))
+
+    return rows
+
+
+def get_request_cache_key(request, query):
+    """
+    Cache key of an availability request. Origin and destination go first so that
+    all the entries of an edge share a prefix
+
+    """
+    return 'availability:%s:%s:%s' % (
+        request.orig,
+        request.dest,
+        '&'.join('%s=%s' % item for item in sorted(query.items())),
+    )
+
+
+def fetch_responses(backend_requests, concurrency=std_concurrency, execute_request=execute_request):
+    """
+    Executes the backend requests, at most `concurrency` of them at the same time,
+    and yields (request, rows) pairs in the order the responses arrive, see `parse_flights`.
+
+    If any request fails, its AppError is raised to the caller.
+
+    :param backend_requests: collection of BackendRequest
+    :param int concurrency: maximum amount of requests in flight
+    :param execute_request: function that executes a single request
+
+    """
+    backend_requests = list(backend_requests)
+
+    def fetch(req):
+        return req, execute_request(req)
+
+    if concurrency <= 1 or len(backend_requests) <= 1:
+        for req in backend_requests:
+            yield fetch(req)
+
+        return
+
+    # Imported here since it takes longer than many commands
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(min(concurrency, len(backend_requests)))
+
+    try:
+        for response in pool.imap_unordered(fetch, backend_requests):
+            yield response
+
+    finally:
+        pool.terminate()
 
 
 def get_cheapest_fare_from_flight(flight):
     fare = flight.get('regularFare') or flight.get('leisureFare') or flight['businessFare']
-    return float2decimal(fare['fares'][0]['amount'])
+
+    # Amounts come as floats, but they are whole cents
+    return int(round(fare['fares'][0]['amount'] * 100))
+
+
+backend_date_format = '%Y-%m-%dT%H:%M:%S'
 
 
 def parse_full_date(date_str):
-    return datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S.%f')
+    """
+    Parses the timestamps of the backend, e.g. 2016-10-20T09:40:00.000. They have
+    a fixed format, so the fields are sliced out instead of using strptime, which
+    is much slower and only used as fallback for anything else.
+
+    """
+    if len(date_str) == 23 and date_str[10] == 'T' and date_str[19] == '.':
+        try:
+            return datetime(
+                int(date_str[0:4]),
+                int(date_str[5:7]),
+                int(date_str[8:10]),
+                int(date_str[11:13]),
+                int(date_str[14:16]),
+                int(date_str[17:19]),
+                int(date_str[20:23]) * 1000,
+            )
+
+        except ValueError:
+            pass
+
+    return datetime.strptime(date_str, backend_date_format + '.%f')
 
 
-def get_airports():
+def get_airports(cache=None, refresh=False):
+    """
+    Returns the stations data, from the local snapshot if it is fresh enough
+
+    :param cache.DiskCache cache: where the snapshot is kept. None disables it
+    :param bool refresh: ignore the snapshot and download the stations again
+
+    """
     log_info('Finding airports')
+    return get_snapshot(cache, 'stations', download_stations, refresh=refresh)
+
+
+def get_airport_index(cache=None, refresh=False):
+    """
+    Returns the search index of the airports. It is kept in the cache along with the
+    stations data, and only built again when they change
+
+    :param cache.DiskCache cache: where the index is kept. None disables it
+    :param bool refresh: download the stations again
+    :rtype: airports.AirportIndex
+
+    """
+    if cache is not None and not refresh:
+        data = cache.get('airport-index', ttl=std_network_ttl)
+
+        if data is not None:
+            return AirportIndex.from_dict(data)
+
+    airports = get_airports(cache=cache, refresh=refresh)
+    previous = cache.get('airport-index', ttl=float('inf')) if cache is not None else None
+
+    if previous is not None and previous['fingerprint'] == get_fingerprint(airports):
+        index = AirportIndex(airports, previous['entries'], previous['fingerprint'])
+
+    else:
+        index = AirportIndex(airports)
+
+    if cache is not None:
+        cache.set('airport-index', index.as_dict())
+
+    return index
+
+
+def download_stations():
     return get_json('https://desktopapps.ryanair.com/en-ie/res/stations')
 
 
@@ -302,28 +1563,361 @@ def scan(
     max_flights=2,
     min_between_flights=std_min_between_flights,
     max_between_flights=std_max_between_flights,
-    get_network=get_airport_connections,
-    find_paths=find_paths
+    concurrency=std_concurrency,
+    cache=None,
+    top_k=None,
+    lazy=False,
+    min_stay=0,
+    max_stay=None,
+    stats=null_stats,
+    engine=std_join_engine,
+    get_network=None,
+    find_paths=find_paths_bidirectional,
+    processes=None,
 ):
     """
+    Returns all the solutions found by `scan_iter` (see its arguments), sorted by departure
+    date, see `get_solution_order`
+
+    """
+    solutions = scan_iter(
+        origs,
+        dests,
+        earliest_to,
+        latest_to,
+        earliest_back=earliest_back,
+        latest_back=latest_back,
+        max_flights=max_flights,
+        min_between_flights=min_between_flights,
+        max_between_flights=max_between_flights,
+        concurrency=concurrency,
+        cache=cache,
+        top_k=top_k,
+        lazy=lazy,
+        min_stay=min_stay,
+        max_stay=max_stay,
+        stats=stats,
+        engine=engine,
+        get_network=get_network,
+        find_paths=find_paths,
+        processes=processes,
+    )
+
+    return sorted(solutions, key=get_solution_order)
+
+
+def profile_scan(*args, **kwargs):
+    """
+    Like `scan`, but returns a (solutions, stats.Stats) tuple
+
+    """
+    stats = Stats()
+    solutions = scan(*args, stats=stats, **kwargs)
+
+    return solutions, stats
+
+
+def scan_iter(
+    origs,
+    dests,
+    earliest_to,
+    latest_to,
+    earliest_back=None,
+    latest_back=None,
+    max_flights=2,
+    min_between_flights=std_min_between_flights,
+    max_between_flights=std_max_between_flights,
+    concurrency=std_concurrency,
+    cache=None,
+    top_k=None,
+    lazy=False,
+    min_stay=0,
+    max_stay=None,
+    stats=null_stats,
+    engine=std_join_engine,
+    get_network=None,
+    find_paths=find_paths_bidirectional,
+    processes=None,
+):
+    """
+    Yields the solutions as soon as they are found, in no particular order
+
     :param dests:
     :param datetime.date earliest_to: Earliest date to fly to destination
     :param datetime.date latest_to: Latest date to fly to destination
-    :param datetime.date earliest_back: Earliest date to return
+    :param datetime.date earliest_back: Earliest date to return. If passed, round trips
+        are searched, and they come as RoundTripSolution
     :param datetime.date latest_back: Latest date to return
     :param int max_flights: Maximum number of flights allowed to reach a destination
     :param timedelta min_between_flights: Minimum time between flights
     :param timedelta max_between_flights: Maximum time between flights
+    :param int concurrency: Maximum amount of simultaneous backend requests
+    :param cache.DiskCache cache: Cache for the backend responses. None disables caching
+    :param int top_k: Only find the `top_k` cheapest solutions. They are not streamed,
+        since they are only known once the whole scan is done
+    :param bool lazy: Fetch later legs only for the dates where earlier legs have flights.
+        Not supported for round trips nor with `top_k`
+    :param int min_stay: Minimum days between arrival and return on round trips
+    :param int max_stay: Maximum days between arrival and return on round trips, or None
+    :param stats.Stats stats: Collects timings and counters of the scan phases
+    :param str engine: Join engine: 'python', 'numpy' or 'auto' (numpy if installed)
+    :param int processes: Join the flights in this amount of worker processes, for wide
+        scans. Solutions are then yielded once all of them are found. Not used with
+        `lazy` nor with `top_k` for one way trips
+    :param get_network: Function without arguments returning the route graph. Defaults
+        to `get_airport_connections` with `cache`
 
     """
-    network = get_network()
+    # Fail before any request if the engine cannot be used
+    get_join_function(engine)
+
+    if top_k is not None and top_k < 1:
+        raise AppError('Invalid amount of cheapest solutions: %s' % top_k, 'It must be 1 or more')
+
+    check_lazy(lazy, top_k, earliest_back)
+
+    with stats.phase('network'):
+        network = (get_network or partial(get_airport_connections, cache=cache))()
+
+    with stats.phase('paths'):
+        paths = list(find_paths(origs, dests, network, max_flights))
 
-    paths = list(find_paths(origs, dests, network, max_flights))
     log_info('%s path(s) found' % len(paths))
+    stats.incr('paths', len(paths))
 
     dates_to = DateInterval(earliest_to, latest_to)
+    solution_args = dict(
+        min_between_flights=min_between_flights,
+        max_between_flights=max_between_flights,
+        concurrency=concurrency,
+        cache=cache,
+        stats=stats,
+        engine=engine,
+    )
+
+    if earliest_back is not None:
+        with stats.phase('paths'):
+            back_paths = list(find_paths(dests, origs, network, max_flights))
+
+        log_info('%s return path(s) found' % len(back_paths))
+        stats.incr('paths', len(back_paths))
+
+        solutions = get_round_trip_solutions(
+            paths,
+            back_paths,
+            dates_to,
+            DateInterval(earliest_back, latest_back or earliest_back),
+            min_stay=min_stay,
+            max_stay=max_stay,
+            processes=processes,
+            **solution_args
+        )
+
+        if top_k is not None:
+            cheapest = CheapestSolutions(top_k)
+
+            for solution in solutions:
+                cheapest.add(solution)
+
+            solutions = cheapest.get_solutions()
+
+    elif top_k is not None:
+        solutions = get_cheapest_solutions(paths, dates_to, top_k, **solution_args)
+
+    else:
+        solutions = get_solutions(paths, dates_to, lazy=lazy, processes=processes, **solution_args)
+
+    for solution in solutions:
+        yield solution
+
+
+def check_lazy(lazy, top_k=None, earliest_back=None):
+    """
+    Raises AppError if the arguments of `scan_iter` ask for a lazy scan it does not
+    support, before anything is requested
+
+    """
+    if not lazy:
+        return
+
+    if top_k is not None:
+        raise AppError('Lazy scans cannot find the cheapest solutions', 'Leave out either lazy or top')
+
+    if earliest_back is not None:
+        raise AppError('Lazy scans cannot find round trips', 'Leave out either lazy or the return dates')
+
+
+std_query = dict(
+    earliest_back=None,
+    latest_back=None,
+    max_flights=2,
+    top_k=None,
+    min_stay=0,
+    max_stay=None,
+)
+
+
+def make_query(spec, max_flights=std_query['max_flights']):
+    """
+    Returns the search arguments for `scan_many` (or `scan`) described by `spec`, as
+    read from batch files or received by the server: dates as YYYY-MM-DD strings,
+    airports as lists or comma separated strings, and optional fields missing or empty
+
+    :param dict spec: with the keys origins, destinations, earliest_to, latest_to, and
+        optionally earliest_back, latest_back, max_flights, top, min_stay, max_stay
+    :param int max_flights: for specs that do not set it
 
-    solutions = get_solutions(paths, dates_to)
+    """
+    def get(key, parse, default=None):
+        value = spec.get(key)
+        return parse(value) if value not in (None, '') else default
+
+    def parse_airports(value):
+        return [x.strip().upper() for x in value.split(',')] if not isinstance(value, list) else value
+
+    try:
+        return dict(
+            origs=parse_airports(spec['origins']),
+            dests=parse_airports(spec['destinations']),
+            earliest_to=parse_isodate(spec['earliest_to']),
+            latest_to=parse_isodate(spec['latest_to']),
+            earliest_back=get('earliest_back', parse_isodate),
+            latest_back=get('latest_back', parse_isodate),
+            max_flights=get('max_flights', int, default=max_flights),
+            top_k=get('top', parse_top_k),
+            min_stay=get('min_stay', int, default=0),
+            max_stay=get('max_stay', int),
+        )
+
+    except (KeyError, TypeError, ValueError) as exc:
+        raise AppError('Invalid search: %r' % (spec, ), '%s: %s' % (type(exc).__name__, exc))
+
+
+def parse_top_k(value):
+    """
+    Parses the amount of cheapest solutions to find
 
-    return sorted(solutions, key=lambda s: s.date_out)
+    :raises ValueError: if it is not a whole number of 1 or more
 
+    """
+    top_k = int(value)
+
+    if top_k < 1:
+        raise ValueError('The amount of cheapest solutions must be 1 or more, not %s' % top_k)
+
+    return top_k
+
+
+def scan_many(
+    queries,
+    min_between_flights=std_min_between_flights,
+    max_between_flights=std_max_between_flights,
+    concurrency=std_concurrency,
+    cache=None,
+    stats=null_stats,
+    engine=std_join_engine,
+    get_network=None,
+    find_paths=find_paths_bidirectional,
+    processes=None,
+):
+    """
+    Runs several searches at once. The dates needed on every edge by all of them
+    are merged into a single fetch plan, so edges and dates shared by several
+    searches are requested only once. Then the solutions of every search are
+    found in the fetched flights.
+
+    :param queries: list of dicts with the search arguments of `scan_iter`: origs,
+        dests, earliest_to, latest_to, and optionally earliest_back, latest_back,
+        max_flights, top_k, min_stay and max_stay
+    :param int processes: join the flights in this amount of worker processes, see
+        `get_paths_solutions`
+    :param get_network: see `scan_iter`
+    :rtype: list with the solutions of every query, sorted by departure like `scan`
+
+    """
+    get_join_function(engine)
+
+    with stats.phase('network'):
+        network = (get_network or partial(get_airport_connections, cache=cache))()
+
+    searches = []
+    edge2dates_list = []
+
+    for query in queries:
+        query = dict(std_query, **query)
+        dates_to = DateInterval(query['earliest_to'], query['latest_to'])
+        dates_back = None
+        back_paths = []
+
+        with stats.phase('paths'):
+            paths = list(find_paths(query['origs'], query['dests'], network, query['max_flights']))
+
+        edge2dates_list.append(get_edge_dates(paths, dates_to))
+
+        if query['earliest_back'] is not None:
+            dates_back = get_return_dates(
+                dates_to,
+                DateInterval(query['earliest_back'], query['latest_back'] or query['earliest_back']),
+                query['min_stay'],
+                query['max_stay'],
+            )
+
+            if dates_back is not None:
+                with stats.phase('paths'):
+                    back_paths = list(find_paths(query['dests'], query['origs'], network, query['max_flights']))
+
+                edge2dates_list.append(get_edge_dates(back_paths, dates_back))
+
+        stats.incr('paths', len(paths) + len(back_paths))
+        searches.append((query, paths, back_paths, dates_to, dates_back))
+
+    log_info('%s search(es), %s path(s) found' % (len(queries), sum(len(s[1]) + len(s[2]) for s in searches)))
+
+    intervals = [interval for search in searches for interval in search[3:] if interval is not None]
+
+    if not intervals:
+        return []
+
+    store = fetch_flight_store(
+        merge_edge_dates(edge2dates_list),
+        make_date_constraint(DateInterval(min(i.start for i in intervals), max(i.end for i in intervals))),
+        round_trips=any(search[4] is not None for search in searches),
+        concurrency=concurrency,
+        cache=cache,
+        stats=stats,
+    )
+    results = []
+
+    for query, paths, back_paths, dates_to, dates_back in searches:
+        with stats.phase('join'):
+            solutions = get_paths_solutions(
+                paths,
+                store,
+                make_date_constraint(dates_to, min_between_flights, max_between_flights),
+                stats=stats,
+                engine=engine,
+                processes=processes,
+            )
+
+            if query['earliest_back'] is not None:
+                inbound = [] if dates_back is None else get_paths_solutions(
+                    back_paths,
+                    store,
+                    make_date_constraint(dates_back, min_between_flights, max_between_flights),
+                    stats=stats,
+                    engine=engine,
+                    processes=processes,
+                )
+                solutions = join_round_trips(solutions, inbound, query['min_stay'], query['max_stay'], min_between_flights)
+
+            if query['top_k'] is not None:
+                cheapest = CheapestSolutions(query['top_k'])
+
+                for solution in solutions:
+                    cheapest.add(solution)
+
+                solutions = cheapest.get_solutions()
+
+        results.append(sorted(solutions, key=get_solution_order))
+
+    return results
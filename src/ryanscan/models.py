@@ -0,0 +1,94 @@
+# coding: utf-8
+
+from __future__ import unicode_literals, absolute_import
+
+from collections import namedtuple
+from datetime import datetime
+
+
+Flight = namedtuple('Flight', ['orig', 'dest', 'date_out', 'date_in', 'price', 'flight_number'])
+DateInterval = namedtuple('DateInterval', ['start', 'end'])
+BackendRequest = namedtuple('BackedRequest', ['orig', 'dest', 'date_to', 'date_back', 'flex_days_out', 'flex_days_back'])
+BackendRequest.__new__.__defaults__ = (None, 6, 6)
+Edge = namedtuple('Edge', ['orig', 'dest'])
+Solution = namedtuple('Solution', ['orig', 'dest', 'date_out', 'date_in', 'flights', 'price'])
+RoundTripSolution = namedtuple(
+    'RoundTripSolution',
+    ['orig', 'dest', 'date_out', 'date_in', 'flights', 'price', 'outbound', 'inbound']
+)
+DateConstraint = namedtuple(
+    'DateConstraint',
+    ['earliest_out', 'latest_in', 'latest_out', 'min_between_flights', 'max_between_flights']
+)
+
+
+def make_jsonizable(obj):
+    if isinstance(obj, list):
+        return [make_jsonizable(o) for o in obj]
+
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+
+    # Imported here since it takes longer than many commands
+    from decimal import Decimal
+
+    if isinstance(obj, Decimal):
+        return float(obj)
+
+    if isinstance(obj, (Solution, Flight, RoundTripSolution)):
+        obj = obj._asdict()
+
+    if isinstance(obj, dict):
+        obj = {k: make_jsonizable(v) for k, v in obj.items()}
+
+    return obj
+
+
+def load_solution(data):
+    """
+    Inverse of `make_jsonizable` for solutions
+
+    :rtype: Solution or RoundTripSolution
+
+    """
+    if 'outbound' in data:
+        outbound = load_solution(data['outbound'])
+        inbound = load_solution(data['inbound'])
+
+        return RoundTripSolution(
+            orig=outbound.orig,
+            dest=outbound.dest,
+            date_out=outbound.date_out,
+            date_in=inbound.date_in,
+            flights=outbound.flights + inbound.flights,
+            price=outbound.price + inbound.price,
+            outbound=outbound,
+            inbound=inbound,
+        )
+
+    from decimal import Decimal
+
+    flights = [
+        Flight(
+            orig=f['orig'],
+            dest=f['dest'],
+            date_out=parse_json_date(f['date_out']),
+            date_in=parse_json_date(f['date_in']),
+            price=Decimal(repr(f['price'])),
+            flight_number=f['flight_number'],
+        )
+        for f in data['flights']
+    ]
+
+    return Solution(
+        orig=data['orig'],
+        dest=data['dest'],
+        date_out=parse_json_date(data['date_out']),
+        date_in=parse_json_date(data['date_in']),
+        flights=flights,
+        price=sum(f.price for f in flights),
+    )
+
+
+def parse_json_date(date_str):
+    return datetime.strptime(date_str, '%Y-%m-%dT%H:%M:%S')
@@ -0,0 +1,145 @@
+# coding: utf-8
+
+"""
+Join of the flights of many paths in several worker processes, for wide scans
+where it takes longer than fetching them. Paths are split in one shard per
+process, and every process only receives the flights of the edges of its shard.
+Shards come back sorted like `core.scan` sorts, and are merged in that order.
+
+The worker processes are started once and kept for the following joins, see `get_pool`.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import atexit
+import heapq
+import threading
+
+from . import core
+from .stats import null_stats
+from .stats import Stats
+
+
+def get_paths_solutions(paths, store, date_constraint, processes, stats=null_stats, engine=core.std_join_engine):
+    """
+    Returns the solutions of `core.get_paths_solutions` sorted by departure date
+    like `core.scan` sorts them, see `core.get_solution_order`
+
+    :param int processes: amount of worker processes. With less than 2 (or a
+        single path) the join is done in this process
+    :rtype: list of Solution
+
+    """
+    shards = make_shards(paths, store, processes)
+
+    if len(shards) < 2:
+        return [s for _, _, _, s in join_shard((store, list(enumerate(paths)), date_constraint, engine))[0]]
+
+    results = get_pool(processes).map(join_shard, [
+        (store.subset({edge for _, path in shard for edge in path}), shard, date_constraint, engine)
+        for shard in shards
+    ])
+
+    for _, counters in results:
+        for name, value in counters.items():
+            stats.incr(name, value)
+
+    # Keys are unique, so solutions themselves are never compared
+    return [s for _, _, _, s in heapq.merge(*[solutions for solutions, _ in results])]
+
+
+_pool = None
+_pool_processes = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(processes):
+    """
+    Returns a pool of `processes` worker processes, created on first use and reused
+    afterwards: starting them takes longer than many joins, e.g. those of every
+    search of a batch. Asking for another amount replaces it.
+
+    :rtype: multiprocessing.Pool
+
+    """
+    global _pool, _pool_processes
+
+    with _pool_lock:
+        if _pool is not None and _pool_processes == processes:
+            return _pool
+
+        if _pool is None:
+            atexit.register(close_pool)
+
+        else:
+            _pool.terminate()
+
+        # Imported here since it takes longer than many commands
+        from multiprocessing import Pool
+
+        _pool = Pool(processes)
+        _pool_processes = processes
+
+        return _pool
+
+
+def close_pool():
+    """
+    Stops the worker processes of `get_pool`, if started
+
+    """
+    global _pool, _pool_processes
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.terminate()
+
+        _pool = None
+        _pool_processes = None
+
+
+def make_shards(paths, store, processes):
+    """
+    Splits the paths in up to `processes` shards of about the same amount of work,
+    estimated by the amount of flights of their edges
+
+    :rtype: list of lists of (index of the path, path)
+
+    """
+    if not processes or processes < 2:
+        return [list(enumerate(paths))]
+
+    shards = [[] for _ in range(min(processes, len(paths)))]
+    heap = [(0, idx) for idx in range(len(shards))]
+
+    # Largest first, each one to the least loaded shard
+    for cost, idx, path in sorted(((get_path_cost(path, store), idx, path) for idx, path in enumerate(paths)), reverse=True):
+        load, shard_idx = heapq.heappop(heap)
+        shards[shard_idx].append((idx, path))
+        heapq.heappush(heap, (load + cost, shard_idx))
+
+    return [sorted(shard) for shard in shards if shard]
+
+
+def get_path_cost(path, store):
+    return sum(len(store.get(edge)) for edge in path if edge in store)
+
+
+def join_shard(args):
+    """
+    Runs in the worker processes. Returns the solutions of the paths as
+    (`core.get_solution_order`, index of the path, index within the path, solution)
+    tuples in order, and the counters of the join
+
+    """
+    store, indexed_paths, date_constraint, engine = args
+    stats = Stats()
+    solutions = [
+        (core.get_solution_order(solution), idx, pos, solution)
+        for idx, path in indexed_paths
+        for pos, solution in enumerate(core.get_path_solutions(path, store, date_constraint, stats=stats, engine=engine))
+    ]
+    solutions.sort(key=lambda item: item[:3])
+
+    return solutions, stats.counters
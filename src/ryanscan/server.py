@@ -0,0 +1,342 @@
+# coding: utf-8
+
+"""
+Local JSON API keeping the network, the airports and recent fares in memory, so
+that repeated searches do not pay for them again. It is started with
+`ryanscan serve` and used by the CLI with `--server`.
+
+Endpoints:
+    GET  /find-airports?terms=<term>&terms=<term>
+    POST /find-flights      body: search as accepted by `core.make_query`, plus
+                            the optional "lazy" flag
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import json
+import os
+import socket
+import stat
+import threading
+import time
+import traceback
+
+try:
+    from http.client import HTTPConnection
+    from http.server import BaseHTTPRequestHandler
+    from http.server import HTTPServer
+    from socketserver import ThreadingMixIn
+    from socketserver import UnixStreamServer
+    from urllib.parse import parse_qs
+    from urllib.parse import urlencode
+    from urllib.parse import urlparse
+
+except ImportError:
+    from httplib import HTTPConnection
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+    from SocketServer import UnixStreamServer
+    from urllib import urlencode
+    from urlparse import parse_qs
+    from urlparse import urlparse
+
+from . import core
+from .cache import MemoryCache
+from .cache import std_ttl
+from .models import load_solution
+from .models import make_jsonizable
+from .tools import log_info
+from .transport import CoalescingTransport
+from .transport import get_transport
+from .transport import set_transport
+
+
+std_port = 8642
+
+
+class App(object):
+    """
+    State shared by all the requests to the server
+
+    """
+
+    def __init__(
+        self,
+        cache=None,
+        fares_ttl=std_ttl,
+        concurrency=core.std_concurrency,
+        engine=core.std_join_engine,
+        clock=time.time,
+    ):
+        """
+        :param cache.DiskCache cache: where the network and airports snapshots are kept
+        :param float fares_ttl: seconds the fares are kept in memory
+
+        """
+        self.fares = MemoryCache(ttl=fares_ttl, clock=clock)
+        self.network = Snapshot(lambda: core.get_airport_connections(cache=cache), clock=clock)
+        self.airport_index = Snapshot(lambda: core.get_airport_index(cache=cache), clock=clock)
+        self.concurrency = concurrency
+        self.engine = engine
+
+    def find_flights(self, query, lazy=False):
+        """
+        :param dict query: search arguments, as returned by `core.make_query`
+
+        """
+        solutions = core.scan(
+            concurrency=self.concurrency,
+            cache=self.fares,
+            lazy=lazy,
+            engine=self.engine,
+            get_network=self.network,
+            **query
+        )
+
+        return {'solutions': make_jsonizable(solutions)}
+
+    def find_airports(self, terms):
+        return {'airports': self.airport_index().search(terms)}
+
+
+class Snapshot(object):
+    """
+    Keeps the result of `fetch` in memory, and calls it again once it is older
+    than `ttl` seconds
+
+    """
+
+    def __init__(self, fetch, ttl=core.std_network_ttl, clock=time.time):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.clock = clock
+        self._value = None
+        self._fetched = None
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self._fetched is None or self.clock() - self._fetched > self.ttl:
+                self._value = self.fetch()
+                self._fetched = self.clock()
+
+            return self._value
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    server_version = 'ryanscan'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path != '/find-airports':
+            return self.send_json(404, {'error': 'Not found: %s' % url.path})
+
+        self.handle_call(lambda: self.server.app.find_airports(parse_qs(url.query).get('terms', [])))
+
+    def do_POST(self):
+        if self.path != '/find-flights':
+            return self.send_json(404, {'error': 'Not found: %s' % self.path})
+
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            spec = json.loads(body.decode('utf-8'))
+
+        except ValueError:
+            spec = None
+
+        if not isinstance(spec, dict):
+            return self.send_json(400, {'error': 'The body must be a JSON object'})
+
+        try:
+            query = core.make_query(spec)
+            core.check_lazy(bool(spec.get('lazy')), query['top_k'], query['earliest_back'])
+
+        except core.AppError as exc:
+            return self.send_json(400, {'error': exc.msg, 'details': exc.details})
+
+        self.handle_call(lambda: self.server.app.find_flights(query, lazy=bool(spec.get('lazy'))))
+
+    def handle_call(self, call):
+        try:
+            data = call()
+
+        except core.AppError as exc:
+            return self.send_json(502, {'error': exc.msg, 'details': exc.details})
+
+        except Exception:
+            log_info(traceback.format_exc())
+            return self.send_json(500, {'error': 'Unexpected error'})
+
+        self.send_json(200, data)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '%s' % len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of Unix sockets have no address
+        return '%s' % (self.client_address[0] if self.client_address else 'unix')
+
+    def log_message(self, format, *args):
+        log_info('%s %s' % (self.address_string(), format % args))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+
+        # Expected by BaseHTTPRequestHandler
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(app, host='127.0.0.1', port=std_port, socket_path=None):
+    """
+    Returns an HTTP server for `app`, listening on `socket_path` if passed, or
+    on `host`:`port` otherwise. Requests are served in parallel threads.
+
+    """
+    if socket_path is not None:
+        # Left behind by a server that did not stop cleanly. Anything else is not ours to delete
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise core.AppError('Cannot listen on %s' % socket_path, 'It exists and is not a socket')
+
+            os.remove(socket_path)
+
+        server = ThreadingUnixHTTPServer(socket_path, RequestHandler)
+        server.socket_id = get_file_id(socket_path)
+
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+
+    server.app = app
+
+    return server
+
+
+def serve(app, host='127.0.0.1', port=std_port, socket_path=None):
+    """
+    Serves `app` until interrupted. Identical backend requests of simultaneous
+    searches are sent only once.
+
+    """
+    previous = set_transport(CoalescingTransport(get_transport()))
+    server = make_server(app, host, port, socket_path)
+
+    log_info('Serving on %s' % (socket_path or 'http://%s:%s' % (host, server.server_port)))
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+        set_transport(previous)
+
+        # Unless another server replaced it meanwhile
+        if socket_path is not None and get_file_id(socket_path) == server.socket_id:
+            os.remove(socket_path)
+
+
+def get_file_id(path):
+    """
+    Returns what identifies the file at `path`, or None if there is none. Inodes of
+    deleted files are reused, so it includes when the file was created
+
+    """
+    try:
+        info = os.stat(path)
+
+    except OSError:
+        return None
+
+    return info.st_dev, info.st_ino, info.st_ctime
+
+
+class Client(object):
+    """
+    Client of the server API
+
+    """
+
+    def __init__(self, address, timeout=300):
+        """
+        :param str address: URL of the server (e.g. http://127.0.0.1:8642), or path of
+            its Unix socket prefixed with "unix:"
+
+        """
+        self.address = address
+        self.timeout = timeout
+
+    def find_flights(self, spec):
+        """
+        :rtype: list of Solution or RoundTripSolution
+
+        """
+        data = self.request('POST', '/find-flights', json.dumps(spec).encode('utf-8'))
+        return [load_solution(s) for s in data['solutions']]
+
+    def find_airports(self, terms):
+        """
+        :rtype: list of (IATA code, stations data) tuples, best matches first
+
+        """
+        data = self.request('GET', '/find-airports?%s' % urlencode([('terms', t) for t in terms]))
+        return [tuple(airport) for airport in data['airports']]
+
+    def request(self, method, path, body=None):
+        if self.address.startswith('unix:'):
+            conn = UnixHTTPConnection(self.address[len('unix:'):], timeout=self.timeout)
+
+        else:
+            url = urlparse(self.address)
+            conn = HTTPConnection(url.hostname, url.port or 80, timeout=self.timeout)
+
+        try:
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            data = json.loads(response.read().decode('utf-8'))
+
+        except (socket.error, ValueError):
+            raise core.AppError('Impossible to communicate with the server at %s' % self.address, traceback.format_exc())
+
+        finally:
+            conn.close()
+
+        if response.status != 200:
+            raise core.AppError('Server error: %s' % data.get('error'), data.get('details'))
+
+        return data
+
+
+class UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self.sock = sock
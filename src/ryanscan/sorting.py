@@ -0,0 +1,237 @@
+# coding: utf-8
+
+"""
+Sorting of solution sets that may not fit in memory. Solutions are kept in memory
+up to a budget, and beyond it they are sorted and written to temporary files in
+runs, which are merged back when the solutions are read.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import heapq
+import itertools
+
+from .core import get_solution_order
+
+
+def get_layovers(solution):
+    """
+    Connections of the solution, not counting the stay of round trips
+
+    """
+    if getattr(solution, 'outbound', None) is not None:
+        return get_layovers(solution.outbound) + get_layovers(solution.inbound)
+
+    return len(solution.flights) - 1
+
+
+# Ties are broken by departure and flights, see `core.get_solution_order`, so that the
+# order does not depend on the order in which the solutions were found
+sort_keys = {
+    'date_out': get_solution_order,
+    'price': lambda s: (s.price, get_solution_order(s)),
+    'duration': lambda s: (s.date_in - s.date_out, get_solution_order(s)),
+    'layovers': lambda s: (get_layovers(s), get_solution_order(s)),
+}
+
+std_sort_key = 'date_out'
+std_max_memory = 512 * 1024 * 1024  # bytes
+
+# Rough memory taken by a solution and by each of its flights, in bytes
+solution_size = 250
+flight_size = 330
+
+# Maximum amount of runs merged at once, each one with an open file. Also the
+# amount of runs of a level that are merged into one of the next level
+std_max_runs = 64
+
+# Solutions written to the runs per pickle
+chunk_size = 1000
+
+
+class ExternalSorter(object):
+    """
+    Sorts the solutions added to it taking about `max_memory` bytes at most: when
+    the solutions in memory exceed it, they are sorted and written to a temporary
+    file as a run. The sort is stable.
+
+    Runs are merged in levels: once there are `max_runs` runs of a level, they are
+    merged into a single run of the next one. That way every solution is written
+    again only once per level, a few times at most, while the files left to merge
+    at the end stay few.
+
+    """
+
+    def __init__(self, key=std_sort_key, max_memory=std_max_memory, tmp_dir=None, max_runs=std_max_runs):
+        """
+        :param str key: one of `sort_keys`
+        :param int max_memory: approximate bytes taken by the solutions kept in memory
+        :param str tmp_dir: where the runs are written. Defaults to the system's
+            temporary directory. Their files are deleted once closed
+
+        """
+        if key not in sort_keys:
+            raise ValueError('Unknown sort key: %s. Use one of: %s' % (key, ', '.join(sorted(sort_keys))))
+
+        self.get_key = sort_keys[key]
+        self.max_memory = max_memory
+        self.tmp_dir = tmp_dir
+        self.max_runs = max_runs
+
+        self._buffer = []  # (key, seq, solution)
+        self._buffer_size = 0
+        self._seq = itertools.count()
+        self._runs = []  # (level, temporary file)
+
+    @property
+    def runs(self):
+        """
+        Amount of runs on disk
+
+        """
+        return len(self._runs)
+
+    def add(self, solution):
+        self._buffer.append((self.get_key(solution), next(self._seq), solution))
+        self._buffer_size += solution_size + flight_size * len(solution.flights)
+
+        if self._buffer_size > self.max_memory:
+            self._spill()
+
+    def extend(self, solutions):
+        for solution in solutions:
+            self.add(solution)
+
+    def __iter__(self):
+        """
+        Yields the solutions added so far in order. The runs are closed once all
+        of them are read
+
+        """
+        self._buffer.sort(key=lambda item: item[:2])
+        runs = [run for _, run in sorted(self._runs, key=lambda item: item[0])]
+        self._runs = []
+
+        if len(runs) > self.max_runs:
+            # The smallest runs, those of the lowest levels, are merged first
+            excess = len(runs) - self.max_runs + 1
+            runs = [self._merge_runs(runs[:excess])] + runs[excess:]
+
+        try:
+            # Keys and sequence numbers are unique, so solutions are never compared
+            for _, _, solution in heapq.merge(self._buffer, *[read_run(run) for run in runs]):
+                yield solution
+
+        finally:
+            for run in runs:
+                run.close()
+
+            self._buffer = []
+            self._buffer_size = 0
+
+    def close(self):
+        """
+        Deletes the runs not read yet
+
+        """
+        for _, run in self._runs:
+            run.close()
+
+        self._runs = []
+
+    def _spill(self):
+        self._buffer.sort(key=lambda item: item[:2])
+        self._runs.append((0, self._write_run(self._buffer)))
+        self._buffer = []
+        self._buffer_size = 0
+        level = 0
+
+        while True:
+            runs = [run for run_level, run in self._runs if run_level == level]
+
+            if len(runs) < self.max_runs:
+                break
+
+            self._runs = [item for item in self._runs if item[0] != level]
+            self._runs.append((level + 1, self._merge_runs(runs)))
+            level += 1
+
+    def _merge_runs(self, runs):
+        """
+        Returns a run with the solutions of `runs`, which are closed
+
+        """
+        try:
+            return self._write_run(heapq.merge(*[read_run(run) for run in runs]))
+
+        finally:
+            for run in runs:
+                run.close()
+
+    def _write_run(self, items):
+        import tempfile
+
+        pickle = get_pickle()
+        run = tempfile.TemporaryFile(dir=self.tmp_dir)
+        items = iter(items)
+
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+
+            if not chunk:
+                break
+
+            pickle.dump(chunk, run, pickle.HIGHEST_PROTOCOL)
+
+        run.seek(0)
+
+        return run
+
+
+def read_run(run):
+    pickle = get_pickle()
+
+    while True:
+        try:
+            chunk = pickle.load(run)
+
+        except EOFError:
+            return
+
+        for item in chunk:
+            yield item
+
+
+def get_pickle():
+    # Imported only once solutions are written to disk, most sorts do not need it
+    try:
+        import cPickle as pickle
+
+    except ImportError:
+        import pickle
+
+    return pickle
+
+
+def sort_solutions(solutions, key=std_sort_key, max_memory=std_max_memory, tmp_dir=None):
+    """
+    Yields the solutions sorted by `key`, keeping about `max_memory` bytes of them
+    in memory at most, see `ExternalSorter`. They are all read before the first is
+    yielded.
+
+    :param solutions: iterable of Solution or RoundTripSolution, e.g. `core.scan_iter(...)`
+    :param str key: date_out, price, duration (first departure to last arrival) or
+        layovers (amount of connections)
+
+    """
+    sorter = ExternalSorter(key, max_memory, tmp_dir)
+
+    try:
+        sorter.extend(solutions)
+
+        for solution in sorter:
+            yield solution
+
+    finally:
+        sorter.close()
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Stats(object):
+    """
+    Collects wall times per phase and counters of a scan. It can be shared by
+    several threads.
+
+    Times of phases running in parallel threads (e.g. HTTP requests) are added up,
+    so they can be larger than the total wall time.
+
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.timings = {}  # phase -> [seconds, calls]
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+
+        try:
+            yield
+
+        finally:
+            self.add_time(name, self.clock() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            timing = self.timings.setdefault(name, [0.0, 0])
+            timing[0] += seconds
+            timing[1] += 1
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'timings': {name: {'seconds': t[0], 'calls': t[1]} for name, t in self.timings.items()},
+                'counters': dict(self.counters),
+            }
+
+    def format(self):
+        """
+        Returns a list of human readable lines
+
+        """
+        data = self.as_dict()
+        lines = []
+
+        for name, timing in sorted(data['timings'].items(), key=lambda x: -x[1]['seconds']):
+            lines.append('%-24s %9.4fs %7s call(s)' % (name, timing['seconds'], timing['calls']))
+
+        for name, value in sorted(data['counters'].items()):
+            lines.append('%-24s %10s' % (name, value))
+
+        return lines
+
+
+class NullStats(object):
+    """
+    Stats that do not record anything, used when no profiling is requested
+
+    """
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def add_time(self, name, seconds):
+        pass
+
+    def incr(self, name, amount=1):
+        pass
+
+    def set(self, name, value):
+        pass
+
+
+null_stats = NullStats()
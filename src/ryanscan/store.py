@@ -0,0 +1,298 @@
+# coding: utf-8
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from datetime import datetime
+from datetime import timedelta
+from operator import itemgetter
+
+from .models import Edge
+from .models import Flight
+
+
+try:
+    array(str('q'))
+    int64 = str('q')
+
+except ValueError:
+    # Python 2 has no 'q' typecode, but 'l' takes 64 bits on most platforms
+    int64 = str('l')
+
+epoch = datetime(1970, 1, 1)
+
+
+def to_minutes(date):
+    """
+    Minutes since the epoch of a naive datetime, rounded down
+
+    """
+    delta = date - epoch
+    return delta.days * 1440 + delta.seconds // 60
+
+
+def to_minutes_ceil(date):
+    minutes = to_minutes(date)
+    return minutes + 1 if date.second or date.microsecond else minutes
+
+
+def from_minutes(minutes):
+    return epoch + timedelta(minutes=minutes)
+
+
+def timedelta_to_minutes(delta, ceil=False):
+    seconds = delta.days * 86400 + delta.seconds
+    minutes = seconds // 60
+
+    return minutes + 1 if ceil and (seconds % 60 or delta.microseconds) else minutes
+
+
+# Prices are kept in cents, and only become Decimal for the output. decimal is imported
+# then, since it takes longer than many commands
+def to_cents(price):
+    from decimal import Decimal
+    from decimal import ROUND_HALF_UP
+
+    return int((Decimal(price) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    from decimal import Decimal
+
+    return Decimal(cents) / 100
+
+
+class EdgeFlights(object):
+    """
+    Flights of an edge stored in columns, sorted by departure. `seqs` keeps the
+    order in which they were added.
+
+    """
+    __slots__ = ['dates_out', 'dates_in', 'prices', 'flight_numbers', 'seqs']
+
+    def __init__(self, rows=()):
+        """
+        :param rows: (departure, arrival, price, flight number id, seq) tuples, with
+            dates in minutes since the epoch and prices in cents
+
+        """
+        self.dates_out = array(int64)
+        self.dates_in = array(int64)
+        self.prices = array(int64)
+        self.flight_numbers = array(str('i'))
+        self.seqs = array(int64)
+
+        for date_out, date_in, price, flight_number, seq in sorted(rows, key=lambda r: (r[0], r[4])):
+            self.dates_out.append(date_out)
+            self.dates_in.append(date_in)
+            self.prices.append(price)
+            self.flight_numbers.append(flight_number)
+            self.seqs.append(seq)
+
+    def __len__(self):
+        return len(self.dates_out)
+
+    def rows(self):
+        return zip(self.dates_out, self.dates_in, self.prices, self.flight_numbers, self.seqs)
+
+    def find(self, earliest_out, latest_out):
+        """
+        Returns the positions of the flights departing within [earliest_out, latest_out]
+
+        """
+        return range(bisect_left(self.dates_out, earliest_out), bisect_right(self.dates_out, latest_out))
+
+    def min_price(self):
+        return min(self.prices) if self.prices else None
+
+
+class FlightStore(object):
+    """
+    Flights grouped by edge, stored as compact columns of integers instead of `Flight`
+    objects: dates as minutes since the epoch, prices in cents and flight numbers
+    interned. `Flight` objects are only built on demand.
+
+    Flights must have whole minutes and whole cents, as the backend sends them.
+
+    """
+
+    def __init__(self, unique=False):
+        """
+        :param bool unique: flights added twice to an edge (same departure and flight
+            number, as when requested windows overlap) are only kept once, the first
+            by `order`, see `add_rows`
+
+        """
+        self.unique = unique
+        self._edges = {}
+        self._pending = {}  # edge -> list of (order, rows)
+        self._flight_numbers = []
+        self._flight_number_ids = {}
+
+    @classmethod
+    def from_mapping(cls, edge2flights):
+        """
+        :param dict edge2flights: edge -> list of Flight
+
+        """
+        store = cls()
+
+        for edge, flights in edge2flights.items():
+            store.add_rows(edge, (flight_to_row(f) for f in flights))
+
+            # Edges are known even without flights
+            store._pending.setdefault(Edge(*edge), [])
+
+        return store
+
+    def add(self, flights):
+        """
+        Adds flights to their edges, after the ones already stored
+
+        """
+        edge2rows = {}
+
+        for flight in flights:
+            edge2rows.setdefault(Edge(flight.orig, flight.dest), []).append(flight_to_row(flight))
+
+        for edge, rows in edge2rows.items():
+            self.add_rows(edge, rows)
+
+    def add_rows(self, edge, rows, order=0):
+        """
+        :param rows: (departure, arrival, price, flight number) tuples, with dates in
+            minutes since the epoch and prices in cents
+        :param order: rows are stored by it, and then in the order they were added. It
+            lets rows arriving in any order, e.g. from concurrent requests, be stored
+            in a fixed one
+
+        """
+        self._pending.setdefault(Edge(*edge), []).append((order, [
+            (date_out, date_in, price, self._intern(flight_number))
+            for date_out, date_in, price, flight_number in rows
+        ]))
+
+    def _intern(self, flight_number):
+        flight_number_id = self._flight_number_ids.get(flight_number)
+
+        if flight_number_id is None:
+            flight_number_id = self._flight_number_ids[flight_number] = len(self._flight_numbers)
+            self._flight_numbers.append(flight_number)
+
+        return flight_number_id
+
+    def __contains__(self, edge):
+        return edge in self._edges or edge in self._pending
+
+    def __len__(self):
+        return sum(len(self.get(edge)) for edge in self.edges())
+
+    def edges(self):
+        return set(self._edges) | set(self._pending)
+
+    def get(self, edge):
+        """
+        :rtype: EdgeFlights
+
+        """
+        pending = self._pending.pop(edge, None)
+
+        if pending is not None:
+            current = self._edges.get(edge)
+            rows = list(current.rows()) if current is not None else []
+            first_seq = len(rows)
+            new_rows = [row for _, chunk in sorted(pending, key=itemgetter(0)) for row in chunk]
+
+            if self.unique:
+                new_rows = get_unique_rows(new_rows, seen={(row[0], row[3]) for row in rows})
+
+            rows.extend(row + (first_seq + idx, ) for idx, row in enumerate(new_rows))
+            self._edges[edge] = EdgeFlights(rows)
+
+        return self._edges[edge]
+
+    def subset(self, edges):
+        """
+        Returns a store with only the flights of `edges`, and only their flight
+        numbers, e.g. to send fewer flights to another process
+
+        :rtype: FlightStore
+
+        """
+        store = FlightStore(unique=self.unique)
+
+        for edge in edges:
+            if edge not in self:
+                continue
+
+            columns = self.get(edge)
+            subset_columns = EdgeFlights()
+            subset_columns.dates_out = array(int64, columns.dates_out)
+            subset_columns.dates_in = array(int64, columns.dates_in)
+            subset_columns.prices = array(int64, columns.prices)
+            subset_columns.seqs = array(int64, columns.seqs)
+            subset_columns.flight_numbers.extend(
+                store._intern(self._flight_numbers[x]) for x in columns.flight_numbers
+            )
+            store._edges[edge] = subset_columns
+
+        return store
+
+    def make_flight(self, edge, pos):
+        columns = self.get(edge)
+
+        return Flight(
+            orig=edge[0],
+            dest=edge[1],
+            date_out=from_minutes(columns.dates_out[pos]),
+            date_in=from_minutes(columns.dates_in[pos]),
+            price=from_cents(columns.prices[pos]),
+            flight_number=self._flight_numbers[columns.flight_numbers[pos]],
+        )
+
+    def comparable_columns(self, edge):
+        """
+        Returns the columns of the edge in a form that compares equal for the same
+        flights and prices, also against other stores, which intern flight numbers
+        differently. Cheaper than comparing their `flights`
+
+        """
+        columns = self.get(edge)
+        flight_numbers = [self._flight_numbers[x] for x in columns.flight_numbers]
+
+        return columns.dates_out, columns.dates_in, columns.prices, flight_numbers
+
+    def flights(self, edge):
+        """
+        Returns the flights of the edge in the order they were added
+
+        :rtype: list of Flight
+
+        """
+        columns = self.get(edge)
+
+        return [self.make_flight(edge, pos) for pos in sorted(range(len(columns)), key=columns.seqs.__getitem__)]
+
+
+def get_unique_rows(rows, seen):
+    """
+    Returns the rows whose departure and flight number are not in `seen`, only the
+    first of them when repeated
+
+    """
+    res = []
+
+    for row in rows:
+        key = (row[0], row[3])
+
+        if key not in seen:
+            seen.add(key)
+            res.append(row)
+
+    return res
+
+
+def flight_to_row(flight):
+    return to_minutes(flight.date_out), to_minutes(flight.date_in), to_cents(flight.price), flight.flight_number
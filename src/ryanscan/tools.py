@@ -2,9 +2,14 @@
 
 from __future__ import unicode_literals, print_function, absolute_import, division
 
+import json
+import os
 import sys
 from datetime import datetime
-import decimal
+
+
+# orjson or ujson module, False if none is installed, None until first needed
+_fast_json = None
 
 
 def log_info(msg):
@@ -41,7 +46,41 @@ def parse_isodate(string):
     return datetime.strptime(string, '%Y-%m-%d').date()
 
 
-float2decimal = decimal.Context(prec=2, rounding=decimal.ROUND_HALF_DOWN).create_decimal_from_float
+def json_loads(content):
+    """
+    Decodes a JSON document from UTF-8 bytes, with orjson or ujson if installed
+
+    """
+    fast_json = get_fast_json()
+
+    if fast_json is not None:
+        return fast_json.loads(content)
+
+    return json.loads(content.decode('utf-8'))
+
+
+def get_fast_json():
+    """
+    Returns the orjson or ujson module if installed, else None. They are imported on
+    the first call, since commands that do not decode responses do not need them
+
+    """
+    global _fast_json
+
+    if _fast_json is None:
+        try:
+            import orjson as fast_json
+
+        except ImportError:
+            try:
+                import ujson as fast_json
+
+            except ImportError:
+                fast_json = False
+
+        _fast_json = fast_json
+
+    return _fast_json or None
 
 
 def set_assoc(s, val):
@@ -52,4 +91,19 @@ def set_assoc(s, val):
     res = s.copy()
     res.add(val)
 
-    return res
\ No newline at end of file
+    return res
+
+
+def get_cache_dir():
+    """
+    Returns the directory where ryanscan keeps its cached data, following
+    the conventions of the platform
+
+    """
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(base, 'ryanscan')
@@ -0,0 +1,386 @@
+# coding: utf-8
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import random
+import threading
+import time
+
+
+std_timeout = (5, 30)  # (connect, read) in seconds
+std_retries = 3
+std_backoff = 0.5
+std_max_backoff = 10
+std_pool_size = 16
+std_max_retry_after = 60  # seconds
+
+std_rate = 10  # requests per second
+std_min_rate = 0.5
+std_max_rate = 100
+std_concurrency_limit = 4
+std_max_concurrency_limit = std_pool_size
+std_slow_latency = 5  # seconds
+
+retry_statuses = frozenset([429, 500, 502, 503, 504])
+
+
+class Transport(object):
+    """
+    HTTP client shared by all the calls to the backend. It keeps the connections
+    alive in a pool and retries idempotent GETs that fail for transient reasons.
+
+    """
+
+    def __init__(
+        self,
+        pool_size=std_pool_size,
+        retries=std_retries,
+        backoff=std_backoff,
+        max_backoff=std_max_backoff,
+        timeout=std_timeout,
+        session=None,
+        sleep=time.sleep,
+        limiter=None,
+    ):
+        """
+        :param int pool_size: maximum amount of kept-alive connections per host
+        :param int retries: how many times a failed request is retried
+        :param float backoff: base delay in seconds for the exponential backoff
+        :param float max_backoff: upper bound in seconds of a single delay
+        :param timeout: per request timeout, as accepted by `requests`
+        :param session: object with the interface of `requests.Session`
+        :param sleep: function used to wait between attempts
+        :param RateLimiter limiter: paces the requests, if passed
+
+        """
+        if session is None:
+            session = make_session(pool_size)
+
+        self.session = session
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.sleep = sleep
+        self.limiter = limiter
+
+    def get(self, url, params=None):
+        # Imported on the first request, to keep the CLI startup fast
+        import requests
+
+        attempt = 0
+
+        while True:
+            retry_after = None
+
+            try:
+                r = self.send(url, params)
+
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.retries:
+                    raise
+
+            else:
+                if r.status_code not in retry_statuses or attempt >= self.retries:
+                    return r
+
+                retry_after = get_retry_after(r)
+
+            self.sleep(self.get_backoff_delay(attempt) if retry_after is None else retry_after)
+            attempt += 1
+
+    def send(self, url, params=None):
+        """
+        Makes a single request, within the pace set by the limiter
+
+        """
+        if self.limiter is None:
+            return self.session.get(url, params=params, timeout=self.timeout)
+
+        self.limiter.acquire()
+        start = self.limiter.clock()
+
+        try:
+            r = self.session.get(url, params=params, timeout=self.timeout)
+
+        except Exception:
+            self.limiter.release(start, throttled=True)
+            raise
+
+        throttled = r.status_code in retry_statuses
+        self.limiter.release(start, throttled=throttled, retry_after=get_retry_after(r) if throttled else None)
+
+        return r
+
+    def get_backoff_delay(self, attempt):
+        """
+        Exponential backoff with "full jitter", so that parallel requests failing
+        at the same time do not retry all at once
+
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+def get_retry_after(response, clock=time.time):
+    """
+    Returns the seconds to wait that the Retry-After header of the response asks
+    for (in seconds or as a date), at most `std_max_retry_after`, or None
+
+    """
+    value = response.headers.get('Retry-After')
+
+    if not value:
+        return None
+
+    try:
+        seconds = float(value)
+
+    except ValueError:
+        from email.utils import mktime_tz
+        from email.utils import parsedate_tz
+
+        date = parsedate_tz(value)
+
+        if date is None:
+            return None
+
+        seconds = mktime_tz(date) - clock()
+
+    return min(max(seconds, 0), std_max_retry_after)
+
+
+class RateLimiter(object):
+    """
+    Paces the requests to the backend, adapting to what it can take. Shared by
+    all the threads making requests.
+
+    Requests are limited in two ways: by a token bucket refilled at `rate` tokens
+    per second, and by a maximum amount of requests in flight. Both limits follow
+    AIMD (additive increase, multiplicative decrease), like TCP congestion control:
+    every fast successful response raises them a bit, and a throttled (429),
+    failed (5xx, connection error) or slow response halves them. A Retry-After
+    pauses all the requests for that long.
+
+    """
+
+    def __init__(
+        self,
+        rate=std_rate,
+        min_rate=std_min_rate,
+        max_rate=std_max_rate,
+        concurrency_limit=std_concurrency_limit,
+        max_concurrency_limit=std_max_concurrency_limit,
+        slow_latency=std_slow_latency,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        """
+        :param float rate: initial requests per second
+        :param int concurrency_limit: initial maximum of requests in flight
+        :param float slow_latency: seconds beyond which a response is taken as a sign
+            of overload
+
+        """
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency_limit = float(concurrency_limit)
+        self.max_concurrency_limit = max_concurrency_limit
+        self.slow_latency = slow_latency
+        self.clock = clock
+        self.sleep = sleep
+        self.throttled = 0
+
+        self._tokens = 1.0
+        self._refilled = clock()
+        self._paused_until = 0
+        self._last_decrease = None
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Blocks until a request can be sent
+
+        """
+        while True:
+            with self._cond:
+                while self._in_flight >= int(self.concurrency_limit):
+                    self._cond.wait()
+
+                now = self.clock()
+                self._refill(now)
+
+                # Tolerance for the rounding of the refill, which could otherwise
+                # ask for waits too short to make the clock advance
+                if now >= self._paused_until and self._tokens >= 1 - 1e-9:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+
+            self.sleep(delay)
+
+    def release(self, start, throttled=False, retry_after=None):
+        """
+        Reports the outcome of a request allowed by `acquire`
+
+        :param float start: when it was sent, according to `clock`
+        :param bool throttled: whether the backend refused it or failed
+        :param float retry_after: seconds the backend asked to wait, if any
+
+        """
+        with self._cond:
+            now = self.clock()
+            self._in_flight -= 1
+
+            if throttled or now - start > self.slow_latency:
+                self._decrease(now, start)
+
+            else:
+                # About +1 per second (rate) and per round trip (concurrency)
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+                self.concurrency_limit = min(self.max_concurrency_limit, self.concurrency_limit + 1 / self.concurrency_limit)
+
+            if throttled:
+                self.throttled += 1
+
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+
+            self._cond.notify_all()
+
+    def _decrease(self, now, start):
+        # Requests sent before the last decrease do not decrease again: they
+        # reflect the same overload
+        if self._last_decrease is not None and start <= self._last_decrease:
+            return
+
+        self._last_decrease = now
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+        self._tokens = min(self._tokens, 1.0)
+
+    def _refill(self, now):
+        # At most one second worth of requests can be sent in a burst
+        self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+
+class CoalescingTransport(object):
+    """
+    Wraps a transport so that identical requests made at the same time by several
+    threads share a single HTTP request: the first one is sent, and the others wait
+    for its response.
+
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @property
+    def limiter(self):
+        return getattr(self.transport, 'limiter', None)
+
+    def get(self, url, params=None):
+        key = url, tuple(sorted((params or {}).items()))
+
+        with self._lock:
+            call = self._in_flight.get(key)
+            is_first = call is None
+
+            if is_first:
+                call = self._in_flight[key] = _PendingCall()
+
+            else:
+                self.coalesced += 1
+
+        if not is_first:
+            return call.wait()
+
+        try:
+            call.result = self.transport.get(url, params=params)
+
+        except Exception as exc:
+            call.error = exc
+            raise
+
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+            call.done.set()
+
+        return call.result
+
+
+class _PendingCall(object):
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self):
+        self.done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+def make_session(pool_size=std_pool_size):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+    })
+
+    return session
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    Returns the transport used by default by `core.get_json`, creating it if needed.
+    The first calls may come from several threads at once, and all of them must get
+    the same transport, so that they share its rate limiter
+
+    """
+    global _transport
+
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport(limiter=RateLimiter())
+
+    return _transport
+
+
+def set_transport(transport):
+    """
+    Replaces the default transport (e.g. with a fake one for tests), and returns
+    the previous one
+
+    """
+    global _transport
+
+    with _transport_lock:
+        previous, _transport = _transport, transport
+
+    return previous
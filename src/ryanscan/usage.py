@@ -0,0 +1,141 @@
+# coding: utf-8
+
+"""
+Parsing of the command line with docopt, caching the usage pattern. Building the
+pattern out of the usage text takes most of docopt's time, more than parsing the
+arguments themselves, so it is built once per version of the text and kept as JSON
+in the cache directory.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+import io
+import json
+import os
+import sys
+import zlib
+
+import docopt
+
+from .tools import get_cache_dir
+
+
+# The cache relies on docopt's internals, which are only known for this version
+supported_version = '0.6.2'
+
+_leaf_classes = ['Option', 'Argument', 'Command']
+_parent_classes = ['Required', 'Optional', 'AnyOptions', 'OneOrMore', 'Either']
+
+_specs = {}  # cache file -> (pattern, options), of this process
+
+
+def parse_args(doc, argv=None, cache_dir=None):
+    """
+    Same as `docopt.docopt(doc, argv)`
+
+    :param str cache_dir: where the pattern is cached. Defaults to the user's cache directory
+
+    """
+    if docopt.__version__ != supported_version:
+        return docopt.docopt(doc, argv)
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    docopt.DocoptExit.usage = docopt.printable_usage(doc)
+    pattern, options = get_spec(doc, cache_dir)
+
+    argv = docopt.parse_argv(docopt.TokenStream(argv, docopt.DocoptExit), list(options), False)
+    docopt.extras(True, None, argv, doc)
+    matched, left, collected = pattern.match(argv)
+
+    if matched and left == []:
+        return docopt.Dict((a.name, a.value) for a in (pattern.flat() + collected))
+
+    raise docopt.DocoptExit()
+
+
+def get_spec(doc, cache_dir=None):
+    """
+    Returns the fixed usage pattern of `doc` and its options, from the cache if
+    possible, as built by `docopt.docopt`
+
+    """
+    key = '%08x' % (zlib.crc32(('%s\n%s' % (docopt.__version__, doc)).encode('utf-8')) & 0xffffffff)
+    path = os.path.join(cache_dir or get_cache_dir(), 'usage-%s.json' % key)
+
+    if path in _specs:
+        return _specs[path]
+
+    try:
+        with io.open(path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        spec = load_pattern(data['pattern']), [load_pattern(o) for o in data['options']]
+
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        spec = build_spec(doc)
+        store_spec(path, spec)
+
+    _specs[path] = spec
+
+    return spec
+
+
+def build_spec(doc):
+    options = docopt.parse_defaults(doc)
+    pattern = docopt.parse_pattern(docopt.formal_usage(docopt.printable_usage(doc)), options)
+
+    pattern_options = set(pattern.flat(docopt.Option))
+
+    for any_options in pattern.flat(docopt.AnyOptions):
+        any_options.children = list(set(docopt.parse_defaults(doc)) - pattern_options)
+
+    return pattern.fix(), options
+
+
+def store_spec(path, spec):
+    """
+    Writes the spec to `path`, if possible. Without cache, the pattern is just built
+    again by the next process
+
+    """
+    pattern, options = spec
+    tmp_path = '%s.%s' % (path, os.getpid())
+
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'pattern': dump_pattern(pattern), 'options': [dump_pattern(o) for o in options]}))
+
+        os.rename(tmp_path, path)
+
+    except (IOError, OSError):
+        pass
+
+
+def dump_pattern(pattern):
+    name = type(pattern).__name__
+
+    if name == 'Option':
+        return [name, pattern.short, pattern.long, pattern.argcount, pattern.value]
+
+    if name in _leaf_classes:
+        return [name, pattern.name, pattern.value]
+
+    return [name, [dump_pattern(child) for child in pattern.children]]
+
+
+def load_pattern(data):
+    name, args = data[0], data[1:]
+
+    if name in _leaf_classes:
+        return getattr(docopt, name)(*args)
+
+    if name in _parent_classes:
+        return getattr(docopt, name)(*[load_pattern(child) for child in args[0]])
+
+    raise ValueError('Unknown pattern: %s' % name)
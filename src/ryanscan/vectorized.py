@@ -0,0 +1,113 @@
+# coding: utf-8
+
+"""
+Join of the flights of a path done on whole NumPy arrays at once. NumPy is an
+optional dependency (``pip install ryanscan[numpy]``); `available` tells whether
+it is installed. It is only imported once a join needs it, since importing it
+takes longer than most CLI commands.
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+from .stats import null_stats
+from .store import timedelta_to_minutes
+from .store import to_cents
+from .store import to_minutes
+from .store import to_minutes_ceil
+
+try:
+    from importlib.util import find_spec
+
+except ImportError:
+    # Python 2
+    from pkgutil import find_loader as find_spec
+
+
+available = find_spec('numpy') is not None
+
+
+def join_path(store, path, date_constraint, max_price=None, stats=null_stats):
+    """
+    Same as `core.join_path`, but every leg is joined in bulk: the connection
+    windows of all partial itineraries are looked up with a single `searchsorted`,
+    and the candidates are expanded and filtered with array masks.
+
+    :type store: store.FlightStore
+    :param list of Edge path:
+    :type date_constraint: DateConstraint
+    :param stats.Stats stats: records how many candidate flights are checked
+    :rtype: list of tuple of int
+
+    """
+    import numpy as np
+
+    legs = [store.get(edge) for edge in path]
+
+    if not legs or not all(legs):
+        return []
+
+    columns = [
+        (np.asarray(leg.dates_out), np.asarray(leg.dates_in), np.asarray(leg.prices), np.asarray(leg.seqs))
+        for leg in legs
+    ]
+
+    latest_in = to_minutes(date_constraint.latest_in)
+    min_between = timedelta_to_minutes(date_constraint.min_between_flights, ceil=True)
+    max_between = timedelta_to_minutes(date_constraint.max_between_flights)
+
+    if max_price is None:
+        max_cents = None
+
+    else:
+        max_cents = to_cents(max_price)
+
+        # Cheapest possible price of the legs from a given one up to the end
+        rest_min_prices = [0] * (len(legs) + 1)
+
+        for leg_idx in reversed(range(len(legs))):
+            rest_min_prices[leg_idx] = rest_min_prices[leg_idx + 1] + legs[leg_idx].min_price()
+
+    dates_out, dates_in, prices, _ = columns[0]
+    start = np.searchsorted(dates_out, to_minutes_ceil(date_constraint.earliest_out), side='left')
+    end = np.searchsorted(dates_out, to_minutes(date_constraint.latest_out), side='right')
+    candidates = np.arange(start, max(start, end))
+    checked = len(candidates)
+
+    mask = dates_in[candidates] <= latest_in
+
+    if max_cents is not None:
+        mask &= prices[candidates] + rest_min_prices[1] <= max_cents
+
+    positions = candidates[mask].reshape(-1, 1)
+    partial_prices = prices[positions[:, 0]]
+
+    for leg_idx in range(1, len(legs)):
+        dates_out, dates_in, prices, _ = columns[leg_idx]
+        arrivals = columns[leg_idx - 1][1][positions[:, -1]]
+
+        starts = np.searchsorted(dates_out, arrivals + min_between, side='left')
+        ends = np.maximum(starts, np.searchsorted(dates_out, arrivals + max_between, side='right'))
+        counts = ends - starts
+        total = int(counts.sum())
+        checked += total
+
+        # One row per (partial itinerary, candidate flight)
+        partial_idxs = np.repeat(np.arange(len(positions)), counts)
+        candidates = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        extended_prices = partial_prices[partial_idxs] + prices[candidates]
+
+        mask = dates_in[candidates] <= latest_in
+
+        if max_cents is not None:
+            mask &= extended_prices + rest_min_prices[leg_idx + 1] <= max_cents
+
+        positions = np.column_stack([positions[partial_idxs[mask]], candidates[mask]])
+        partial_prices = extended_prices[mask]
+
+    stats.incr('combinations_checked', checked)
+
+    # Same order as the pure Python join: by the insertion order of every leg
+    order = np.lexsort([columns[leg_idx][3][positions[:, leg_idx]] for leg_idx in reversed(range(len(legs)))])
+
+    return [tuple(row) for row in positions[order].tolist()]
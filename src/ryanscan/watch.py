@@ -0,0 +1,202 @@
+# coding: utf-8
+
+"""
+Repeated scans of the same search reporting only what changed since the previous one
+
+"""
+
+from __future__ import unicode_literals, division, absolute_import, print_function
+
+from collections import namedtuple
+from functools import partial
+
+from . import core
+from .models import DateInterval
+from .stats import null_stats
+
+
+Changes = namedtuple('Changes', ['added', 'removed', 'repriced'])
+
+
+class Watcher(object):
+    """
+    Runs a search once per `poll`, keeping the solutions found and the flights they
+    were found in:
+
+    - Backend requests are planned with the cache like any scan, so only the ones
+      without a fresh cached response are sent again.
+    - Paths whose edges got exactly the same flights as in the previous poll keep
+      their previous solutions instead of being joined again.
+    - Only the solutions that appeared, disappeared or changed their price are
+      returned.
+
+    """
+
+    def __init__(
+        self,
+        query,
+        min_between_flights=core.std_min_between_flights,
+        max_between_flights=core.std_max_between_flights,
+        concurrency=core.std_concurrency,
+        cache=None,
+        stats=null_stats,
+        engine=core.std_join_engine,
+        get_network=None,
+        find_paths=core.find_paths_bidirectional,
+    ):
+        """
+        :param dict query: search arguments, as accepted by `core.scan_many`
+        :param cache.DiskCache cache: responses younger than its ttl are not requested
+            again. Without cache, every poll requests everything
+
+        """
+        self.query = dict(core.std_query, **query)
+        self.min_between_flights = min_between_flights
+        self.max_between_flights = max_between_flights
+        self.concurrency = concurrency
+        self.cache = cache
+        self.stats = stats
+        self.engine = engine
+        self.get_network = get_network
+        self.find_paths = find_paths
+
+        self.solutions = None  # solution key -> solution, of the last poll
+        self._edge2columns = {}  # edge -> `FlightStore.comparable_columns` of the last poll
+        self._path2solutions = {}  # (path, date constraint) -> solutions of the last poll
+
+    def poll(self):
+        """
+        Scans again, and returns the changes since the previous poll. On the first
+        one, all the solutions are added
+
+        :rtype: Changes
+
+        """
+        core.get_join_function(self.engine)
+        query, stats = self.query, self.stats
+
+        with stats.phase('network'):
+            network = (self.get_network or partial(core.get_airport_connections, cache=self.cache))()
+
+        with stats.phase('paths'):
+            paths = list(self.find_paths(query['origs'], query['dests'], network, query['max_flights']))
+
+        dates_to = DateInterval(query['earliest_to'], query['latest_to'])
+        edge2dates_list = [core.get_edge_dates(paths, dates_to)]
+        searches = [(paths, dates_to)]
+        round_trips = query['earliest_back'] is not None
+
+        if round_trips:
+            dates_back = core.get_return_dates(
+                dates_to,
+                DateInterval(query['earliest_back'], query['latest_back'] or query['earliest_back']),
+                query['min_stay'],
+                query['max_stay'],
+            )
+
+            if dates_back is not None:
+                with stats.phase('paths'):
+                    back_paths = list(self.find_paths(query['dests'], query['origs'], network, query['max_flights']))
+
+                edge2dates_list.append(core.get_edge_dates(back_paths, dates_back))
+                searches.append((back_paths, dates_back))
+
+        intervals = [interval for _, interval in searches]
+        store = core.fetch_flight_store(
+            core.merge_edge_dates(edge2dates_list),
+            core.make_date_constraint(DateInterval(min(i.start for i in intervals), max(i.end for i in intervals))),
+            round_trips=round_trips,
+            concurrency=self.concurrency,
+            cache=self.cache,
+            stats=stats,
+        )
+
+        changed_edges = self._update_edges(store)
+        path2solutions = {}
+        search_solutions = []
+
+        with stats.phase('join'):
+            for search_paths, interval in searches:
+                constraint = core.make_date_constraint(interval, self.min_between_flights, self.max_between_flights)
+                solutions = []
+
+                for path in search_paths:
+                    key = tuple(path), constraint
+
+                    if key in self._path2solutions and not changed_edges.intersection(path):
+                        stats.incr('paths_reused')
+                        path2solutions[key] = self._path2solutions[key]
+
+                    else:
+                        path2solutions[key] = core.get_path_solutions(path, store, constraint, stats=stats, engine=self.engine)
+
+                    solutions.extend(path2solutions[key])
+
+                search_solutions.append(solutions)
+
+            # Paths no longer searched are forgotten
+            self._path2solutions = path2solutions
+            solutions = search_solutions[0]
+
+            if round_trips:
+                inbound = search_solutions[1] if len(search_solutions) > 1 else []
+                solutions = core.join_round_trips(solutions, inbound, query['min_stay'], query['max_stay'], self.min_between_flights)
+
+            if query['top_k'] is not None:
+                cheapest = core.CheapestSolutions(query['top_k'])
+
+                for solution in solutions:
+                    cheapest.add(solution)
+
+                solutions = cheapest.get_solutions()
+
+        current = {get_solution_key(s): s for s in solutions}
+        changes = diff_solutions(self.solutions or {}, current)
+        self.solutions = current
+
+        return changes
+
+    def _update_edges(self, store):
+        """
+        Keeps the flights of every edge of the store, and returns the edges whose
+        flights are not the same as in the previous poll
+
+        """
+        edge2columns = {edge: store.comparable_columns(edge) for edge in store.edges()}
+        changed = {edge for edge, columns in edge2columns.items() if self._edge2columns.get(edge) != columns}
+        self._edge2columns = edge2columns
+
+        return changed
+
+
+def get_solution_key(solution):
+    """
+    What identifies a solution across scans: its flights, regardless of their price
+
+    """
+    return tuple((f.orig, f.dest, f.date_out, f.flight_number) for f in solution.flights)
+
+
+def diff_solutions(previous, current):
+    """
+    :param dict previous: solution key -> solution
+    :param dict current: solution key -> solution
+    :rtype: Changes, with added and removed solutions, and (old, new) pairs of
+        repriced ones, all sorted by departure, see `core.get_solution_order`
+
+    """
+    def get_pair_order(pair):
+        return core.get_solution_order(pair[1])
+
+    return Changes(
+        added=sorted((s for key, s in current.items() if key not in previous), key=core.get_solution_order),
+        removed=sorted((s for key, s in previous.items() if key not in current), key=core.get_solution_order),
+        repriced=sorted(
+            (
+                (previous[key], s)
+                for key, s in current.items()
+                if key in previous and previous[key].price != s.price
+            ),
+            key=get_pair_order,
+        ),
+    )
@@ -2,16 +2,45 @@
 
 from __future__ import unicode_literals, absolute_import, division, print_function
 
+import json
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
 from datetime import datetime as dt
 from datetime import timedelta as delta
 from unittest import TestCase
+from unittest import skipIf
 
 from ryanscan import core
+from ryanscan import tools
+from ryanscan import server
+from ryanscan import transport
+from ryanscan import vectorized
+from ryanscan import parallel
+from ryanscan import sorting
+from ryanscan import archive
+from ryanscan import cache as cache_module
+from ryanscan import __main__ as cli
+from ryanscan import usage
+from ryanscan.airports import AirportIndex
+from ryanscan.cache import DiskCache
+from ryanscan.cache import MemoryCache
+from ryanscan.stats import Stats
+from ryanscan.store import FlightStore
+from ryanscan.store import from_cents
+from ryanscan.store import to_cents
+from ryanscan.store import to_minutes
 from ryanscan.core import DateConstraint
 from ryanscan.core import Solution
 from ryanscan.core import BackendRequest
 from ryanscan.core import Flight as F
 from ryanscan.core import Edge as E
+from ryanscan.watch import Changes
+from ryanscan.watch import Watcher
 
 
 class Tests(TestCase):
@@ -146,18 +175,42 @@ class Tests(TestCase):
         }
         self.assertEqual(expected, res)
 
+    def test_3d(self):
+        """
+        find_paths_bidirectional finds the same paths as find_paths
+
+        """
+        rnd = random.Random(3)
+        nodes = ['N%s' % x for x in range(30)]
+        random_network = {n: set(rnd.sample([x for x in nodes if x != n], 4)) for n in nodes}
+
+        cases = [
+            (self.network, ['A'], ['F']),
+            (self.network, ['A', 'B'], ['F', 'E']),
+            (self.network, ['E'], ['A', 'B']),
+            (random_network, nodes[:3], nodes[-3:]),
+            (random_network, nodes[:1], nodes[1:2]),
+        ]
+
+        for network, origs, targets in cases:
+            for max_flights in range(1, 6):
+                expected = set(map(tuple, core.find_paths(origs, targets, network, max_flights)))
+                res = set(map(tuple, core.find_paths_bidirectional(origs, targets, network, max_flights)))
+
+                self.assertEqual(expected, res)
+
     def test_6(self):
         paths = [[E('A', 'B'), E('B', 'C')], [E('D', 'E')]]
-        dates_to = core.DateInterval(dt(2016, 10, 10), dt(2016, 10, 20))
-        result = core.calculate_needed_requests(paths, dates_to)
+        dates_to = core.DateInterval(dt(2016, 10, 10).date(), dt(2016, 10, 20).date())
+        result = core.plan_requests(core.get_edge_dates(paths, dates_to))
 
         self.assertEqual({
-            BackendRequest('A', 'B', dt(2016, 10, 10), None),
-            BackendRequest('A', 'B', dt(2016, 10, 17), None),
-            BackendRequest('B', 'C', dt(2016, 10, 10), None),
-            BackendRequest('B', 'C', dt(2016, 10, 17), None),
-            BackendRequest('D', 'E', dt(2016, 10, 10), None),
-            BackendRequest('D', 'E', dt(2016, 10, 17), None),
+            BackendRequest('A', 'B', dt(2016, 10, 10).date(), None),
+            BackendRequest('A', 'B', dt(2016, 10, 17).date(), None, 3),
+            BackendRequest('B', 'C', dt(2016, 10, 10).date(), None),
+            BackendRequest('B', 'C', dt(2016, 10, 17).date(), None, 3),
+            BackendRequest('D', 'E', dt(2016, 10, 10).date(), None),
+            BackendRequest('D', 'E', dt(2016, 10, 17).date(), None, 3),
         }, result)
 
     def test_7(self):
@@ -166,34 +219,72 @@ class Tests(TestCase):
 
         """
         paths = [[E('A', 'B'), E('B', 'C')], [E('D', 'E')]]
-        dates_to = core.DateInterval(dt(2016, 10, 10), dt(2016, 10, 10))
-        result = core.calculate_needed_requests(paths, dates_to)
+        dates_to = core.DateInterval(dt(2016, 10, 10).date(), dt(2016, 10, 10).date())
+        result = core.plan_requests(core.get_edge_dates(paths, dates_to))
 
         self.assertEqual({
-            BackendRequest('A', 'B', dt(2016, 10, 10), None),
-            BackendRequest('B', 'C', dt(2016, 10, 10), None),
-            BackendRequest('D', 'E', dt(2016, 10, 10), None),
+            BackendRequest('A', 'B', dt(2016, 10, 10).date(), None, 0),
+            BackendRequest('B', 'C', dt(2016, 10, 10).date(), None, 0),
+            BackendRequest('D', 'E', dt(2016, 10, 10).date(), None, 0),
         }, result)
 
     def test_8(self):
         """
-        Query calculator works fine over longer time periods
+        Query calculator works fine over longer time periods, up to the last day
 
         """
         paths = [[E('A', 'B')]]
-        dates_to = core.DateInterval(dt(2016, 10, 1), dt(2016, 11, 15))
-        result = core.calculate_needed_requests(paths, dates_to)
+        dates_to = core.DateInterval(dt(2016, 10, 1).date(), dt(2016, 11, 15).date())
+        result = core.plan_requests(core.get_edge_dates(paths, dates_to))
 
         self.assertEqual({
-            BackendRequest('A', 'B', dt(2016, 10, 1), None),
-            BackendRequest('A', 'B', dt(2016, 10, 8), None),
-            BackendRequest('A', 'B', dt(2016, 10, 15), None),
-            BackendRequest('A', 'B', dt(2016, 10, 22), None),
-            BackendRequest('A', 'B', dt(2016, 10, 29), None),
-            BackendRequest('A', 'B', dt(2016, 11, 5), None),
-            BackendRequest('A', 'B', dt(2016, 11, 12), None),
+            BackendRequest('A', 'B', dt(2016, 10, 1).date(), None),
+            BackendRequest('A', 'B', dt(2016, 10, 8).date(), None),
+            BackendRequest('A', 'B', dt(2016, 10, 15).date(), None),
+            BackendRequest('A', 'B', dt(2016, 10, 22).date(), None),
+            BackendRequest('A', 'B', dt(2016, 10, 29).date(), None),
+            BackendRequest('A', 'B', dt(2016, 11, 5).date(), None),
+            BackendRequest('A', 'B', dt(2016, 11, 12).date(), None, 3),
         }, result)
 
+    def test_8b(self):
+        """
+        plan_requests: windows are shrunk to the needed dates
+
+        """
+        d = dt(2016, 10, 10).date()
+        edge2dates = {
+            E('A', 'B'): {d + delta(days=x) for x in range(10)},
+            E('B', 'C'): {d, d + delta(days=3)},
+        }
+
+        self.assertEqual(core.plan_requests(edge2dates), {
+            BackendRequest('A', 'B', d, None, 6),
+            BackendRequest('A', 'B', d + delta(days=7), None, 2),
+            BackendRequest('B', 'C', d, None, 3),
+        })
+
+    def test_8c(self):
+        """
+        plan_requests: dates covered by cached responses are requested in their cached windows
+
+        """
+        cache = DiskCache(self.make_tmp_path('cache.sqlite'))
+        d = dt(2016, 10, 10).date()
+        cached_req = BackendRequest('A', 'B', d + delta(days=2), None, 6)
+        other_passengers = dict(core.make_availability_query(cached_req), ADT=2)
+
+        cache.set(core.get_request_cache_key(cached_req, core.make_availability_query(cached_req)), {})
+        cache.set(core.get_request_cache_key(cached_req, other_passengers), {})
+
+        result = core.plan_requests({E('A', 'B'): {d + delta(days=x) for x in range(10)}}, cache=cache)
+
+        self.assertEqual(result, {
+            cached_req,
+            BackendRequest('A', 'B', d, None, 1),
+            BackendRequest('A', 'B', d + delta(days=9), None, 0),
+        })
+
     def test_9(self):
         """
         are_flights_compatible: positive single flight
@@ -386,10 +477,1396 @@ class Tests(TestCase):
 
         self.assertEqual(result, expected)
 
+    def test_18(self):
+        """
+        fetch_responses: concurrent fetching returns the same flights as sequential fetching
+
+        """
+        reqs = [BackendRequest('A', 'B', dt(2016, 10, 10 + x), None) for x in range(8)]
+
+        def execute_request(req):
+            return [make_flight(date_out=req.date_to), make_flight(date_out=req.date_to, flight_number='xyz')]
+
+        sequential = dict(core.fetch_responses(reqs, concurrency=1, execute_request=execute_request))
+        concurrent = dict(core.fetch_responses(reqs, concurrency=4, execute_request=execute_request))
+
+        self.assertEqual(sum(len(flights) for flights in sequential.values()), 16)
+        self.assertEqual(sequential, concurrent)
+
+    def test_19(self):
+        """
+        fetch_responses: the AppError of a failing request reaches the caller
+
+        """
+        reqs = [BackendRequest('A', 'B', dt(2016, 10, 10 + x), None) for x in range(8)]
+
+        def execute_request(req):
+            if req.date_to.day == 13:
+                raise core.AppError('boom', req)
+
+            return [make_flight()]
+
+        with self.assertRaises(core.AppError) as ctx:
+            list(core.fetch_responses(reqs, concurrency=4, execute_request=execute_request))
+
+        self.assertEqual(ctx.exception.details, reqs[3])
+
+    def test_20(self):
+        """
+        Transport: transient backend errors are retried with backoff
+
+        """
+        session = FakeSession([FakeResponse(503), FakeResponse(502), FakeResponse(200, {'ok': 1})])
+        delays = []
+        t = transport.Transport(session=session, retries=3, sleep=delays.append)
+
+        r = t.get('http://backend', params={'a': 1})
+
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(len(session.calls), 3)
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(all(0 <= d <= t.max_backoff for d in delays))
+
+    def test_21(self):
+        """
+        get_json: the response of the last attempt is reported when retries are exhausted
+
+        """
+        session = FakeSession([FakeResponse(503)] * 3)
+        t = transport.Transport(session=session, retries=2, sleep=lambda x: None)
+
+        with self.assertRaises(core.AppError):
+            core.get_json('http://backend', transport=t)
+
+        self.assertEqual(len(session.calls), 3)
+
+    def test_22(self):
+        """
+        get_json: uses the shared transport, which can be swapped
+
+        """
+        session = FakeSession([FakeResponse(200, {'airports': []})])
+        self.use_transport(transport.Transport(session=session))
+
+        self.assertEqual(core.get_json('http://backend'), {'airports': []})
+
+    def test_23(self):
+        """
+        DiskCache: entries expire after their TTL
+
+        """
+        now = [1000]
+        cache = DiskCache(self.make_tmp_path('cache.sqlite'), ttl=60, clock=lambda: now[0])
+        cache.set('k', {'a': [1, 2]})
+
+        self.assertEqual(cache.get('k'), {'a': [1, 2]})
+
+        now[0] += 61
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(cache.get('k', ttl=120), {'a': [1, 2]})
+
+    def test_24(self):
+        """
+        DiskCache: least recently used entries are evicted when over the size cap
+
+        """
+        now = [1000]
+        path = self.make_tmp_path('cache.sqlite')
+        cache = DiskCache(path, clock=lambda: now[0])
+
+        for key in 'abc':
+            now[0] += 1
+            cache.set(key, key * 10)
+
+        entry_size = len(cache_module.encode_value('a' * 10))
+
+        now[0] += 1
+        cache.get('a')
+
+        cache = DiskCache(path, max_size=entry_size * 2, clock=lambda: now[0])
+        now[0] += 1
+        cache.set('d', 'd' * 10)
+
+        self.assertEqual(cache.get('a'), 'a' * 10)
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.get('d'), 'd' * 10)
+
+    def test_25(self):
+        """
+        execute_request: repeated requests are answered by the cache
+
+        """
+        response = FakeResponse(200, make_availability_data('A', 'B', [('2016-10-10T10:00:00.000', '2016-10-10T12:00:00.000', 20)]))
+        session = FakeSession([response])
+        cache = DiskCache(self.make_tmp_path('cache.sqlite'))
+        self.use_transport(transport.Transport(session=session))
+        req = BackendRequest('A', 'B', dt(2016, 10, 10).date(), None)
+
+        first = core.execute_request(req, cache=cache)
+        second = core.execute_request(req, cache=cache)
+
+        self.assertEqual(len(session.calls), 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first[0][:2], (E('A', 'B'), to_minutes(dt(2016, 10, 10, 10))))
+
+    def test_26(self):
+        """
+        get_airport_connections: the network is downloaded once and then read from the snapshot
+
+        """
+        cache = DiskCache(self.make_tmp_path('cache.sqlite'))
+        session = FakeSession([FakeResponse(200, self.stations_data)] * 2)
+        self.use_transport(transport.Transport(session=session))
+
+        first = core.get_airport_connections(cache=cache)
+        second = core.get_airport_connections(cache=cache)
+        self.assertEqual(len(session.calls), 1)
+
+        core.get_airport_connections(cache=cache, refresh=True)
+        self.assertEqual(len(session.calls), 2)
+
+        self.assertEqual(first, core.get_connections_from_stations_data(self.stations_data))
+        self.assertEqual(first, second)
+
+    def test_27(self):
+        """
+        get_path_solutions: the indexed join gives exactly the same solutions as checking
+        every combination of flights
+
+        """
+        rnd = random.Random(1)
+        path = [E('A', 'B'), E('B', 'C'), E('C', 'D')]
+        edge2flights = {
+            edge: [make_random_flight(rnd, edge) for _ in range(40)]
+            for edge in path
+        }
+        constraint = DateConstraint(
+            earliest_out=dt(2016, 1, 2),
+            latest_out=dt(2016, 1, 5, 23, 59, 59),
+            latest_in=dt(2016, 1, 5, 23, 59, 59),
+            min_between_flights=delta(hours=1),
+            max_between_flights=delta(hours=5),
+        )
+
+        for sub_path in [path[:1], path[:2], path]:
+            expected = core.get_path_solutions(sub_path, edge2flights, constraint, are_flights_compatible=core.are_flights_compatible)
+            result = core.get_path_solutions(sub_path, edge2flights, constraint)
+
+            self.assertEqual(expected, result)
+
+        self.assertTrue(result)
+
+    def test_28(self):
+        """
+        scan_iter: yields the same solutions as scan, which sorts them by departure
+
+        """
+        backend = FakeBackend({
+            E('A', 'B'): [('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 30)],
+            E('B', 'C'): [
+                ('2016-10-10T11:30:00.000', '2016-10-10T13:00:00.000', 20),
+                ('2016-10-11T11:30:00.000', '2016-10-11T13:00:00.000', 20),
+            ],
+            E('A', 'C'): [
+                ('2016-10-09T07:00:00.000', '2016-10-09T09:00:00.000', 90),
+                ('2016-10-12T07:00:00.000', '2016-10-12T09:00:00.000', 80),
+            ],
+        })
+        scan_args = dict(
+            origs=['A'],
+            dests=['C'],
+            earliest_to=dt(2016, 10, 8).date(),
+            latest_to=dt(2016, 10, 12).date(),
+            max_flights=2,
+            concurrency=3,
+            get_network=lambda: self.network_abc,
+        )
+        self.use_transport(transport.Transport(session=backend))
+
+        streamed = list(core.scan_iter(**scan_args))
+        solutions = core.scan(**scan_args)
+
+        self.assertEqual(sorted(streamed, key=core.get_solution_order), solutions)
+        self.assertEqual(
+            [(s.date_out, s.price) for s in solutions],
+            [(dt(2016, 10, 9, 7), 90), (dt(2016, 10, 10, 8), 50), (dt(2016, 10, 12, 7), 80)],
+        )
+
+    def test_29(self):
+        """
+        get_cheapest_solutions: same result as taking the cheapest of all the solutions
+
+        """
+        rnd = random.Random(5)
+        edges = [E('A', 'B'), E('B', 'C'), E('A', 'C')]
+        backend = FakeBackend({
+            edge: [make_random_availability(rnd, dt(2016, 10, 10)) for _ in range(30)]
+            for edge in edges
+        })
+        paths = [[E('A', 'C')], [E('A', 'B'), E('B', 'C')]]
+        dates_to = core.DateInterval(dt(2016, 10, 10).date(), dt(2016, 10, 14).date())
+        self.use_transport(transport.Transport(session=backend))
+
+        all_solutions = list(core.get_solutions(paths, dates_to, concurrency=1))
+
+        for k in [1, 3, 10, 1000]:
+            result = core.get_cheapest_solutions(paths, dates_to, k, concurrency=1)
+            self.assertEqual([s.price for s in result], sorted(s.price for s in all_solutions)[:k])
+
+    def test_30(self):
+        """
+        get_cheapest_solutions: edges of paths that cannot beat the cheapest solutions are not requested
+
+        """
+        backend = FakeBackend({
+            E('A', 'C'): [('2016-10-10T07:00:00.000', '2016-10-10T09:00:00.000', 10)],
+            E('A', 'B'): [('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 50)],
+            E('B', 'C'): [('2016-10-10T11:30:00.000', '2016-10-10T13:00:00.000', 20)],
+        })
+        paths = [[E('A', 'C')], [E('A', 'B'), E('B', 'C')]]
+        dates_to = core.DateInterval(dt(2016, 10, 10).date(), dt(2016, 10, 12).date())
+        self.use_transport(transport.Transport(session=backend))
+
+        result = core.get_cheapest_solutions(paths, dates_to, 1, concurrency=1)
+
+        self.assertEqual([s.price for s in result], [10])
+        self.assertEqual(
+            {(params['Origin'], params['Destination']) for _, params in backend.calls},
+            {('A', 'C'), ('A', 'B')},
+        )
+
+    def test_31(self):
+        """
+        profile_scan: phases and counters of the scan are recorded
+
+        """
+        backend = FakeBackend({
+            E('A', 'B'): [('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 30)],
+            E('B', 'C'): [('2016-10-10T11:30:00.000', '2016-10-10T13:00:00.000', 20)],
+            E('A', 'C'): [('2016-10-09T07:00:00.000', '2016-10-09T09:00:00.000', 90)],
+        })
+        self.use_transport(transport.Transport(session=backend))
+
+        solutions, stats = core.profile_scan(
+            origs=['A'],
+            dests=['C'],
+            earliest_to=dt(2016, 10, 8).date(),
+            latest_to=dt(2016, 10, 12).date(),
+            max_flights=2,
+            get_network=lambda: self.network_abc,
+        )
+
+        data = stats.as_dict()
+
+        self.assertEqual(len(solutions), 2)
+        self.assertEqual(data['counters']['paths'], 2)
+        self.assertEqual(data['counters']['backend_requests'], 3)
+        self.assertEqual(data['counters']['http_requests'], 3)
+        self.assertEqual(data['counters']['flights_parsed'], 3)
+        self.assertEqual(data['counters']['combinations_accepted'], 2)
+        self.assertTrue(data['counters']['response_bytes'] > 0)
+        self.assertTrue({'network', 'paths', 'http', 'json', 'parse', 'join'} <= set(data['timings']))
+        self.assertEqual(data['timings']['http']['calls'], 3)
+
+    def test_32(self):
+        """
+        get_solutions (lazy): later legs are only requested around the arrivals of earlier legs,
+        and not at all after a leg without flights
+
+        """
+        backend = FakeBackend({
+            E('A', 'B'): [('2016-10-20T08:00:00.000', '2016-10-20T10:00:00.000', 30)],
+            E('B', 'C'): [
+                ('2016-10-20T11:30:00.000', '2016-10-20T13:00:00.000', 20),
+                ('2016-10-21T11:30:00.000', '2016-10-21T13:00:00.000', 20),
+            ],
+            E('D', 'C'): [('2016-10-20T11:30:00.000', '2016-10-20T13:00:00.000', 20)],
+        })
+        paths = [[E('A', 'B'), E('B', 'C')], [E('A', 'D'), E('D', 'C')]]
+        dates_to = core.DateInterval(dt(2016, 10, 10).date(), dt(2016, 10, 30).date())
+        self.use_transport(transport.Transport(session=backend))
+
+        eager = list(core.get_solutions(paths, dates_to, concurrency=1))
+        backend.calls = []
+        lazy = list(core.get_solutions(paths, dates_to, concurrency=1, lazy=True))
+
+        self.assertEqual(lazy, eager)
+        self.assertEqual(len(lazy), 1)
+        self.assertEqual(
+            sorted((params['Origin'], params['Destination'], params['DateOut'], params['FlexDaysOut']) for _, params in backend.calls),
+            [
+                ('A', 'B', '2016-10-10', 6),
+                ('A', 'B', '2016-10-17', 6),
+                ('A', 'B', '2016-10-24', 6),
+                ('A', 'D', '2016-10-10', 6),
+                ('A', 'D', '2016-10-17', 6),
+                ('A', 'D', '2016-10-24', 6),
+                ('B', 'C', '2016-10-20', 0),
+            ],
+        )
+
+    def test_33(self):
+        """
+        FlightStore: flights come back as they were added, also when added in several
+        batches, and joining over the store gives the same solutions as over lists
+
+        """
+        rnd = random.Random(2)
+        path = [E('A', 'B'), E('B', 'C')]
+        edge2flights = {
+            edge: [make_random_flight(rnd, edge)._replace(price=from_cents(rnd.randint(999, 9999))) for _ in range(30)]
+            for edge in path
+        }
+        store = FlightStore()
+
+        for edge in path:
+            store.add(edge2flights[edge][:10])
+            store.get(edge)
+            store.add(edge2flights[edge][10:])
+
+        self.assertEqual(store.flights(E('A', 'B')), edge2flights[E('A', 'B')])
+        self.assertEqual(len(store), 60)
+        self.assertEqual(store.get(E('B', 'C')).min_price(), min(to_cents(f.price) for f in edge2flights[E('B', 'C')]))
+
+        constraint = core.make_date_constraint(core.DateInterval(dt(2016, 1, 1).date(), dt(2016, 1, 6).date()))
+
+        self.assertEqual(
+            core.get_path_solutions(path, store, constraint),
+            core.get_path_solutions(path, edge2flights, constraint, are_flights_compatible=core.are_flights_compatible),
+        )
+
+    @skipIf(not vectorized.available, 'NumPy is not installed')
+    def test_34(self):
+        """
+        get_path_solutions: the python and numpy engines give exactly the same solutions,
+        also when pruning by price
+
+        """
+        rnd = random.Random(4)
+        path = [E('A', 'B'), E('B', 'C'), E('C', 'D'), E('D', 'E')]
+        store = FlightStore.from_mapping({
+            edge: [make_random_flight(rnd, edge) for _ in range(rnd.randint(20, 60))]
+            for edge in path
+        })
+        store.add_rows(E('E', 'F'), [])
+        constraint = DateConstraint(
+            earliest_out=dt(2016, 1, 2, 0, 0, 30),
+            latest_out=dt(2016, 1, 6, 23, 59, 59),
+            latest_in=dt(2016, 1, 7, 23, 59, 59),
+            min_between_flights=delta(minutes=45),
+            max_between_flights=delta(hours=6),
+        )
+
+        found = 0
+
+        for sub_path in [path[:1], path[:2], path[:3], path, path + [E('E', 'F')]]:
+            for max_price in [None, 150, 300]:
+                expected = core.get_path_solutions(sub_path, store, constraint, max_price=max_price, engine='python')
+                result = core.get_path_solutions(sub_path, store, constraint, max_price=max_price, engine='numpy')
+
+                self.assertEqual(expected, result)
+                found += len(result)
+
+        self.assertTrue(found)
+
+    def test_35(self):
+        """
+        parse_flights: rows have prices exact to the cent and dates in minutes, and sold
+        out flights and flights out of the date constraint are left out
+
+        """
+        data = make_availability_data('A', 'B', [
+            ('2016-10-09T23:00:00.000', '2016-10-10T01:00:00.000', 10.5),
+            ('2016-10-10T00:00:00.000', '2016-10-10T02:00:00.000', 29.99),
+            ('2016-10-11T22:30:00.000', '2016-10-11T23:59:59.000', 19.99),
+            ('2016-10-11T23:00:00.000', '2016-10-12T01:00:00.000', 12),
+        ])
+        data['trips'][0]['dates'][0]['flights'].append(dict(data['trips'][0]['dates'][0]['flights'][1], faresLeft=0))
+        constraint = core.make_date_constraint(core.DateInterval(dt(2016, 10, 10).date(), dt(2016, 10, 11).date()))
+
+        rows = core.parse_flights(data)
+        self.assertEqual([row[3] for row in rows], [1050, 2999, 1999, 1200])
+        self.assertEqual(rows[2][:3], (E('A', 'B'), to_minutes(dt(2016, 10, 11, 22, 30)), to_minutes(dt(2016, 10, 11, 23, 59))))
+
+        rows = core.parse_flights(data, constraint)
+        self.assertEqual([row[4] for row in rows], ['FR 1', 'FR 2'])
+        self.assertEqual(core.group_rows(rows + rows), {E('A', 'B'): [row[1:] for row in rows]})
+
+        for date_str in ['2016-02-29T07:05:09.000', '2016-10-10T10:00:00.250']:
+            self.assertEqual(core.parse_full_date(date_str), dt.strptime(date_str, '%Y-%m-%dT%H:%M:%S.%f'))
+
+    def test_36(self):
+        """
+        scan: round trips combine outbound and return solutions within the stay bounds,
+        fetching both directions of an edge with the same requests
+
+        """
+        backend = FakeBackend({
+            E('A', 'B'): [
+                ('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 30),
+                ('2016-10-12T08:00:00.000', '2016-10-12T10:00:00.000', 40),
+            ],
+            E('B', 'A'): [
+                ('2016-10-10T18:00:00.000', '2016-10-10T20:00:00.000', 25),
+                ('2016-10-13T18:00:00.000', '2016-10-13T20:00:00.000', 35),
+                ('2016-10-20T18:00:00.000', '2016-10-20T20:00:00.000', 15),
+            ],
+        })
+        self.use_transport(transport.Transport(session=backend))
+
+        solutions = core.scan(
+            ['A'],
+            ['B'],
+            dt(2016, 10, 10).date(),
+            dt(2016, 10, 12).date(),
+            earliest_back=dt(2016, 10, 10).date(),
+            latest_back=dt(2016, 10, 20).date(),
+            min_stay=1,
+            max_stay=3,
+            max_flights=1,
+            concurrency=1,
+            get_network=lambda: self.network_abc_round,
+        )
+
+        self.assertEqual(
+            [(s.date_out, s.inbound.date_out, s.price) for s in solutions],
+            [
+                (dt(2016, 10, 10, 8), dt(2016, 10, 13, 18), 65),
+                (dt(2016, 10, 12, 8), dt(2016, 10, 13, 18), 75),
+            ],
+        )
+        self.assertEqual(solutions[0].flights, solutions[0].outbound.flights + solutions[0].inbound.flights)
+        self.assertEqual(
+            sorted((p['Origin'], p['Destination'], p['RoundTrip'], p['DateOut'], p.get('DateIn')) for _, p in backend.calls),
+            [('A', 'B', 'true', '2016-10-10', '2016-10-11')],
+        )
+
+    def test_37(self):
+        """
+        join_round_trips: gives the same round trips as checking every pair
+
+        """
+        rnd = random.Random(5)
+        make = lambda edge: core.make_solution([make_random_flight(rnd, edge)])
+        outbound = [make(E(o, d)) for o, d in ['AB', 'AC', 'CA'] for _ in range(40)]
+        inbound = [make(E(o, d)) for o, d in ['BA', 'CA', 'AC'] for _ in range(40)]
+
+        for min_stay, max_stay in [(0, None), (0, 0), (1, 3), (2, 10)]:
+            expected = sorted(
+                core.make_round_trip(out, back)
+                for out in outbound
+                for back in inbound
+                if (back.orig, back.dest) == (out.dest, out.orig)
+                and back.date_out >= out.date_in + core.std_min_between_flights
+                and min_stay <= (back.date_out.date() - out.date_in.date()).days <= (max_stay if max_stay is not None else 1000)
+            )
+
+            self.assertEqual(sorted(core.join_round_trips(outbound, inbound, min_stay, max_stay)), expected)
+
+    def test_38(self):
+        """
+        scan_many: gives the same solutions as separate scans, requesting the shared
+        edges and dates only once
+
+        """
+        backend = FakeBackend({
+            E('A', 'B'): [('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 30)],
+            E('B', 'C'): [
+                ('2016-10-10T11:30:00.000', '2016-10-10T13:00:00.000', 20),
+                ('2016-10-11T11:30:00.000', '2016-10-11T13:00:00.000', 20),
+            ],
+            E('A', 'C'): [
+                ('2016-10-09T07:00:00.000', '2016-10-09T09:00:00.000', 90),
+                ('2016-10-12T07:00:00.000', '2016-10-12T09:00:00.000', 80),
+            ],
+            E('C', 'A'): [('2016-10-14T07:00:00.000', '2016-10-14T09:00:00.000', 70)],
+        })
+        queries = [
+            dict(origs=['A'], dests=['C'], earliest_to=dt(2016, 10, 8).date(), latest_to=dt(2016, 10, 12).date()),
+            dict(origs=['A'], dests=['B', 'C'], earliest_to=dt(2016, 10, 10).date(), latest_to=dt(2016, 10, 11).date(), max_flights=1),
+            dict(origs=['A'], dests=['C'], earliest_to=dt(2016, 10, 9).date(), latest_to=dt(2016, 10, 12).date(), top_k=1),
+            dict(
+                origs=['A'],
+                dests=['C'],
+                earliest_to=dt(2016, 10, 9).date(),
+                latest_to=dt(2016, 10, 12).date(),
+                earliest_back=dt(2016, 10, 13).date(),
+                latest_back=dt(2016, 10, 15).date(),
+            ),
+        ]
+        network = dict(self.network_abc, C={'A'})
+        self.use_transport(transport.Transport(session=backend))
+
+        expected = [core.scan(concurrency=1, get_network=lambda: network, **query) for query in queries]
+        separate_calls = len(backend.calls)
+        backend.calls = []
+        result = core.scan_many(queries, concurrency=1, get_network=lambda: network)
+
+        self.assertEqual(result, expected)
+        self.assertEqual([len(solutions) for solutions in result], [3, 1, 1, 3])
+        self.assertTrue(len(backend.calls) < separate_calls)
+        self.assertEqual(len(backend.calls), len({(p['Origin'], p['Destination']) for _, p in backend.calls}))
+
+    def test_39(self):
+        """
+        MemoryCache: entries expire after the ttl, and the least recently used are evicted
+
+        """
+        now = [1000.0]
+        cache = MemoryCache(ttl=60, max_entries=2, clock=lambda: now[0])
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+        now[0] += 61
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', ttl=120), 1)
+        self.assertEqual(cache.keys(), [])
+
+    def test_40(self):
+        """
+        CoalescingTransport: simultaneous identical requests are sent only once
+
+        """
+        release = threading.Event()
+        calls = []
+
+        class SlowTransport(object):
+            def get(self, url, params=None):
+                calls.append(url)
+                release.wait()
+                return {'url': url}
+
+        coalescing = transport.CoalescingTransport(SlowTransport())
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(coalescing.get('x', {'a': 1}))) for _ in range(5)]
+
+        for thread in threads:
+            thread.start()
+
+        while coalescing.coalesced < 4:
+            time.sleep(0.001)
+
+        release.set()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, ['x'])
+        self.assertEqual(results, [{'url': 'x'}] * 5)
+        self.assertEqual(coalescing.get('y'), {'url': 'y'})
+        self.assertEqual(calls, ['x', 'y'])
+
+    def test_41(self):
+        """
+        server: searches are answered like local scans, and repeated ones are served
+        from memory
+
+        """
+        backend = FakeBackend({
+            E('A', 'B'): [('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 30)],
+            E('B', 'C'): [('2016-10-10T11:30:00.000', '2016-10-10T13:00:00.000', 20)],
+            E('A', 'C'): [('2016-10-12T07:00:00.000', '2016-10-12T09:00:00.000', 80)],
+        })
+        app = server.App(concurrency=1)
+        app.network = server.Snapshot(lambda: self.network_abc)
+        app.airport_index = server.Snapshot(lambda: AirportIndex({
+            'AAA': {'name': 'Alpha', 'country': 'Spain'},
+            'BBB': {'name': 'Beta', 'country': 'Germany'},
+        }))
+        httpd = server.make_server(app, port=0)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        self.use_transport(transport.Transport(session=backend))
+
+        try:
+            client = server.Client('http://127.0.0.1:%s' % httpd.server_port)
+            spec = dict(origins='A', destinations=['C'], earliest_to='2016-10-08', latest_to='2016-10-12', max_flights=2)
+            first = client.find_flights(spec)
+            calls = len(backend.calls)
+            second = client.find_flights(spec)
+
+            self.assertEqual(client.find_airports(['spa']), [('AAA', {'name': 'Alpha', 'country': 'Spain'})])
+
+            with self.assertRaises(core.AppError):
+                client.find_flights(dict(spec, earliest_to='tomorrow'))
+
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+
+        self.assertEqual([(s.date_out, s.price, len(s.flights)) for s in first], [(dt(2016, 10, 10, 8), 50, 2), (dt(2016, 10, 12, 7), 80, 1)])
+        self.assertEqual(first, second)
+        self.assertEqual(len(backend.calls), calls)
+
+    def test_42(self):
+        """
+        Watcher: reports only the solutions added, removed or repriced since the last
+        poll, requesting only expired responses and joining only the changed paths
+
+        """
+        flights_ac = [
+            ('2016-10-09T07:00:00.000', '2016-10-09T09:00:00.000', 90),
+            ('2016-10-12T07:00:00.000', '2016-10-12T09:00:00.000', 80),
+        ]
+        backend = FakeBackend({
+            E('A', 'B'): [('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 30)],
+            E('B', 'C'): [('2016-10-10T11:30:00.000', '2016-10-10T13:00:00.000', 20)],
+            E('A', 'C'): flights_ac,
+        })
+        now = [1000.0]
+        stats = Stats()
+        watcher = Watcher(
+            dict(origs=['A'], dests=['C'], earliest_to=dt(2016, 10, 8).date(), latest_to=dt(2016, 10, 12).date()),
+            concurrency=1,
+            cache=MemoryCache(ttl=60, clock=lambda: now[0]),
+            stats=stats,
+            get_network=lambda: self.network_abc,
+        )
+        self.use_transport(transport.Transport(session=backend))
+
+        first = watcher.poll()
+        calls = len(backend.calls)
+
+        self.assertEqual(watcher.poll(), Changes([], [], []))
+        self.assertEqual(len(backend.calls), calls)
+
+        flights_ac[:] = [
+            ('2016-10-09T07:00:00.000', '2016-10-09T09:00:00.000', 70),
+            ('2016-10-11T07:00:00.000', '2016-10-11T09:00:00.000', 60),
+        ]
+        stats.counters.clear()
+        now[0] += 61
+        third = watcher.poll()
+
+        self.assertEqual([(s.date_out, s.price) for s in first.added], [(dt(2016, 10, 9, 7), 90), (dt(2016, 10, 10, 8), 50), (dt(2016, 10, 12, 7), 80)])
+        self.assertEqual(first.removed + first.repriced, [])
+        self.assertEqual([(s.date_out, s.price) for s in third.added], [(dt(2016, 10, 11, 7), 60)])
+        self.assertEqual([(s.date_out, s.price) for s in third.removed], [(dt(2016, 10, 12, 7), 80)])
+        self.assertEqual([(old.price, new.price) for old, new in third.repriced], [(90, 70)])
+        self.assertEqual(len(backend.calls), 2 * calls)
+        self.assertEqual(stats.counters['paths_reused'], 1)
+
+    def test_43(self):
+        """
+        RateLimiter: the pace increases with fast successful responses, halves once per
+        overload, and pauses for as long as Retry-After asks
+
+        """
+        now = [1000.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = transport.RateLimiter(rate=2, concurrency_limit=2, clock=lambda: now[0], sleep=sleep)
+
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(now[0])
+
+        self.assertEqual(len(sleeps), 2)
+        self.assertTrue(0 < sum(sleeps) < 1)
+        self.assertTrue(limiter.rate > 2 and limiter.concurrency_limit > 2)
+
+        # Two requests in flight throttled by the same overload
+        rate = limiter.rate
+        limiter.acquire()
+        limiter.acquire()
+        start = now[0]
+        limiter.release(start, throttled=True, retry_after=10)
+        limiter.release(start, throttled=True)
+
+        self.assertEqual(limiter.rate, rate / 2)
+        self.assertEqual(int(limiter.concurrency_limit), 1)
+        self.assertEqual(limiter.throttled, 2)
+
+        del sleeps[:]
+        limiter.acquire()
+        self.assertEqual(sleeps, [10])
+
+        # Slow responses count as overload
+        limiter.release(now[0] - transport.std_slow_latency - 1)
+        self.assertEqual(limiter.rate, rate / 4)
+
+    def test_44(self):
+        """
+        Transport: throttled requests are retried after the time in Retry-After, and
+        the pace of its limiter is recorded in the stats
+
+        """
+        session = FakeSession([FakeResponse(429, headers={'Retry-After': '7'}), FakeResponse(200, {'ok': 1})])
+        delays = []
+        now = [1000.0]
+        limiter = transport.RateLimiter(rate=5, clock=lambda: now[0], sleep=lambda x: None)
+
+        def sleep(seconds):
+            delays.append(seconds)
+            now[0] += seconds
+
+        t = transport.Transport(session=session, sleep=sleep, limiter=limiter)
+        stats = Stats()
+
+        self.assertEqual(core.get_json('http://backend', transport=t, stats=stats), {'ok': 1})
+        self.assertEqual(delays, [7])
+        self.assertEqual(stats.counters['requests_throttled'], 1)
+        self.assertEqual(stats.counters['request_rate'], round(limiter.rate, 2))
+        self.assertEqual(transport.get_retry_after(FakeResponse(503)), None)
+        self.assertEqual(
+            transport.get_retry_after(FakeResponse(503, headers={'Retry-After': 'Wed, 21 Oct 2015 07:28:30 GMT'}), clock=lambda: 1445412500),
+            10,
+        )
+
+    def test_45(self):
+        """
+        AirportIndex: terms match the beginning of the words of the code, name, city or
+        country, regardless of case and accents, and the best matches come first
+
+        """
+        index = AirportIndex({
+            'AGP': {'name': 'Málaga', 'country': 'ES', 'city': 'Málaga'},
+            'MAD': {'name': 'Madrid', 'country': 'ES'},
+            'BER': {'name': 'Berlin Brandenburg', 'country': 'DE', 'city': 'Berlin'},
+            'BRE': {'name': 'Bremen', 'country': 'DE'},
+            'SXF': {'name': 'Schönefeld', 'country': 'DE', 'city': 'Berlin'},
+        })
+        search = lambda *terms: [iata for iata, _ in index.search(terms)]
+
+        self.assertEqual(search('MALAGA'), ['AGP'])
+        self.assertEqual(search('ma'), ['MAD', 'AGP'])
+        self.assertEqual(search('mad'), ['MAD'])
+        self.assertEqual(search('berlin'), ['BER', 'SXF'])
+        self.assertEqual(search('schonefeld', 'bre'), ['BRE', 'SXF'])
+        self.assertEqual(search('berlin bra'), ['BER'])
+        self.assertEqual(search('es'), ['MAD', 'AGP'])
+        self.assertEqual(search('lin'), [])
+        self.assertEqual(search(), ['BER', 'BRE', 'MAD', 'AGP', 'SXF'])
+
+        # Kept in the cache, and built again once the stations change
+        now = [1000.0]
+        cache = DiskCache(self.make_tmp_path('cache.sqlite'), clock=lambda: now[0])
+        cache.set('stations', index.airports)
+        self.assertEqual(core.get_airport_index(cache).entries, index.entries)
+
+        now[0] += core.std_network_ttl + 1
+        cache.set('stations', dict(index.airports, STN={'name': 'London Stansted', 'country': 'GB'}))
+        self.assertEqual([iata for iata, _ in core.get_airport_index(cache).search(['london'])], ['STN'])
+
+    def test_46(self):
+        """
+        parse_args: same arguments as docopt, whether the usage pattern is built or
+        read from the cache
+
+        """
+        from docopt import docopt
+        from docopt import DocoptExit
+
+        cache_dir = os.path.dirname(self.make_tmp_path('usage'))
+        argvs = [
+            ['find-airports', 'bremen', 'valencia'],
+            ['find-airports', 'bremen', '--replay=airports.archive', '--no-cache'],
+            ['find-flights', 'BRE,HAM', 'VLC', '2016-10-20', '2016-10-25', '-m', '2', '--top=3', '--json'],
+            ['find-flights', 'BRE', 'VLC', '2016-10-20', '2016-10-25', '2016-10-27', '2016-11-02', '--max-stay=7'],
+            ['watch', 'BRE', 'VLC', '2016-10-20', '2016-10-25', '--interval=60', '--no-cache'],
+            ['serve', '--socket=/tmp/ryanscan.sock'],
+            ['refresh-network'],
+        ]
+
+        for cached in [False, True]:
+            usage._specs.clear()
+
+            for argv in argvs:
+                self.assertEqual(usage.parse_args(cli.__doc__, argv, cache_dir), docopt(cli.__doc__, argv))
+
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+            with self.assertRaises(DocoptExit):
+                usage.parse_args(cli.__doc__, ['find-flights', 'BRE'], cache_dir)
+
+    def test_47(self):
+        """
+        parallel.get_paths_solutions: same solutions as the join in a single process,
+        in the order of scan, and with the counters of all the shards. The worker
+        processes are kept for the following joins
+
+        """
+        self.addCleanup(parallel.close_pool)
+        rnd = random.Random(6)
+        edges = [E('A', 'B'), E('B', 'C'), E('A', 'C'), E('C', 'D'), E('B', 'D'), E('A', 'D')]
+        store = FlightStore.from_mapping({
+            edge: [make_random_flight(rnd, edge, start=dt(2016, 1, 1, 0, 0))._replace(date_out=dt(2016, 1, 2, 10, 0)) for _ in range(3)]
+            + [make_random_flight(rnd, edge) for _ in range(rnd.randint(10, 30))]
+            for edge in edges
+        })
+        paths = [
+            [E('A', 'D')],
+            [E('A', 'B'), E('B', 'D')],
+            [E('A', 'C'), E('C', 'D')],
+            [E('A', 'B'), E('B', 'C'), E('C', 'D')],
+            [E('A', 'X')],
+        ]
+        constraint = DateConstraint(
+            earliest_out=dt(2016, 1, 1),
+            latest_out=dt(2016, 1, 7, 23, 59, 59),
+            latest_in=dt(2016, 1, 7, 23, 59, 59),
+            min_between_flights=delta(minutes=45),
+            max_between_flights=delta(hours=6),
+        )
+        expected_stats = Stats()
+        expected = sorted(core.get_paths_solutions(paths, store, constraint, stats=expected_stats), key=core.get_solution_order)
+        self.assertTrue(len(expected) > 10)
+
+        pools = []
+
+        for processes in [2, 3, 3]:
+            stats = Stats()
+            result = core.get_paths_solutions(paths, store, constraint, stats=stats, processes=processes)
+            pools.append(parallel.get_pool(processes))
+
+            self.assertEqual(result, expected)
+            self.assertEqual(stats.counters, expected_stats.counters)
+
+        self.assertIsNot(pools[0], pools[1])
+        self.assertIs(pools[1], pools[2])
+
+        with self.assertRaises(core.AppError):
+            cli.find(['A'], ['D'], dt(2016, 1, 1).date(), dt(2016, 1, 2).date(), 2, server_address='unix:/nope', processes=2)
+
+        shards = parallel.make_shards(paths, store, 2)
+        self.assertEqual(len(shards), 2)
+        self.assertEqual(sorted(item for shard in shards for item in shard), list(enumerate(paths)))
+
+    def test_48(self):
+        """
+        ExternalSorter: same order as a stable in-memory sort for every key, also
+        when the solutions are spilled to disk in several runs and these are merged
+
+        """
+        rnd = random.Random(7)
+        edges = [E('A', 'B'), E('B', 'C'), E('C', 'A')]
+        solutions = [
+            core.make_solution([make_random_flight(rnd, edge)._replace(price=rnd.randint(1, 5)) for edge in edges[:rnd.randint(1, 3)]])
+            for _ in range(300)
+        ]
+        solutions.append(core.make_round_trip(solutions[0], solutions[1]))
+        self.assertEqual(sorting.get_layovers(solutions[-1]), len(solutions[0].flights) + len(solutions[1].flights) - 2)
+
+        for key, get_key in sorting.sort_keys.items():
+            expected = sorted(solutions, key=get_key)
+
+            self.assertEqual(list(sorting.sort_solutions(solutions, key)), expected)
+
+            # More runs than max_runs are left, so the smallest are merged when read
+            sorter = sorting.ExternalSorter(key, max_memory=16000, max_runs=4)
+            sorter.extend(solutions)
+            self.assertEqual([level for level, _ in sorter._runs], [1, 1, 1, 0, 0, 0])
+            self.assertEqual(list(sorter), expected)
+
+        with self.assertRaises(ValueError):
+            sorting.ExternalSorter('nope')
+
+    def test_49(self):
+        """
+        RecordingTransport and ReplayTransport: a scan replayed from an archive gives the
+        same solutions without requests to the backend, and requests missing from the
+        archive fail
+
+        """
+        rnd = random.Random(8)
+        backend = FakeBackend({
+            edge: [make_random_availability(rnd, dt(2016, 10, 10)) for _ in range(20)]
+            for edge in [E('A', 'B'), E('B', 'C'), E('A', 'C')]
+        })
+        scan_args = dict(
+            origs=['A'],
+            dests=['C'],
+            earliest_to=dt(2016, 10, 10).date(),
+            latest_to=dt(2016, 10, 14).date(),
+            max_flights=2,
+            get_network=lambda: self.network_abc,
+        )
+        path = self.make_tmp_path('scan.archive')
+        recorder = archive.RecordingTransport(transport.Transport(session=backend), archive.Archive(path))
+        self.addCleanup(recorder.close)
+        self.use_transport(recorder)
+
+        recorded = core.scan(**scan_args)
+        calls = len(backend.calls)
+        recorder.close()
+
+        player = archive.ReplayTransport(archive.Archive(path))
+        self.use_transport(player)
+
+        self.assertEqual(core.scan(**scan_args), recorded)
+        self.assertEqual(len(backend.calls), calls)
+        self.assertEqual(player.replayed, recorder.recorded)
+
+        with self.assertRaises(core.AppError):
+            core.scan(**dict(scan_args, latest_to=dt(2016, 10, 30).date()))
+
+        self.assertTrue(recorded)
+
+        with self.assertRaises(IOError):
+            archive.Archive(self.make_tmp_path('missing.archive')).load()
+
+    def test_50(self):
+        """
+        get_transport: threads asking for the default transport at the same time all
+        get the same one, and so share its rate limiter
+
+        """
+        self.use_transport(None)
+        barrier = threading.Event()
+        transports = []
+
+        def get():
+            barrier.wait()
+            transports.append(transport.get_transport())
+
+        threads = [threading.Thread(target=get) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        barrier.set()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(transports), 8)
+        self.assertEqual(len({id(t) for t in transports}), 1)
+
+    def test_51(self):
+        """
+        scan: solutions departing at the same time come in the same order whichever
+        backend responses arrive first
+
+        """
+        edge2flights = {
+            E('A', 'B'): [('2016-10-10T08:00:00.000', '2016-10-10T09:00:00.000', 30)],
+            E('B', 'C'): [('2016-10-10T10:30:00.000', '2016-10-10T12:00:00.000', 20)],
+            E('A', 'C'): [('2016-10-10T08:00:00.000', '2016-10-10T10:00:00.000', 90)],
+        }
+        results = []
+
+        for slow_origin in ['A', 'B']:
+            backend = DelayedBackend(edge2flights, {slow_origin: 0.05})
+            self.use_transport(transport.Transport(session=backend))
+
+            results.append(core.scan(
+                origs=['A'],
+                dests=['C'],
+                earliest_to=dt(2016, 10, 10).date(),
+                latest_to=dt(2016, 10, 10).date(),
+                max_flights=2,
+                concurrency=3,
+                get_network=lambda: self.network_abc,
+            ))
+
+        self.assertEqual([len(s.flights) for s in results[0]], [2, 1])
+        self.assertEqual(results[0], results[1])
+
+    def test_52(self):
+        """
+        FlightStore: rows are stored by their order whichever arrives first, and a
+        unique store keeps repeated flights once, the first by order
+
+        """
+        store = FlightStore(unique=True)
+        store.add_rows(E('A', 'B'), [(10, 20, 100, 'FR 2'), (5, 15, 100, 'FR 1')], order=2)
+        store.add_rows(E('A', 'B'), [(10, 20, 150, 'FR 2'), (30, 40, 100, 'FR 3')], order=1)
+
+        self.assertEqual(
+            [(f.flight_number, to_cents(f.price)) for f in store.flights(E('A', 'B'))],
+            [('FR 2', 150), ('FR 3', 100), ('FR 1', 100)],
+        )
+
+    def test_53(self):
+        """
+        read_queries: ids name the result files, so repeated ones and ones with path
+        separators are rejected
+
+        """
+        spec = {'origins': 'A', 'destinations': 'B', 'earliest_to': '2016-10-10', 'latest_to': '2016-10-12'}
+        path = self.make_tmp_path('queries.json')
+
+        for ids, error in [
+            (['x', None], None),
+            (['x', 'x'], 'Duplicate search id: x'),
+            (['2', None], 'Duplicate search id: 2'),
+            (['../x'], 'Invalid search id: ../x'),
+            (['a\\b'], 'Invalid search id: a\\b'),
+        ]:
+            with open(path, 'w') as f:
+                json.dump([dict(spec, id=query_id) for query_id in ids], f)
+
+            if error is None:
+                self.assertEqual(cli.read_queries(path, 2)[0], ['x', '2'])
+                continue
+
+            with self.assertRaises(core.AppError) as ctx:
+                cli.read_queries(path, 2)
+
+            self.assertEqual(ctx.exception.msg, error)
+
+    def test_54(self):
+        """
+        top: less than 1 cheapest solutions is an error, instead of a scan without limit
+
+        """
+        spec = {'origins': 'A', 'destinations': 'B', 'earliest_to': '2016-10-10', 'latest_to': '2016-10-12'}
+
+        self.assertEqual(core.make_query(dict(spec, top='3'))['top_k'], 3)
+        self.assertIsNone(core.make_query(dict(spec, top=''))['top_k'])
+        self.assertEqual(cli.parse_top('3'), 3)
+        self.assertIsNone(cli.parse_top(None))
+
+        for top in ['0', '-1']:
+            with self.assertRaises(core.AppError):
+                core.make_query(dict(spec, top=top))
+
+            with self.assertRaises(core.AppError):
+                cli.parse_top(top)
+
+        with self.assertRaises(core.AppError):
+            core.scan(['A'], ['C'], dt(2016, 10, 10).date(), dt(2016, 10, 10).date(), top_k=0, get_network=lambda: self.network_abc)
+
+    def test_55(self):
+        """
+        scan and find: lazy scans of the cheapest solutions or of round trips are
+        rejected instead of running eagerly
+
+        """
+        day = dt(2016, 10, 10).date()
+
+        for extra in [dict(top_k=3), dict(earliest_back=dt(2016, 10, 12).date())]:
+            with self.assertRaises(core.AppError):
+                core.scan(['A'], ['C'], day, day, lazy=True, get_network=lambda: self.network_abc, **extra)
+
+            with self.assertRaises(core.AppError):
+                cli.find(['A'], ['C'], day, day, 2, lazy=True, server_address='unix:/nope', **extra)
+
+        core.check_lazy(True)
+        core.check_lazy(False, top_k=3, earliest_back=day)
+
+    def test_56(self):
+        """
+        find-flights: --profile is rejected with --server, where the scan is not timed
+
+        """
+        from docopt import docopt
+
+        args = docopt(cli.__doc__, ['find-flights', 'A', 'C', '2016-10-10', '2016-10-11', '--profile', '--server=unix:/nope'])
+
+        with self.assertRaises(core.AppError) as ctx:
+            cli.run_command(args)
+
+        self.assertEqual(ctx.exception.msg, '--profile cannot be used with --server')
+
+    def test_57(self):
+        """
+        scan: a date range ending before it starts finds nothing in every mode,
+        also when looking for the cheapest solutions
+
+        """
+        scan_args = dict(
+            origs=['A'],
+            dests=['C'],
+            earliest_to=dt(2016, 1, 5).date(),
+            latest_to=dt(2016, 1, 2).date(),
+            concurrency=1,
+            get_network=lambda: self.network_abc,
+        )
+
+        for extra in [dict(), dict(top_k=2), dict(lazy=True)]:
+            self.assertEqual(core.scan(**dict(scan_args, **extra)), [])
+
+    def test_58(self):
+        """
+        CheapestSolutions: of the solutions tied in price, it keeps the ones that scan
+        sorts first, whatever order they are added in
+
+        """
+        rnd = random.Random(8)
+        edges = [E('A', 'B'), E('B', 'C')]
+        solutions = [
+            core.make_solution([make_random_flight(rnd, edge)._replace(price=10, flight_number=rnd.choice('xyz')) for edge in edges[:rnd.randint(1, 2)]])
+            for _ in range(40)
+        ]
+        # Same departure and flight number, only their airports tell them apart
+        solutions.extend(core.make_solution([make_flight(orig='A', dest=dest, date_out=dt(2015, 12, 31), price=10)]) for dest in 'BCD')
+        expected = sorted(solutions, key=lambda s: (s.price, core.get_solution_order(s)))[:5]
+        self.assertEqual(expected[0].dest, 'B')
+
+        for _ in range(5):
+            rnd.shuffle(solutions)
+            cheapest = core.CheapestSolutions(5)
+
+            for solution in solutions:
+                cheapest.add(solution)
+
+            self.assertEqual(cheapest.get_solutions(), expected)
+
+    @skipIf(not hasattr(socket, 'AF_UNIX'), 'No Unix sockets')
+    def test_59(self):
+        """
+        make_server: a socket left behind is replaced, but any other file at the
+        socket path is kept
+
+        """
+        path = self.make_tmp_path('server.sock')
+
+        with open(path, 'w') as f:
+            f.write('precious')
+
+        with self.assertRaises(core.AppError):
+            server.make_server(server.App(), socket_path=path)
+
+        with open(path) as f:
+            self.assertEqual(f.read(), 'precious')
+
+        os.remove(path)
+        stale = server.make_server(server.App(), socket_path=path)
+        stale.server_close()
+        httpd = server.make_server(server.App(), socket_path=path)
+        httpd.server_close()
+
+        self.assertEqual(server.get_file_id(path), httpd.socket_id)
+
+    def test_60(self):
+        """
+        find-airports: searches with the stations of an archive, and --record and
+        --replay together are an error with a reason
+
+        """
+        stations = {'BRE': {'name': 'Bremen', 'country': 'Germany'}}
+        path = self.make_tmp_path('airports.archive')
+        recorder = archive.RecordingTransport(transport.Transport(session=FakeSession([FakeResponse(200, stations)])), archive.Archive(path))
+        recorder.get('https://desktopapps.ryanair.com/en-ie/res/stations')
+        recorder.close()
+
+        cli._main(['find-airports', 'brem', '--replay=%s' % path])
+
+        with self.assertRaises(core.AppError) as ctx:
+            cli._main(['find-airports', '--record=%s' % path, '--replay=%s' % path])
+
+        self.assertTrue(ctx.exception.details)
+
+    def test_61(self):
+        """
+        scan: misspelled arguments fail right away, before anything is fetched
+
+        """
+        def get_network():
+            raise AssertionError('Network requested')
+
+        with self.assertRaises(TypeError):
+            core.scan(['A'], ['C'], dt(2016, 10, 10).date(), dt(2016, 10, 10).date(), topk=2, get_network=get_network)
+
+    def test_62(self):
+        """
+        FlightStore.subset: keeps the flights of its edges, and only their flight numbers
+
+        """
+        rnd = random.Random(5)
+        edges = [E('A', 'B'), E('B', 'C'), E('C', 'D')]
+        store = FlightStore.from_mapping({edge: [make_random_flight(rnd, edge) for _ in range(20)] for edge in edges})
+        store.add([make_flight('A', 'B', flight_number='x1'), make_flight('C', 'D', flight_number='x2')])
+        subset = store.subset([E('A', 'B'), E('X', 'Y')])
+
+        self.assertEqual(subset.edges(), {E('A', 'B')})
+        self.assertEqual(subset.flights(E('A', 'B')), store.flights(E('A', 'B')))
+        self.assertEqual(set(subset._flight_numbers), {f.flight_number for f in store.flights(E('A', 'B'))})
+        self.assertNotIn('x2', subset._flight_numbers)
+
+        store.add([make_flight('A', 'B', flight_number='x3')])
+
+        self.assertEqual(len(subset), 21)
+
+    def test_63(self):
+        """
+        MemoryCache.keys: finds keys by any prefix through the index, which follows
+        replaced, deleted and evicted entries
+
+        """
+        now = [1000.0]
+        cache = MemoryCache(ttl=60, max_entries=4, clock=lambda: now[0])
+
+        cache.set('availability:A:B:x=1', 1)
+        cache.set('availability:A:B:x=2', 2)
+        cache.set('availability:A:C:x=1', 3)
+        cache.set('availability:A:B:x=1', 4)
+        cache.set('airport-index', 5)
+
+        self.assertEqual(sorted(cache.keys('availability:A:B:')), ['availability:A:B:x=1', 'availability:A:B:x=2'])
+        self.assertEqual(cache.keys('availability:A:B:x=2'), ['availability:A:B:x=2'])
+        self.assertEqual(cache.keys('availability:A:C'), ['availability:A:C:x=1'])
+        self.assertEqual(len(cache.keys('a')), 4)
+
+        cache.delete('availability:A:B:x=2')
+        cache.set('availability:B:C:x=1', 6)
+        cache.set('availability:B:C:x=2', 7)
+        cache.set('availability:B:C:x=3', 8)
+
+        self.assertEqual(cache.keys('availability:A:'), [])
+        self.assertEqual(sorted(cache._prefixes), ['availability:', 'availability:B:', 'availability:B:C:'])
+
+        now[0] += 61
+        self.assertEqual(cache.keys('availability:'), [])
+
+    network_abc_round = {
+        'A': {'B'},
+        'B': {'A'},
+    }
+
+    network_abc = {
+        'A': {'B', 'C'},
+        'B': {'C'},
+        'C': set(),
+    }
+
+    def use_transport(self, new_transport):
+        self.addCleanup(transport.set_transport, transport.set_transport(new_transport))
+
+    def make_tmp_path(self, name):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        return os.path.join(directory, name)
+
+
+def make_random_flight(rnd, edge, start=dt(2016, 1, 1)):
+    date_out = start + delta(minutes=5 * rnd.randint(0, 12 * 24 * 6))
+
+    return make_flight(
+        orig=edge.orig,
+        dest=edge.dest,
+        date_out=date_out,
+        date_in=date_out + delta(minutes=5 * rnd.randint(6, 36)),
+        price=rnd.randint(10, 200),
+    )
+
+
+def make_random_availability(rnd, start):
+    """
+    Random flight in the format used by FakeBackend, departing at most 5 days after `start`
+
+    """
+    date_out = start + delta(minutes=5 * rnd.randint(0, 12 * 24 * 5 - 1))
+    date_in = date_out + delta(minutes=5 * rnd.randint(6, 36))
+    fmt = '%Y-%m-%dT%H:%M:%S.000'
+
+    return date_out.strftime(fmt), date_in.strftime(fmt), rnd.randint(10, 200)
+
 
 def return_true(*args, **kwargs):
     return True
 
 
+def make_availability_data(orig, dest, flights):
+    """
+    Builds a payload with the shape of the backend availability response
+
+    :param flights: list of (time out, time in, price) tuples
+
+    """
+    return {
+        'trips': [{
+            'origin': orig,
+            'destination': dest,
+            'dates': [{
+                'flights': [
+                    {
+                        'time': [time_out, time_in],
+                        'faresLeft': 5,
+                        'flightNumber': 'FR %s' % n,
+                        'regularFare': {'fares': [{'amount': price}]},
+                    }
+                    for n, (time_out, time_in, price) in enumerate(flights)
+                ],
+            }],
+        }],
+    }
+
+
+class FakeBackend(object):
+    """
+    Fake session answering availability requests from a dict of edge to flights
+
+    """
+
+    def __init__(self, edge2flights):
+        self.edge2flights = edge2flights
+        self.calls = []
+
+    def get(self, url, params=None, **kwargs):
+        self.calls.append((url, params))
+        data = self.get_trip_data(params['Origin'], params['Destination'], params['DateOut'], params['FlexDaysOut'])
+
+        if params['RoundTrip'] == 'true':
+            data['trips'].extend(
+                self.get_trip_data(params['Destination'], params['Origin'], params['DateIn'], params['FlexDaysIn'])['trips']
+            )
+
+        return FakeResponse(200, data)
+
+    def get_trip_data(self, orig, dest, date_from, flex_days):
+        date_from = tools.parse_isodate(date_from)
+        date_until = date_from + delta(days=flex_days)
+        flights = [
+            f for f in self.edge2flights.get(E(orig, dest), [])
+            if date_from <= tools.parse_isodate(f[0][:10]) <= date_until
+        ]
+
+        return make_availability_data(orig, dest, flights)
+
+
+class DelayedBackend(FakeBackend):
+    """
+    FakeBackend answering later the requests from some airports
+
+    """
+
+    def __init__(self, edge2flights, origin2delay):
+        FakeBackend.__init__(self, edge2flights)
+        self.origin2delay = origin2delay
+
+    def get(self, url, params=None, **kwargs):
+        time.sleep(self.origin2delay.get(params['Origin'], 0))
+        return FakeBackend.get(self, url, params, **kwargs)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.ok = status_code < 400
+        self.data = data
+        self.text = json.dumps(data)
+        self.content = self.text.encode('utf-8')
+
+    def json(self):
+        return self.data
+
+
+class FakeSession(object):
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        self.calls.append((url, kwargs))
+        return self.responses.pop(0)
+
+
 def make_flight(orig='A', dest='B', date_out=dt(2016, 1, 1, 10, 30), date_in=dt(2016, 1, 1, 13, 30), price=100, flight_number='abc'):
     return F(**locals())